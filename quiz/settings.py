@@ -27,6 +27,90 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 
 XENOCANTO_API_KEY = os.getenv("XENOCANTO_API_KEY")
 
+# Token bucket per media provider (requests per second, burst), shared by every process through the database
+PROVIDER_RATE_LIMITS = {
+    "inaturalist": {
+        "rate": float(os.getenv("INATURALIST_RATE", 1)),
+        "burst": int(os.getenv("INATURALIST_BURST", 1)),
+    },
+    "xenocanto": {
+        "rate": float(os.getenv("XENOCANTO_RATE", 1)),
+        "burst": int(os.getenv("XENOCANTO_BURST", 1)),
+    },
+}
+
+# Circuit breaker: after this many failed calls in a row, a provider is skipped for PROVIDER_COOLDOWN seconds
+PROVIDER_FAILURE_THRESHOLD = int(os.getenv("PROVIDER_FAILURE_THRESHOLD", 5))
+PROVIDER_COOLDOWN = float(os.getenv("PROVIDER_COOLDOWN", 60))
+
+# Maximum seconds a single page request may spend on provider calls
+OUTBOUND_BUDGET_SECONDS = float(os.getenv("OUTBOUND_BUDGET_SECONDS", 20))
+
+# Days before a provider's media of a taxon is refreshed; stale media is still served while a background
+# refresh replaces it
+MEDIA_TTL_DAYS = {
+    "inaturalist": float(os.getenv("INATURALIST_MEDIA_TTL_DAYS", 30)),
+    "xenocanto": float(os.getenv("XENOCANTO_MEDIA_TTL_DAYS", 90)),
+}
+
+# A provider with nothing for a taxon is asked again after MEDIA_MISS_RETRY_HOURS, doubling after each further
+# empty answer up to MEDIA_MISS_RETRY_MAX_DAYS
+MEDIA_MISS_RETRY_HOURS = float(os.getenv("MEDIA_MISS_RETRY_HOURS", 1))
+MEDIA_MISS_RETRY_MAX_DAYS = float(os.getenv("MEDIA_MISS_RETRY_MAX_DAYS", 30))
+
+# A provider whose refresh of a taxon failed is asked again after MEDIA_FAILURE_RETRY_MINUTES, doubling after each
+# further failure up to MEDIA_FAILURE_RETRY_MAX_HOURS; the current media is served meanwhile
+MEDIA_FAILURE_RETRY_MINUTES = float(os.getenv("MEDIA_FAILURE_RETRY_MINUTES", 5))
+MEDIA_FAILURE_RETRY_MAX_HOURS = float(os.getenv("MEDIA_FAILURE_RETRY_MAX_HOURS", 6))
+
+# Single-flight media fetches: a fetch lease expires after MEDIA_FETCH_LEASE_SECONDS (crashed process), and
+# concurrent requests for the same taxon wait at most MEDIA_FETCH_WAIT seconds for the fetch in progress
+MEDIA_FETCH_LEASE_SECONDS = float(os.getenv("MEDIA_FETCH_LEASE_SECONDS", 60))
+MEDIA_FETCH_WAIT = float(os.getenv("MEDIA_FETCH_WAIT", 15))
+
+# Outbound HTTP connection pool: hosts kept, keep-alive connections per host, and total size of the response bodies
+# kept per process for ETag revalidation (their decoded JSON takes a few times more memory)
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", 10))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 10))
+HTTP_ETAG_CACHE_BYTES = int(os.getenv("HTTP_ETAG_CACHE_BYTES", 8 * 1024 * 1024))
+
+# Optional on-disk cache of provider JSON responses (disabled when PROVIDER_CACHE_PATH is empty), shared by the
+# views and the management commands. Responses expire per endpoint after PROVIDER_CACHE_TTL_DAYS (endpoints not
+# listed are not cached) and the least recently used ones are evicted past PROVIDER_CACHE_MAX_BYTES (compressed).
+# With PROVIDER_CACHE_OFFLINE, only cached responses are replayed (any age) and nothing goes to the network.
+PROVIDER_CACHE_PATH = os.getenv("PROVIDER_CACHE_PATH", "")
+PROVIDER_CACHE_MAX_BYTES = int(os.getenv("PROVIDER_CACHE_MAX_BYTES", 256 * 1024**2))
+PROVIDER_CACHE_OFFLINE = bool(os.getenv("PROVIDER_CACHE_OFFLINE", False))
+PROVIDER_CACHE_TTL_DAYS = {
+    "api.inaturalist.org/v1/taxa/autocomplete": float(os.getenv("INATURALIST_TAXA_CACHE_TTL_DAYS", 180)),
+    "api.inaturalist.org/v1/observations": float(os.getenv("INATURALIST_OBSERVATIONS_CACHE_TTL_DAYS", 7)),
+    "xeno-canto.org/api/3/recordings": float(os.getenv("XENOCANTO_CACHE_TTL_DAYS", 30)),
+}
+# Query parameters left out of the cache keys (API keys)
+PROVIDER_CACHE_IGNORED_PARAMS = {"key"}
+
+# Optional local mirror of provider photos (disabled when MEDIA_MIRROR_ROOT is empty), capped in size with LRU
+# eviction. With MEDIA_MIRROR_ACCEL_PREFIX set, files are handed to the reverse proxy via X-Accel-Redirect.
+MEDIA_MIRROR_ROOT = os.getenv("MEDIA_MIRROR_ROOT", "")
+MEDIA_MIRROR_MAX_BYTES = int(os.getenv("MEDIA_MIRROR_MAX_BYTES", 2 * 1024**3))
+MEDIA_MIRROR_ACCEL_PREFIX = os.getenv("MEDIA_MIRROR_ACCEL_PREFIX", "")
+
+# How the next question is chosen: "min_score" (lowest score first) or "leitner" (spaced repetition)
+QUIZ_STRATEGY = os.getenv("QUIZ_STRATEGY", "min_score")
+
+# Seconds between two checks of the catalog version stamp by each worker
+CATALOG_CHECK_INTERVAL = float(os.getenv("CATALOG_CHECK_INTERVAL", 5))
+
+# Dataset versions kept by import_taxons: the active one and the previous ones, so that a question shown before
+# a switch-over can still be answered
+DATASET_VERSIONS_KEPT = int(os.getenv("DATASET_VERSIONS_KEPT", 2))
+
+# Rows of the PDF pages parsed by import_taxons, kept under each page's content hash (disabled when empty)
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", BASE_DIR / ".pdf_cache")
+
+# Compiled catalog written by import_taxons and memory-mapped by every worker
+CATALOG_PATH = os.getenv("CATALOG_PATH", BASE_DIR / "catalog.bin")
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = bool(os.getenv("DEBUG", False))
 
@@ -1,7 +1,73 @@
+from .catalog import publish_catalog
+from .catalog import get_catalog
+from .media import renumber_media
+from .models import MediaStatus
+from .models import ProviderState
 from .models import SearchResult
+from .models import Species
 from .models import Taxon
 from .models import UserScore
+from datetime import timedelta
 from django.contrib import admin
+from django.utils import timezone
+
+
+class DatasetListFilter(admin.SimpleListFilter):
+    title = "dataset"
+    parameter_name = "dataset"
+
+    def lookups(self, request, model_admin):
+        return [(dataset, dataset) for dataset in get_catalog().datasets()]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(dataset=self.value())
+        return queryset
+
+
+class MediaAgeListFilter(admin.SimpleListFilter):
+    title = "âge des médias"
+    parameter_name = "media_age"
+    AGES = {"week": 7, "month": 30, "half_year": 182}
+
+    def lookups(self, request, model_admin):
+        return [
+            ("never", "Jamais récupérés"),
+            ("week", "Moins d'une semaine"),
+            ("month", "Moins d'un mois"),
+            ("half_year", "Moins de 6 mois"),
+            ("older", "Plus de 6 mois"),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() == "never":
+            return queryset.filter(last_update__isnull=True)
+        if self.value() == "older":
+            return queryset.filter(last_update__lt=timezone.now() - timedelta(days=self.AGES["half_year"]))
+        if self.value() in self.AGES:
+            return queryset.filter(last_update__gte=timezone.now() - timedelta(days=self.AGES[self.value()]))
+        return queryset
+
+
+class NoMediaListFilter(admin.SimpleListFilter):
+    title = "médias introuvables"
+    parameter_name = "no_media"
+
+    def lookups(self, request, model_admin):
+        return [
+            ("none", "Aucun média (nom à corriger ?)"),
+            ("inaturalist", "Aucune photo iNaturalist"),
+            ("xenocanto", "Aucun chant Xeno-canto"),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() == "none":
+            return queryset.filter(species__media_statuses__misses__gt=0, photo_count=0, song_count=0).distinct()
+        if self.value() in ("inaturalist", "xenocanto"):
+            return queryset.filter(
+                species__media_statuses__provider=self.value(), species__media_statuses__misses__gt=0
+            )
+        return queryset
 
 
 @admin.register(Taxon)
@@ -16,11 +82,12 @@ class TaxonAdmin(admin.ModelAdmin):
         "embranchement",
         "regne",
         "dataset",
+        "last_update",
     )
-    list_filter = ("category", "dataset")
+    list_filter = ("category", DatasetListFilter, MediaAgeListFilter, NoMediaListFilter)
     search_fields = ("nom_vernaculaire", "genre", "espece", "famille")
     ordering = ("nom_vernaculaire",)
-    readonly_fields = ("last_update",)
+    readonly_fields = ("last_update", "species", "version")
     fieldsets = (
         (
             "Identification",
@@ -45,19 +112,55 @@ class TaxonAdmin(admin.ModelAdmin):
         (
             "Métadonnées",
             {
-                "fields": ("last_update",),
+                "fields": ("species", "version", "last_update"),
             },
         ),
     )
 
+    def get_queryset(self, request):
+        # Previous versions are kept for the switch-over only
+        return super().get_queryset(request).filter(version__active=True)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        publish_catalog()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        publish_catalog()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        publish_catalog()
+
 
 @admin.register(SearchResult)
 class SearchResultAdmin(admin.ModelAdmin):
-    list_display = ("taxon", "title")
-    list_filter = ("taxon",)
-    search_fields = ("title", "taxon__nom_vernaculaire")
-    readonly_fields = ("taxon", "title", "link", "image_context_link")
-    ordering = ("taxon",)
+    list_display = ("species", "title", "kind", "provider")
+    list_filter = ("kind", "provider")
+    search_fields = ("title", "species__key", "species__taxa__nom_vernaculaire")
+    readonly_fields = ("species", "title", "link", "image_context_link", "kind", "provider", "ordinal")
+    ordering = ("species",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        renumber_media(obj.species)
+
+    def delete_queryset(self, request, queryset):
+        species = list(Species.objects.filter(search_results__in=queryset).distinct())
+        super().delete_queryset(request, queryset)
+        for item in species:
+            renumber_media(item)
+
+
+@admin.register(Species)
+class SpeciesAdmin(admin.ModelAdmin):
+    list_display = ("key", "name")
+    search_fields = ("key", "name", "taxa__nom_vernaculaire")
+    readonly_fields = ("key", "name")
 
     def has_add_permission(self, request):
         return False
@@ -79,3 +182,24 @@ class UserScoreAdmin(admin.ModelAdmin):
 
     def has_add_permission(self, request):
         return False
+
+
+@admin.register(MediaStatus)
+class MediaStatusAdmin(admin.ModelAdmin):
+    list_display = ("species", "provider", "refreshed_at", "misses", "retry_at")
+    list_filter = ("provider",)
+    search_fields = ("species__key", "species__taxa__nom_vernaculaire")
+    readonly_fields = ("species", "provider", "refreshed_at", "misses")
+    ordering = ("-misses", "species")
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ProviderState)
+class ProviderStateAdmin(admin.ModelAdmin):
+    list_display = ("provider", "consecutive_failures", "open_until", "tokens", "refilled_at")
+    readonly_fields = ("provider", "tokens", "refilled_at")
+
+    def has_add_permission(self, request):
+        return False
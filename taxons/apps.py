@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class TaxonsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'taxons'
+
+    def ready(self):
+        from taxons import catalog  # noqa: F401  (connects the catalog invalidation signals)
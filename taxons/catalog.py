@@ -0,0 +1,192 @@
+from django.conf import settings
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from taxons.models import CatalogVersion
+from taxons.models import Taxon
+from taxons.models import TaxonNeighbor
+
+import time
+import unicodedata
+
+
+RECORD_FIELDS = (
+    "id",
+    "dataset",
+    "category",
+    "nom_vernaculaire",
+    "regne",
+    "embranchement",
+    "classe",
+    "ordre",
+    "famille",
+    "genre",
+    "espece",
+)
+
+
+# Taxonomic ranks indexed by the catalog, closest first
+RANK_FIELDS = ("genre", "famille", "ordre", "classe", "embranchement")
+
+# Letters that do not decompose into a base letter and an accent
+LIGATURES = str.maketrans({"œ": "oe", "æ": "ae", "ß": "ss", "ø": "o", "ł": "l"})
+
+
+def collation_key(name):
+    """Sort key ordering names as the database collation (en_US) did: accents, case and punctuation only
+    break ties, so "Écureuil roux" sorts among the E's and "Œdémère" among the O's.
+    """
+    folded = unicodedata.normalize("NFKD", name.casefold().translate(LIGATURES))
+    letters = "".join(char for char in folded if not unicodedata.combining(char))
+    return ("".join(char for char in letters if char.isalnum()), letters, folded, name)
+
+
+class TaxonRecord:
+    """Read-only, compact copy of the taxonomy columns of a Taxon."""
+
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, *values):
+        for field, value in zip(RECORD_FIELDS, values):
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TaxonRecord is immutable")
+
+    def __eq__(self, other):
+        return isinstance(other, TaxonRecord) and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.nom_vernaculaire
+
+
+class Catalog:
+    """Immutable snapshot of the taxonomy with the per-dataset/per-category lists the views need."""
+
+    def __init__(self, version, records, neighbors):
+        self.version = version
+        self._by_id = {record.id: record for record in records}
+        self._taxa = {}
+        for record in sorted(records, key=lambda r: collation_key(r.nom_vernaculaire)):
+            self._taxa.setdefault((record.dataset, ""), []).append(record)
+            if record.category:
+                self._taxa.setdefault((record.dataset, record.category), []).append(record)
+        self._taxa = {scope: tuple(taxa) for scope, taxa in self._taxa.items()}
+        self._names = {scope: tuple(r.nom_vernaculaire for r in taxa) for scope, taxa in self._taxa.items()}
+        self._datasets = tuple(sorted({dataset for dataset, _ in self._taxa}))
+        self._categories = {}
+        for dataset, category in self._taxa:
+            if category:
+                self._categories.setdefault(dataset, set()).add(category)
+        self._categories = {dataset: frozenset(categories) for dataset, categories in self._categories.items()}
+        self._ranks = {}
+        for (dataset, category), taxa in self._taxa.items():
+            if not category:
+                for record in taxa:
+                    for rank in RANK_FIELDS:
+                        if getattr(record, rank):
+                            self._ranks.setdefault((dataset, rank, getattr(record, rank)), []).append(record)
+        self._ranks = {key: tuple(records) for key, records in self._ranks.items()}
+        self._neighbors = {}
+        for taxon_id, category, neighbor_id in neighbors:
+            self._neighbors.setdefault((taxon_id, category), []).append(self._by_id[neighbor_id])
+        self._neighbors = {key: tuple(records) for key, records in self._neighbors.items()}
+
+    @classmethod
+    def from_database(cls, version):
+        records = [TaxonRecord(*row) for row in Taxon.objects.active().values_list(*RECORD_FIELDS)]
+        neighbors = (
+            TaxonNeighbor.objects.filter(taxon__version__active=True)
+            .order_by("rank")
+            .values_list("taxon_id", "category", "neighbor_id")
+        )
+        return cls(version, records, neighbors)
+
+    def datasets(self):
+        return self._datasets
+
+    def categories(self, dataset):
+        return self._categories.get(dataset, frozenset())
+
+    def taxa(self, dataset, category=""):
+        return self._taxa.get((dataset, category), ())
+
+    def names(self, dataset, category=""):
+        """Alphabetical nom_vernaculaire list of a dataset (and category)."""
+        return self._names.get((dataset, category), ())
+
+    def by_rank(self, dataset, rank, value):
+        """Taxa of a dataset sharing a rank value (e.g. rank "genre", value "Turdus"), alphabetical."""
+        return self._ranks.get((dataset, rank, value), ())
+
+    def get(self, taxon_id):
+        return self._by_id.get(taxon_id)
+
+    def neighbors(self, taxon_id, category=""):
+        """Precomputed distractor candidates of a taxon, closest ranks first."""
+        return self._neighbors.get((taxon_id, category), ())
+
+
+_catalog = None
+_checked_at = 0.0
+
+
+def current_catalog_version():
+    """Version stamp of the taxonomy: (bump counter, time of the last bump in microseconds)."""
+    row = CatalogVersion.objects.filter(pk=1).values_list("version", "updated_at").first()
+    if row is None:
+        return (0, 0)
+    return (row[0], int(row[1].timestamp() * 1_000_000))
+
+
+def bump_catalog_version():
+    """Tell every worker that the taxonomy changed (import, admin edit)."""
+    global _catalog
+    _catalog = None
+    updated = CatalogVersion.objects.filter(pk=1).update(version=F("version") + 1, updated_at=timezone.now())
+    if not updated:
+        CatalogVersion.objects.get_or_create(pk=1, defaults={"version": 1})
+
+
+def publish_catalog():
+    """Bump the version stamp and compile the matching catalog file for the workers to map."""
+    from taxons.catalog_file import write_catalog_file
+
+    bump_catalog_version()
+    catalog = Catalog.from_database(current_catalog_version())
+    write_catalog_file(settings.CATALOG_PATH, catalog)
+    return catalog
+
+
+def get_catalog():
+    """Return this worker's catalog, reloading it when the version stamp moved.
+
+    The stamp is read at most once every CATALOG_CHECK_INTERVAL seconds, so most
+    requests read the taxonomy without any query. The compiled file written by
+    publish_catalog() is mapped when it matches the stamp; otherwise the catalog
+    is built from the database.
+    """
+    from taxons.catalog_file import load_catalog_file
+
+    global _catalog, _checked_at
+    now = time.monotonic()
+    if _catalog is not None and now - _checked_at < settings.CATALOG_CHECK_INTERVAL:
+        return _catalog
+    version = current_catalog_version()
+    if _catalog is None or _catalog.version != version:
+        _catalog = load_catalog_file(settings.CATALOG_PATH, version) or Catalog.from_database(version)
+    _checked_at = now
+    return _catalog
+
+
+@receiver(post_save, sender=Taxon)
+@receiver(post_delete, sender=Taxon)
+def drop_local_catalog(sender, **kwargs):
+    # Other workers pick the change up from the version stamp bumped by the writer
+    global _catalog
+    _catalog = None
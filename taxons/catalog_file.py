@@ -0,0 +1,227 @@
+"""Compiled, memory-mapped catalog shared read-only by every worker of a host.
+
+Layout (little-endian), all offsets from the start of the file:
+
+    header     magic, stamp, record count, then (offset, length) of each section
+    ids        int64 taxon id per record, sorted, so lookups bisect the mapped memory
+    records    fixed-width records: one (offset, length) string reference per field
+    strings    UTF-8 string table, every distinct value stored once, followed by the index keys
+    postings   uint32 record positions referenced by the indexes
+    scopes     index of the taxa by dataset and category
+    neighbors  index of the distractor candidates by taxon id and category
+    ranks      index of the taxa by dataset, rank and rank value
+
+The three indexes are arrays of fixed-width entries (key offset, key length, postings start, count) sorted by
+their UTF-8 key, so a lookup bisects the mapped memory without decoding anything up front. Keys are
+"dataset\\0category", big-endian taxon id + category, and "dataset\\0rank\\0value".
+
+"scopes" and "ranks" lists are sorted by nom_vernaculaire (taxons.catalog.collation_key), "neighbors" lists by
+taxonomic rank.
+"""
+
+from taxons.catalog import RECORD_FIELDS
+from taxons.catalog import TaxonRecord
+
+import mmap
+import os
+import struct
+import tempfile
+
+
+MAGIC = b"TXCAT\x00\x00\x02"
+SECTIONS = 7
+HEADER = struct.Struct("<8sqqI" + "QQ" * SECTIONS)
+STRING_FIELDS = RECORD_FIELDS[1:]
+RECORD = struct.Struct("<" + "IH" * len(STRING_FIELDS))
+INDEX_ENTRY = struct.Struct("<IHII")
+TAXON_ID = struct.Struct(">q")
+
+
+def scope_key(dataset, category):
+    return f"{dataset}\0{category}".encode("utf-8")
+
+
+def neighbor_key(taxon_id, category):
+    return TAXON_ID.pack(taxon_id) + category.encode("utf-8")
+
+
+def rank_key(dataset, rank, value):
+    return f"{dataset}\0{rank}\0{value}".encode("utf-8")
+
+
+def write_catalog_file(path, catalog):
+    """Serialize a Catalog to `path`, atomically replacing any previous file."""
+    records = sorted(catalog._by_id.values(), key=lambda r: r.id)
+    position = {record.id: i for i, record in enumerate(records)}
+
+    strings = bytearray()
+    string_refs = {}
+
+    def ref(value):
+        value = value or ""
+        if value not in string_refs:
+            encoded = value.encode("utf-8")
+            string_refs[value] = (len(strings), len(encoded))
+            strings.extend(encoded)
+        return string_refs[value]
+
+    ids = struct.pack(f"<{len(records)}q", *(record.id for record in records))
+    packed_records = bytearray()
+    for record in records:
+        packed_records += RECORD.pack(*(part for field in STRING_FIELDS for part in ref(getattr(record, field))))
+
+    postings = []
+
+    def index(entries):
+        packed = bytearray()
+        for key, items in sorted(entries, key=lambda entry: entry[0]):
+            packed += INDEX_ENTRY.pack(len(strings), len(key), len(postings), len(items))
+            strings.extend(key)
+            postings.extend(position[item.id] for item in items)
+        return bytes(packed)
+
+    scopes = index((scope_key(*scope), taxa) for scope, taxa in catalog._taxa.items())
+    neighbors = index((neighbor_key(*key), items) for key, items in catalog._neighbors.items())
+    ranks = index((rank_key(*key), taxa) for key, taxa in catalog._ranks.items())
+
+    sections = [ids, bytes(packed_records), bytes(strings), struct.pack(f"<{len(postings)}I", *postings),
+                scopes, neighbors, ranks]
+    offsets = []
+    offset = HEADER.size
+    for section in sections:
+        offsets += [offset, len(section)]
+        offset += len(section)
+
+    version, stamp = catalog.version
+    directory_name = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory_name, prefix=".catalog-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, version, stamp, len(records), *offsets))
+            for section in sections:
+                f.write(section)
+        os.chmod(tmp_path, 0o644)
+        # Workers still mapping the old file keep reading its inode until they reload
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class MappedCatalog:
+    """Catalog API (see taxons.catalog.Catalog) read straight from a memory-mapped file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self._mm, 0)
+        if header[0] != MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} is not a compiled catalog")
+        self.version = (header[1], header[2])
+        self._count = header[3]
+        sections = [header[i:i + 2] for i in range(4, len(header), 2)]
+        (ids_at, ids_len), (self._records_at, _), (self._strings_at, _), (postings_at, postings_len), \
+            *self._indexes = sections
+        self._view = memoryview(self._mm)
+        self._ids = self._view[ids_at:ids_at + ids_len].cast("q")
+        self._postings = self._view[postings_at:postings_at + postings_len].cast("I")
+        self._datasets = None
+
+    def close(self):
+        # The mapping cannot be closed while memoryviews of it exist
+        for view in (self._ids, self._postings, self._view):
+            view.release()
+        self._mm.close()
+
+    def _string(self, offset, length):
+        start = self._strings_at + offset
+        return self._mm[start:start + length].decode("utf-8")
+
+    def _record(self, position):
+        parts = RECORD.unpack_from(self._mm, self._records_at + position * RECORD.size)
+        values = [self._string(parts[i], parts[i + 1]) for i in range(0, len(parts), 2)]
+        return TaxonRecord(self._ids[position], *values)
+
+    def _entry(self, index, i):
+        at, _ = self._indexes[index]
+        key_at, key_len, start, count = INDEX_ENTRY.unpack_from(self._mm, at + i * INDEX_ENTRY.size)
+        return self._mm[self._strings_at + key_at:self._strings_at + key_at + key_len], start, count
+
+    def _entries(self, index, prefix):
+        """(key, postings start, count) of the entries whose key starts with `prefix`, in key order."""
+        lo, hi = 0, self._indexes[index][1] // INDEX_ENTRY.size
+        end = hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(index, mid)[0] < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < end:
+            entry = self._entry(index, lo)
+            if not entry[0].startswith(prefix):
+                break
+            yield entry
+            lo += 1
+
+    def _posting(self, index, key):
+        for found, start, count in self._entries(index, key):
+            if found == key:
+                return self._postings[start:start + count]
+            break
+        return ()
+
+    def datasets(self):
+        if self._datasets is None:
+            # Every dataset has a scope without category
+            self._datasets = tuple(
+                key[:-1].decode("utf-8") for key, _, _ in self._entries(0, b"") if key.endswith(b"\0")
+            )
+        return self._datasets
+
+    def categories(self, dataset):
+        prefix = scope_key(dataset, "")
+        return frozenset(key[len(prefix):].decode("utf-8") for key, _, _ in self._entries(0, prefix) if key != prefix)
+
+    def taxa(self, dataset, category=""):
+        return tuple(self._record(p) for p in self._posting(0, scope_key(dataset, category)))
+
+    def names(self, dataset, category=""):
+        name_at = STRING_FIELDS.index("nom_vernaculaire") * 2
+        names = []
+        for p in self._posting(0, scope_key(dataset, category)):
+            parts = RECORD.unpack_from(self._mm, self._records_at + p * RECORD.size)
+            names.append(self._string(parts[name_at], parts[name_at + 1]))
+        return tuple(names)
+
+    def by_rank(self, dataset, rank, value):
+        return tuple(self._record(p) for p in self._posting(2, rank_key(dataset, rank, value)))
+
+    def get(self, taxon_id):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ids[mid] < taxon_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._ids[lo] == taxon_id:
+            return self._record(lo)
+        return None
+
+    def neighbors(self, taxon_id, category=""):
+        return tuple(self._record(p) for p in self._posting(1, neighbor_key(taxon_id, category)))
+
+
+def load_catalog_file(path, version):
+    """Map the compiled catalog if it exists and matches `version`, else return None."""
+    try:
+        catalog = MappedCatalog(path)
+    except (OSError, ValueError, struct.error):
+        return None
+    if catalog.version != tuple(version):
+        # Stale file: do not keep it mapped
+        catalog.close()
+        return None
+    return catalog
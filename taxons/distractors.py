@@ -0,0 +1,71 @@
+from django.db import transaction
+from taxons.catalog import RANK_FIELDS
+from taxons.catalog import get_catalog
+from taxons.models import TaxonNeighbor
+
+import random
+
+
+RANKS = list(RANK_FIELDS)
+
+
+def closest_taxa(taxon, candidates, count=3, rank_members=None):
+    """Return (candidate, rank) pairs, closest ranks first, until at least `count` are collected.
+
+    Same cascade as the quiz always used: every taxon of the same genre, then of the same
+    famille, ordre, classe and embranchement, and finally any other taxon of the scope.
+    `rank_members(field, value)`, when given, returns the candidates sharing a rank value
+    (in the order of `candidates`) so that only those are scanned.
+    """
+    neighbors = []
+    taken = {taxon.id}
+    for rank, field in enumerate(RANKS + [None]):
+        if len(neighbors) >= count:
+            break
+        value = getattr(taxon, field) if field else None
+        if field and not value:
+            continue
+        pool = rank_members(field, value) if field and rank_members else candidates
+        for candidate in pool:
+            if candidate.id not in taken and (field is None or getattr(candidate, field) == value):
+                taken.add(candidate.id)
+                neighbors.append((candidate, rank))
+    return neighbors
+
+
+def build_distractor_index(version):
+    taxa = list(version.taxa.all())
+    scopes = {"": taxa}
+    for taxon in taxa:
+        if taxon.category:
+            scopes.setdefault(taxon.category, []).append(taxon)
+
+    rows = []
+    for taxon in taxa:
+        for category in {"", taxon.category}:
+            rows.extend(
+                TaxonNeighbor(taxon=taxon, neighbor=neighbor, category=category, rank=rank)
+                for neighbor, rank in closest_taxa(taxon, scopes[category])
+            )
+
+    with transaction.atomic():
+        TaxonNeighbor.objects.filter(taxon__version=version).delete()
+        TaxonNeighbor.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def pick_distractors(taxon, category="", count=3):
+    catalog = get_catalog()
+    neighbors = catalog.neighbors(taxon.id, category)
+    if not neighbors:
+        # Not indexed yet (e.g. taxon added outside import_taxons): compute on the fly from the rank index
+        def rank_members(field, value):
+            members = catalog.by_rank(taxon.dataset, field, value)
+            return [member for member in members if member.category == category] if category else members
+
+        def candidates():
+            # Only read when the ranks do not give `count` taxa
+            yield from catalog.taxa(taxon.dataset, category)
+
+        neighbors = [neighbor for neighbor, _ in closest_taxa(taxon, candidates(), count, rank_members)]
+    return random.sample(neighbors, min(count, len(neighbors)))
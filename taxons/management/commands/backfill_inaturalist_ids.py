@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand
+from taxons.media import provider_get
+from taxons.media import remember_inaturalist_id
+from taxons.models import Taxon
+from taxons.response_cache import refreshing
+
+import time
+
+
+class Command(BaseCommand):
+    help = "Resolve the missing iNaturalist taxon ids from the scientific names and store them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dataset", default="", help="Only taxa of this dataset")
+        parser.add_argument("--batch-size", type=int, default=50, help="Lookups between two progress reports")
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help="Ignore the provider response cache (PROVIDER_CACHE_PATH) and store fresh responses",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=1.0,
+            metavar="SECONDS",
+            help="Wait between batches, on top of the iNaturalist rate limit",
+        )
+
+    def taxa_to_resolve(self, dataset):
+        qs = Taxon.objects.active().filter(inaturalist_taxon_id=None).exclude(species=None)
+        if dataset:
+            qs = qs.filter(dataset=dataset)
+        # The id is written to every taxon of the species: look each species up once
+        taxa = {}
+        for taxon in qs.select_related("species").order_by("id"):
+            if taxon.scientific_name:
+                taxa.setdefault(taxon.species_id, taxon)
+        return list(taxa.values())
+
+    def resolve(self, taxon):
+        # Same lookup as the media fetch, through the shared rate limit and circuit breaker
+        data = provider_get(
+            "inaturalist",
+            "https://api.inaturalist.org/v1/taxa/autocomplete",
+            params={"q": taxon.scientific_name, "per_page": 1},
+            timeout=10,
+        )
+        results = data.get("results", [])
+        return results[0]["id"] if results else None
+
+    def handle(self, *args, **options):
+        with refreshing(options["refresh"]):
+            taxa = self.taxa_to_resolve(options["dataset"])
+            total = len(taxa)
+            batch_size = max(options["batch_size"], 1)
+            self.stdout.write(f"{total} species without iNaturalist id")
+
+            resolved = 0
+            not_found = []
+            failed = 0
+            collisions = []
+            for start in range(0, total, batch_size):
+                if start:
+                    time.sleep(options["pause"])
+                for taxon in taxa[start:start + batch_size]:
+                    try:
+                        taxon_id = self.resolve(taxon)
+                    except Exception as e:
+                        self.stdout.write(self.style.WARNING(f"Lookup failed for {taxon.scientific_name}: {e}"))
+                        failed += 1
+                        continue
+                    if taxon_id is None:
+                        not_found.append(taxon)
+                        continue
+                    clashes = remember_inaturalist_id(taxon, taxon_id)
+                    collisions.extend((taxon_id, other) for other in clashes)
+                    if taxon.inaturalist_taxon_id is not None:
+                        resolved += 1
+                self.stdout.write(f"[{min(start + batch_size, total)}/{total}] {resolved} resolved")
+
+            for taxon in not_found:
+                self.stdout.write(self.style.WARNING(f"Not found: {taxon.scientific_name} ({taxon.nom_vernaculaire})"))
+            for taxon_id, other in collisions:
+                holder = Taxon.objects.filter(inaturalist_taxon_id=taxon_id, version=other.version_id).first()
+                self.stdout.write(self.style.WARNING(
+                    f"Collision: {other.nom_vernaculaire} ({other.dataset}) resolves to iNaturalist id {taxon_id}, "
+                    f"already used by {holder.nom_vernaculaire if holder else '?'}"
+                ))
+            self.stdout.write(self.style.SUCCESS(
+                f"Backfill complete: {resolved} species resolved, {len(not_found)} not found, {failed} failed, "
+                f"{len(collisions)} collisions"
+            ))
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from taxons.models import DatasetVersion
+from taxons.models import Taxon
+from taxons.strategies import STRATEGIES
+from taxons.strategies import get_strategy
+
+import random
+import time
+
+
+BENCHMARK_DATASET = "__benchmark__"
+
+
+class Command(BaseCommand):
+    help = "Measure per-question latency of the question strategies for growing catalog sizes (rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+        parser.add_argument("--questions", type=int, default=50, help="Questions asked per strategy and size")
+        parser.add_argument("--strategies", nargs="+", choices=sorted(STRATEGIES), default=sorted(STRATEGIES))
+
+    def create_taxa(self, size):
+        version = DatasetVersion.active_for(BENCHMARK_DATASET)
+        Taxon.objects.bulk_create(
+            [
+                Taxon(
+                    dataset=BENCHMARK_DATASET,
+                    version=version,
+                    nom_vernaculaire=f"Taxon {i}",
+                    regne="Animalia",
+                    embranchement="Chordata",
+                    classe="Aves",
+                    ordre=f"Ordre {i % 50}",
+                    famille=f"Famille {i % 500}",
+                    genre=f"Genre {i % 5000}",
+                    espece=f"sp{i}",
+                    partie_etat_indice="",
+                )
+                for i in range(size)
+            ],
+            batch_size=5000,
+        )
+
+    def run_session(self, strategy, session_id, questions):
+        timings = []
+        for _ in range(questions):
+            start = time.perf_counter()
+            taxon = strategy.next_taxon(session_id, dataset=BENCHMARK_DATASET)
+            strategy.record_answer(session_id, taxon, correct=random.random() < 0.7)
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'strategy':<12}{'taxa':>10}{'first (ms)':>14}{'median (ms)':>14}{'p95 (ms)':>12}")
+        for size in options["sizes"]:
+            with transaction.atomic():
+                self.create_taxa(size)
+                for name in options["strategies"]:
+                    timings = self.run_session(get_strategy(name), f"benchmark-{name}-{size}", options["questions"])
+                    steady = sorted(timings[1:]) or timings
+                    self.stdout.write(
+                        f"{name:<12}{size:>10}{timings[0] * 1000:>14.2f}"
+                        f"{steady[len(steady) // 2] * 1000:>14.2f}{steady[int(len(steady) * 0.95)] * 1000:>12.2f}"
+                    )
+                transaction.set_rollback(True)
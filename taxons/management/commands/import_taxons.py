@@ -1,14 +1,29 @@
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.core.management.base import CommandError
+from django.db import connection
+from django.db import transaction
+from taxons.catalog import publish_catalog
+from taxons.distractors import build_distractor_index
+from taxons.media import enough_recordings
+from taxons.media import provider_get
+from taxons.media import rank_recordings
+from taxons.media import xenocanto_params
+from taxons.media import xenocanto_queries
+from taxons.models import DatasetVersion
 from taxons.models import Taxon
+from taxons.pdf_extract import extract_rows
+from taxons.response_cache import refreshing
+from taxons.versions import activate_version
+from taxons.versions import collect_versions
 
 import csv
+import hashlib
+import json
 import os
-import pdfplumber
 import time
-from taxons.utils import requests_session
 
 
 CATEGORY_MAP = {
@@ -575,18 +590,66 @@ CATEGORY_MAP = {
 }
 
 
+# Columns of Taxon written by the import (besides dataset and nom_vernaculaire, the row's identity)
+TAXON_FIELDS = [
+    "regne",
+    "embranchement",
+    "classe",
+    "ordre",
+    "famille",
+    "genre",
+    "espece",
+    "partie_etat_indice",
+    "category",
+    "inaturalist_taxon_id",
+    "source_hash",
+]
 DATASETS = ["nature", "rando"]
 
 
+class LookupFailed(Exception):
+    """A provider request failed while looking a row up (as opposed to the row not being found)."""
+
+
+def normalize_row(row):
+    """CSV row with surrounding and repeated whitespace removed (columns without header are dropped)."""
+    return {key.strip(): " ".join((value or "").split()) for key, value in row.items() if key}
+
+
+def row_hash(row, by_nom_vernaculaire):
+    """Content hash of a normalized source row and of how it is looked up."""
+    payload = json.dumps([row, by_nom_vernaculaire], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
 class Command(BaseCommand):
     help = "Import taxons from CSV file"
-    inaturalist_last_call = None
-    xenocanto_last_call = None
 
     def add_arguments(self, parser):
-        pass
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Look every row up again and write a new version with its distractor index, even when nothing changed",
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="Rows looked up concurrently (providers stay rate limited, rows are stored in file order)",
+        )
+        parser.add_argument(
+            "--pdf-workers",
+            type=int,
+            default=None,
+            help="Processes parsing the pages of a PDF without CSV (default: one per CPU)",
+        )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help="Ignore the provider response cache (PROVIDER_CACHE_PATH) and store fresh responses",
+        )
 
-    def extract_pdf_to_csv(self, pdf_path, csv_path):
+    def extract_pdf_to_csv(self, pdf_path, csv_path, workers=None):
         hdrs = [
             (
                 "Règne",
@@ -600,25 +663,7 @@ class Command(BaseCommand):
                 "Partie/état/indice à reconnaitre",
             )
         ]
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                for tb in page.extract_tables():
-                    for sub_tb in tb:
-                        regne = sub_tb[0]
-                        nom_vernaculaire = sub_tb[-2]
-                        if regne != "Règne" and nom_vernaculaire:
-                            hdrs.append(
-                                tuple(
-                                    [
-                                        (
-                                            str(cell.strip().replace("-\n", "").replace("\n", " "))
-                                            if cell and cell != "-"
-                                            else None
-                                        )
-                                        for cell in sub_tb
-                                    ]
-                                )
-                            )
+        hdrs.extend(extract_rows(pdf_path, settings.PDF_CACHE_DIR, workers))
 
         with open(csv_path, "w", encoding="utf-8", newline="") as f:
             writer = csv.writer(f)
@@ -650,20 +695,18 @@ class Command(BaseCommand):
         return None
 
     def resolve_inaturalist_id(self, query_term, nom_vernaculaire):
-        if self.inaturalist_last_call and (datetime.now() - self.inaturalist_last_call).total_seconds() < 1:
-            time.sleep(2)  # Respect iNaturalist rate limit of 1 request per second
-        self.inaturalist_last_call = datetime.now()
         try:
-            resp = requests_session().get(
+            resp = provider_get(
+                "inaturalist",
                 "https://api.inaturalist.org/v1/taxa/autocomplete",
                 params={"q": query_term, "per_page": 1},
                 timeout=10,
-            ).json()
+            )
         except Exception as e:
             self.stdout.write(self.style.WARNING(
                 f"iNaturalist request failed for '{query_term}' ({nom_vernaculaire}): {e}"
             ))
-            return None
+            raise LookupFailed(query_term) from e
 
         results = resp.get("results", [])
         if not results:
@@ -672,48 +715,34 @@ class Command(BaseCommand):
         return results[0]["id"]
 
     def validate_xenocanto(self, row):
-        genre = row.get("Genre") or ""
-        espece = row.get("Espèce") or ""
-
-        if espece and espece != "spp.":
-            species_query = f"gen:{genre} sp:{espece}"
-        elif genre:
-            species_query = f"gen:{genre}"
-        else:
+        queries = xenocanto_queries(row.get("Genre") or "", row.get("Espèce") or "")
+        if not queries:
             raise CommandError(f"Cannot build Xeno-canto query for: {row.get('Nom vernaculaire')}")
 
-        queries = [
-            f"{species_query} cnt:Belgium type:song",
-            f"{species_query} cnt:Belgium",
-            f"{species_query} cnt:France type:song",
-            f"{species_query} cnt:France",
-        ]
-
-        resp = None
-        for query in queries:
-            if self.xenocanto_last_call and (datetime.now() - self.xenocanto_last_call).total_seconds() < 1:
-                time.sleep(2)  # Respect Xeno-canto rate limit of 1 request per second
-            self.xenocanto_last_call = datetime.now()
+        recordings = []
+        for queried, query in enumerate(queries, 1):
             try:
-                resp = requests_session().get(
+                resp = provider_get(
+                    "xenocanto",
                     "https://xeno-canto.org/api/3/recordings",
-                    params={"query": query, "key": settings.XENOCANTO_API_KEY},
+                    params=xenocanto_params(query),
                     timeout=15,
-                ).json()
+                )
             except Exception as e:
                 raise CommandError(f"Xeno-canto request failed for {query}: {e}")
-            if resp.get("recordings"):
+            recordings += resp.get("recordings", [])
+            if enough_recordings(recordings, queried):
                 break
 
-        if not resp or not resp.get("recordings"):
-            self.stdout.write(f"Not found in Xeno-canto: {species_query} (tried Belgium/France, song/any) ({row.get('Nom vernaculaire')})")
-            # raise CommandError(f"Not found in Xeno-canto: {species_query} ({row.get('Nom vernaculaire')})")
+        if not rank_recordings(recordings):
+            self.stdout.write(f"Not found in Xeno-canto: {queries[0]} (Belgium/France) ({row.get('Nom vernaculaire')})")
+            # raise CommandError(f"Not found in Xeno-canto: {query} ({row.get('Nom vernaculaire')})")
 
-    def import_csv(self, csv_path, dataset_name):
+    def import_csv(self, csv_path, dataset_name, jobs=1, force=False):
         from collections import defaultdict
 
         with open(csv_path, "r", encoding="utf-8") as csvfile:
-            all_rows = list(csv.DictReader(csvfile))
+            all_rows = [normalize_row(row) for row in csv.DictReader(csvfile)]
 
         # Pre-scan: detect scientific name collisions before any API calls
         scientific_name_groups = defaultdict(list)
@@ -732,115 +761,214 @@ class Command(BaseCommand):
                 ))
                 collision_noms.update(noms)
 
-        created_count = 0
-        updated_count = 0
+        rows = {}  # nom_vernaculaire → taxon fields, a repeated row overrides the previous one
         resolved_ids = {}  # taxon_id → nom_vernaculaire, tracks IDs claimed in this run
 
-        for row in all_rows:
+        # nom_vernaculaire → (source_hash, inaturalist_taxon_id) of the active rows
+        stored = {
+            nom_vernaculaire: (source_hash, inaturalist_taxon_id)
+            for nom_vernaculaire, source_hash, inaturalist_taxon_id in Taxon.objects.active().filter(
+                dataset=dataset_name
+            ).values_list("nom_vernaculaire", "source_hash", "inaturalist_taxon_id")
+        }
+
+        def lookup(row):
             nom_vernaculaire = row["Nom vernaculaire"]
-            sci_name = self._build_scientific_name_from_row(row)
+            source_hash = row_hash(row, nom_vernaculaire in collision_noms)
+            previous_hash, inaturalist_taxon_id = stored.get(nom_vernaculaire, ("", None))
+            # Rows whose source is unchanged since the last import keep their id without any provider call
+            if previous_hash == source_hash and not force:
+                return inaturalist_taxon_id, source_hash, True
+            try:
+                return self.lookup_row(row, collision_noms), source_hash, False
+            except LookupFailed:
+                # The row keeps the id it had; no hash, so the next import looks it up again
+                return inaturalist_taxon_id, "", False
 
-            if nom_vernaculaire in collision_noms:
-                query_term = nom_vernaculaire
-            else:
-                query_term = sci_name
+        def lookup_in_thread(row):
+            try:
+                return lookup(row)
+            finally:
+                # Each pool thread has its own connection (rate limiter, response cache)
+                connection.close()
+
+        total = len(all_rows)
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else nullcontext() as pool:
+            # Lookups run ahead in the pool; results are applied in input order, like a serial run
+            lookups = pool.map(lookup_in_thread, all_rows) if pool else map(lookup, all_rows)
+            for done, (row, (raw_id, source_hash, skipped)) in enumerate(zip(all_rows, lookups), start=1):
+                fields = self.build_row(row, raw_id, resolved_ids)
+                fields["source_hash"] = source_hash
+                rows[fields["nom_vernaculaire"]] = fields
+                elapsed = time.monotonic() - start
+                eta = elapsed / done * (total - done)
+                status = " (unchanged)" if skipped else ""
+                self.stdout.write(f"[{done}/{total}] {row['Nom vernaculaire']}{status} — ETA {eta:.0f}s")
+
+        return self.write_dataset(dataset_name, list(rows.values()), force=force)
+
+    def write_dataset(self, dataset_name, rows, force=False):
+        """Write the dataset's rows as a new DatasetVersion, not yet active, in one transaction.
+
+        Players keep seeing the active version until activate_version() switches to this one. Returns the
+        (inserted, updated, unchanged, deleted) counts against the active version, and the new version (None
+        when nothing changed and not `force`: no version is written).
+        """
+        existing = {
+            taxon.nom_vernaculaire: taxon
+            for taxon in Taxon.objects.active().filter(dataset=dataset_name).select_related("species")
+        }
+        changes = {}
+        for fields in rows:
+            taxon = existing.get(fields["nom_vernaculaire"])
+            changes[fields["nom_vernaculaire"]] = (
+                None if taxon is None else any(getattr(taxon, name) != fields[name] for name in TAXON_FIELDS)
+            )
+        inserted = sum(changed is None for changed in changes.values())
+        updated = sum(changed is True for changed in changes.values())
+        deleted = len(existing.keys() - changes.keys())
+        counts = inserted, updated, len(rows) - inserted - updated, deleted
+        if not inserted and not updated and not deleted and not force:
+            return counts, None
+
+        with transaction.atomic():
+            version = DatasetVersion.objects.create(dataset=dataset_name)
+            taxa = []
+            for fields in rows:
+                taxon = Taxon(dataset=dataset_name, version=version, **fields)
+                previous = existing.get(fields["nom_vernaculaire"])
+                if previous is not None:
+                    # The row keeps its media and age; assign_species() moves it if its identity changed
+                    taxon.species = previous.species
+                    taxon.photo_count = previous.photo_count
+                    taxon.song_count = previous.song_count
+                    taxon.last_update = previous.last_update
+                # bulk_create bypasses Taxon.save()
+                taxon.assign_species()
+                taxa.append(taxon)
+            Taxon.objects.bulk_create(taxa, batch_size=1000)
+        return counts, version
+
+    def switch_to(self, version):
+        """Index the distractors of a written version, make it the active one and drop the old versions.
+
+        Returns the number of distractors indexed and of versions deleted.
+        """
+        neighbor_count = build_distractor_index(version)
+        activate_version(version)
+        return neighbor_count, collect_versions(version.dataset)
+
+    def lookup_row(self, row, collision_noms):
+        """Provider calls of one row: returns its iNaturalist id (None when not found) and validates birds on
+        Xeno-canto. Rows colliding on their scientific name are searched by nom_vernaculaire.
+        """
+        nom_vernaculaire = row["Nom vernaculaire"]
+        if nom_vernaculaire in collision_noms:
+            query_term = nom_vernaculaire
+        else:
+            query_term = self._build_scientific_name_from_row(row)
 
-            if query_term:
-                raw_id = self.resolve_inaturalist_id(query_term, nom_vernaculaire)
-            else:
-                self.stdout.write(self.style.WARNING(
-                    f"Cannot determine search term for: '{nom_vernaculaire}'"
-                ))
-                raw_id = None
+        if query_term:
+            raw_id = self.resolve_inaturalist_id(query_term, nom_vernaculaire)
+        else:
+            self.stdout.write(self.style.WARNING(
+                f"Cannot determine search term for: '{nom_vernaculaire}'"
+            ))
+            raw_id = None
 
-            if raw_id is not None and raw_id in resolved_ids:
-                self.stdout.write(self.style.WARNING(
-                    f"nom_vernaculaire fallback still collides: ID {raw_id} already taken by "
-                    f"'{resolved_ids[raw_id]}' — storing None for '{nom_vernaculaire}'"
-                ))
-                inaturalist_taxon_id = None
-            elif raw_id is not None:
-                resolved_ids[raw_id] = nom_vernaculaire
-                inaturalist_taxon_id = raw_id
-            else:
-                inaturalist_taxon_id = None
+        if row.get("Classe") == "Aves":
+            self.validate_xenocanto(row)
+        return raw_id
 
-            if row.get("Classe") == "Aves":
-                self.validate_xenocanto(row)
+    def build_row(self, row, raw_id, resolved_ids):
+        """Taxon fields of one row, with its looked up iNaturalist id unless an earlier row claimed it."""
+        nom_vernaculaire = row["Nom vernaculaire"]
+        if raw_id is not None and raw_id in resolved_ids:
+            self.stdout.write(self.style.WARNING(
+                f"nom_vernaculaire fallback still collides: ID {raw_id} already taken by "
+                f"'{resolved_ids[raw_id]}' — storing None for '{nom_vernaculaire}'"
+            ))
+            inaturalist_taxon_id = None
+        elif raw_id is not None:
+            resolved_ids[raw_id] = nom_vernaculaire
+            inaturalist_taxon_id = raw_id
+        else:
+            inaturalist_taxon_id = None
 
-            embranchement = row["Embranchement (Sous-embranchement)"] or ""
-            if "(" in embranchement:
-                embranchement = embranchement.split("(")[0].strip()
+        embranchement = row["Embranchement (Sous-embranchement)"] or ""
+        if "(" in embranchement:
+            embranchement = embranchement.split("(")[0].strip()
 
-            ordre = row["Ordre (Sous-ordre)"] or ""
-            if "(" in ordre:
-                ordre = ordre.split("(")[0].strip()
+        ordre = row["Ordre (Sous-ordre)"] or ""
+        if "(" in ordre:
+            ordre = ordre.split("(")[0].strip()
 
-            if nom_vernaculaire not in CATEGORY_MAP:
-                self.stdout.write(
-                    self.style.WARNING(
-                        f"No category mapping for: '{nom_vernaculaire}' — importing with empty category"
-                    )
+        if nom_vernaculaire not in CATEGORY_MAP:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"No category mapping for: '{nom_vernaculaire}' — importing with empty category"
                 )
-            category = CATEGORY_MAP.get(nom_vernaculaire, "")
-
-            taxon, created = Taxon.objects.update_or_create(
-                nom_vernaculaire=nom_vernaculaire,
-                dataset=dataset_name,
-                defaults={
-                    "regne": row["Règne"],
-                    "embranchement": embranchement,
-                    "classe": row["Classe"],
-                    "ordre": ordre,
-                    "famille": row["Famille"],
-                    "genre": row["Genre"],
-                    "espece": row["Espèce"],
-                    "partie_etat_indice": row["Partie/état/indice à reconnaitre"],
-                    "category": category,
-                    "inaturalist_taxon_id": inaturalist_taxon_id,
-                },
             )
-
-            if created:
-                created_count += 1
-            else:
-                updated_count += 1
-
-        return created_count, updated_count
+        category = CATEGORY_MAP.get(nom_vernaculaire, "")
+
+        return {
+            "nom_vernaculaire": nom_vernaculaire,
+            "regne": row["Règne"],
+            "embranchement": embranchement,
+            "classe": row["Classe"],
+            "ordre": ordre,
+            "famille": row["Famille"],
+            "genre": row["Genre"],
+            "espece": row["Espèce"],
+            "partie_etat_indice": row["Partie/état/indice à reconnaitre"],
+            "category": category,
+            "inaturalist_taxon_id": inaturalist_taxon_id,
+        }
 
     def handle(self, *args, **options):
-        total_created = 0
-        total_updated = 0
-
-        for dataset_name in DATASETS:
-            csv_path = f"{dataset_name}.csv"
-            pdf_path = f"{dataset_name}.pdf"
-
-            if os.path.exists(csv_path):
-                pass
-            elif os.path.exists(pdf_path):
-                self.stdout.write(f"Extracting {pdf_path} → {csv_path}...")
-                self.extract_pdf_to_csv(pdf_path, csv_path)
-            else:
+        with refreshing(options["refresh"]):
+            totals = [0, 0, 0, 0]
+
+            for dataset_name in DATASETS:
+                csv_path = f"{dataset_name}.csv"
+                pdf_path = f"{dataset_name}.pdf"
+
+                if os.path.exists(csv_path):
+                    pass
+                elif os.path.exists(pdf_path):
+                    self.stdout.write(f"Extracting {pdf_path} → {csv_path}...")
+                    self.extract_pdf_to_csv(pdf_path, csv_path, options["pdf_workers"])
+                else:
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f"Neither {csv_path} nor {pdf_path} found — skipping dataset '{dataset_name}'"
+                        )
+                    )
+                    continue
+
+                self.stdout.write(f"Importing dataset '{dataset_name}' from {csv_path}...")
+                counts, version = self.import_csv(csv_path, dataset_name, options["jobs"], options["force"])
+                totals = [total + count for total, count in zip(totals, counts)]
+                inserted, updated, unchanged, deleted = counts
+                if version is None:
+                    self.stdout.write(
+                        self.style.SUCCESS(f"Dataset '{dataset_name}': Unchanged={unchanged}, active version kept")
+                    )
+                    continue
+                neighbor_count, collected = self.switch_to(version)
                 self.stdout.write(
-                    self.style.WARNING(
-                        f"Neither {csv_path} nor {pdf_path} found — skipping dataset '{dataset_name}'"
+                    self.style.SUCCESS(
+                        f"Dataset '{dataset_name}' v{version.pk}: Inserted={inserted}, Updated={updated}, "
+                        f"Unchanged={unchanged}, Deleted={deleted}, Distractors indexed={neighbor_count}, "
+                        f"Old versions removed={collected}"
                     )
                 )
-                continue
 
-            self.stdout.write(f"Importing dataset '{dataset_name}' from {csv_path}...")
-            created_count, updated_count = self.import_csv(csv_path, dataset_name)
-            total_created += created_count
-            total_updated += updated_count
+            publish_catalog()
+
             self.stdout.write(
                 self.style.SUCCESS(
-                    f"Dataset '{dataset_name}': Created={created_count}, Updated={updated_count}"
+                    "\nImport complete! Total inserted: {}, updated: {}, unchanged: {}, deleted: {}".format(*totals)
                 )
             )
-
-        self.stdout.write(
-            self.style.SUCCESS(
-                f"\nImport complete! Total created: {total_created}, updated: {total_updated}"
-            )
-        )
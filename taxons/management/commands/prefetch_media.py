@@ -0,0 +1,164 @@
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from taxons.media import INATURALIST_BATCH_SIZE
+from taxons.media import acquire_media_lease
+from taxons.media import fetch_images_for_taxa
+from taxons.media import fetchable_providers
+from taxons.media import refresh_media
+from taxons.media import release_media_lease
+from taxons.mirror import evict
+from taxons.mirror import mirror_enabled
+from taxons.mirror import mirror_link
+from taxons.models import SearchResult
+from taxons.models import Taxon
+from taxons.response_cache import refreshing
+
+import time
+
+
+class Command(BaseCommand):
+    help = "Fetch photos and songs of every taxon ahead of time so that no request waits on a provider"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dataset", default="", help="Only taxa of this dataset")
+        parser.add_argument("--category", default="", help="Only taxa of this category")
+        parser.add_argument("--workers", type=int, default=4, help="Concurrent fetches (providers stay rate limited)")
+        parser.add_argument(
+            "--stale-after",
+            type=float,
+            default=None,
+            metavar="DAYS",
+            help="Also refresh taxa whose media is older than DAYS days",
+        )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help="Ignore the provider response cache (PROVIDER_CACHE_PATH) and store fresh responses",
+        )
+        parser.add_argument(
+            "--mirror",
+            action="store_true",
+            help="Also download the photos into the local mirror (MEDIA_MIRROR_ROOT)",
+        )
+
+    def scope(self, dataset, category):
+        qs = Taxon.objects.active()
+        if dataset:
+            qs = qs.filter(dataset=dataset)
+        if category:
+            qs = qs.filter(category=category)
+        return qs
+
+    def taxa_to_fetch(self, dataset, category, stale_after):
+        qs = self.scope(dataset, category)
+        # Taxa done by a previous (interrupted) run are skipped, which makes the command resumable
+        todo = Q(photo_count=0, song_count=0)
+        if stale_after is not None:
+            cutoff = timezone.now() - timedelta(days=stale_after)
+            todo |= Q(last_update__isnull=True) | Q(last_update__lt=cutoff)
+        # Taxa of the same species share their media: fetch it once
+        taxa = {}
+        for taxon in qs.filter(todo).exclude(species=None).order_by("id"):
+            taxa.setdefault(taxon.species_id, taxon)
+        return list(taxa.values())
+
+    def prefetch(self, taxon, photos):
+        try:
+            providers = fetchable_providers(taxon)
+            if not providers:
+                # Recently found nothing for this taxon: wait for the back-off
+                return taxon.photo_count + taxon.song_count
+            # Leased right before the taxon's own requests: a lease taken for the whole chunk would expire
+            # (MEDIA_FETCH_LEASE_SECONDS) while the rate-limited fetches of the taxa ahead of it run
+            token = acquire_media_lease(taxon)
+            if token is None:
+                # A page request is fetching this taxon right now
+                return None
+            try:
+                refresh_media(taxon, providers, {"inaturalist": photos} if photos is not None else None)
+            finally:
+                release_media_lease(taxon, token)
+            return taxon.photo_count + taxon.song_count
+        finally:
+            # Each pool thread has its own connection
+            connection.close()
+
+    def batch_photos(self, taxa):
+        """Photos of the taxa with a known iNaturalist id, fetched with a few batched requests.
+
+        Stored by prefetch() under the taxon's lease, so that a taxon a page request is fetching is left alone.
+        """
+        batch = [
+            taxon
+            for taxon in taxa
+            if taxon.inaturalist_taxon_id is not None and "inaturalist" in fetchable_providers(taxon)
+        ]
+        return fetch_images_for_taxa(batch) if batch else {}
+
+    def handle(self, *args, **options):
+        with refreshing(options["refresh"]):
+            if options["mirror"] and not mirror_enabled():
+                raise CommandError("--mirror needs MEDIA_MIRROR_ROOT to be set")
+
+            taxa = self.taxa_to_fetch(options["dataset"], options["category"], options["stale_after"])
+            total = len(taxa)
+            self.stdout.write(f"{total} taxa to prefetch with {options['workers']} workers")
+
+            start = time.monotonic()
+            done = 0
+            empty = 0
+            busy = 0
+            with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+                for offset in range(0, total, INATURALIST_BATCH_SIZE):
+                    chunk = taxa[offset:offset + INATURALIST_BATCH_SIZE]
+                    photos = self.batch_photos(chunk)
+                    futures = {pool.submit(self.prefetch, taxon, photos.get(taxon.id)): taxon for taxon in chunk}
+                    for future in as_completed(futures):
+                        taxon = futures[future]
+                        count = future.result()
+                        done += 1
+                        elapsed = time.monotonic() - start
+                        eta = elapsed / done * (total - done)
+                        if count is None:
+                            busy += 1
+                            status = "already being fetched"
+                        else:
+                            if not count:
+                                empty += 1
+                            status = f"{count} media"
+                        self.stdout.write(
+                            f"[{done}/{total}] {taxon.nom_vernaculaire} ({taxon.dataset}): {status} — ETA {eta:.0f}s"
+                        )
+
+            self.stdout.write(self.style.SUCCESS(
+                f"Prefetch complete: {total - empty - busy} taxa with media, {empty} without, {busy} fetched elsewhere"
+            ))
+
+            if options["mirror"]:
+                self.mirror(options["dataset"], options["category"], options["workers"])
+
+    def mirror_photo(self, link):
+        try:
+            return mirror_link(link)
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f"Could not mirror {link}: {e}"))
+            return False
+
+    def mirror(self, dataset, category, workers):
+        links = list(
+            SearchResult.objects.filter(species__taxa__in=self.scope(dataset, category))
+            .filter(kind=SearchResult.PHOTO)
+            .values_list("link", flat=True)
+            .distinct()
+        )
+        self.stdout.write(f"Mirroring {len(links)} photos...")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            mirrored = sum(pool.map(self.mirror_photo, links))
+        evicted = evict()
+        self.stdout.write(self.style.SUCCESS(f"Mirror complete: {mirrored} photos cached, {evicted} evicted"))
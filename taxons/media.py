@@ -0,0 +1,807 @@
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError
+from django.db import close_old_connections
+from django.db import connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from taxons.models import MediaFetchLease
+from taxons.models import MediaStatus
+from taxons.models import SearchResult
+from taxons.models import Species
+from taxons.models import Taxon
+from taxons.providers import DeadlineExceeded
+from taxons.providers import acquire
+from taxons.providers import record_failure
+from taxons.providers import record_success
+from taxons.providers import remaining_budget
+from taxons.response_cache import cached_get
+from taxons.utils import http_client
+
+import asyncio
+import random
+import requests
+import threading
+import time
+
+
+INATURALIST_PLACES = [7008, 6753]  # Belgium, then France
+INATURALIST_BATCH_SIZE = 100  # taxon ids per batched observations request
+INATURALIST_PAGE_SIZE = 200  # the API maximum
+XENOCANTO_COUNTRIES = ["Belgium", "France"]
+# lat_min,lon_min,lat_max,lon_max around Belgium and France: usually one query instead of one per country
+XENOCANTO_BOX = "41.3,-5.2,51.6,9.6"
+XENOCANTO_QUALITIES = {"A": 0, "B": 1, "C": 2, "D": 3, "E": 4}
+
+
+def provider_get(provider, url, params, timeout):
+    """GET a provider's JSON API through the response cache, then the shared rate limit, circuit breaker and
+    request budget.
+    """
+    return cached_get(url, params, lambda: _provider_get(provider, url, params, timeout))
+
+
+def _provider_get(provider, url, params, timeout):
+    acquire(provider)
+    remaining = remaining_budget()
+    shortened = False
+    if remaining is not None:
+        if remaining <= 0:
+            raise DeadlineExceeded(f"No time left to call {provider}")
+        shortened = remaining < timeout
+        timeout = min(timeout, remaining)
+    try:
+        # Within a request budget, a single attempt: retries and their back-off would outlast it
+        data = http_client().get_json(url, params=params, timeout=timeout, retries=remaining is None)
+    except requests.Timeout as e:
+        if shortened:
+            # Our budget ran out, not the provider's patience: not a provider failure
+            raise DeadlineExceeded(f"No time left to wait for {provider}") from e
+        record_failure(provider)
+        raise
+    except Exception:
+        record_failure(provider)
+        raise
+    record_success(provider)
+    return data
+
+
+def _provider_get_in_thread(provider, url, params, timeout):
+    try:
+        return provider_get(provider, url, params, timeout)
+    finally:
+        # No request signal fires in the executor threads: close their connection like request_finished would
+        close_old_connections()
+
+
+async def aprovider_get(provider, url, params, timeout):
+    # requests is blocking: run it (and the rate limiter wait) off the event loop.
+    # to_thread copies the context, so the request's outbound budget still applies.
+    return await asyncio.to_thread(_provider_get_in_thread, provider, url, params, timeout)
+
+
+def _autocomplete_params(taxon):
+    return {"q": taxon.scientific_name, "per_page": 1}
+
+
+def _observation_params(taxon_id, place_id):
+    return {
+        "taxon_id": taxon_id,
+        "place_id": place_id,
+        "quality_grade": "research",
+        "photos": "true",
+        "per_page": 30,
+    }
+
+
+def xenocanto_queries(genre, espece):
+    """Xeno-canto queries for the species (or genus): around Belgium and France, then one per country.
+
+    The first is usually enough (see enough_recordings). The per-country ones catch the Belgian recordings
+    beyond its first page, and the recordings without coordinates, which box: leaves out.
+    """
+    if espece and "spp." not in espece and "ssp." not in espece:
+        species_query = f"gen:{genre} sp:{espece}"
+    elif genre:
+        species_query = f"gen:{genre}"
+    else:
+        return []
+    return [f"{species_query} box:{XENOCANTO_BOX}"] + [
+        f"{species_query} cnt:{country}" for country in XENOCANTO_COUNTRIES
+    ]
+
+
+def enough_recordings(recordings, queried):
+    """Whether the recordings of the first `queried` xenocanto_queries make the later ones unnecessary:
+    a Belgian recording after the box, any Belgian or French one after a per-country query.
+    """
+    countries = {recording.get("cnt") for recording in recordings}
+    if queried == 1:
+        return XENOCANTO_COUNTRIES[0] in countries
+    return not countries.isdisjoint(XENOCANTO_COUNTRIES)
+
+
+def xenocanto_params(query):
+    return {"query": query, "key": settings.XENOCANTO_API_KEY, "per_page": 500}
+
+
+def _recording_seconds(length):
+    try:
+        seconds = 0
+        for part in length.split(":"):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def rank_recordings(recordings):
+    """Belgian recordings first, then French ones (others in the box are dropped), songs before other types,
+    then by quality (A to E, unrated last), clips of 10 s to 2 min before too short or too long ones.
+
+    A recording returned by several queries is kept once.
+    """
+    def rank(recording):
+        seconds = _recording_seconds(recording.get("length", ""))
+        return (
+            XENOCANTO_COUNTRIES.index(recording["cnt"]),
+            "song" not in recording.get("type", "").lower(),
+            XENOCANTO_QUALITIES.get(recording.get("q"), len(XENOCANTO_QUALITIES)),
+            seconds is None or not 10 <= seconds <= 120,
+        )
+
+    unique = {r["file"]: r for r in recordings if r.get("file") and r.get("cnt") in XENOCANTO_COUNTRIES}
+    return sorted(unique.values(), key=rank)
+
+
+def _photo_results(taxon, observations_by_place):
+    """Belgian observations first, French ones only when Belgium has fewer than 4."""
+    observations = observations_by_place[0]
+    if len(observations) < 4:
+        observations = observations + observations_by_place[1]
+    results = []
+    seen_urls = set()
+    for obs in observations:
+        photos = obs.get("photos", [])
+        if not photos:
+            continue
+        photo = photos[0]
+        square_url = photo.get("url", "")
+        if not square_url:
+            continue
+        medium_url = square_url.replace("/square.", "/medium.")
+        if medium_url in seen_urls:
+            continue
+        seen_urls.add(medium_url)
+        results.append(SearchResult(
+            species_id=taxon.species_id,
+            title=photo.get("attribution", "")[:300],
+            link=medium_url,
+            image_context_link=obs.get("uri", ""),
+            kind=SearchResult.PHOTO,
+            provider="inaturalist",
+        ))
+    return results
+
+
+def _sound_results(taxon, recordings):
+    results = []
+    for recording in recordings[:30]:
+        file_url = recording.get("file", "")
+        if not file_url:
+            continue
+        loc = recording.get("loc", "")
+        rec = recording.get("rec", "")
+        length = recording.get("length", "")
+        attribution = f"{rec} — {loc} ({length})"
+        results.append(SearchResult(
+            species_id=taxon.species_id,
+            title=attribution[:300],
+            link=file_url,
+            image_context_link=recording.get("url", ""),
+            kind=SearchResult.AUDIO,
+            provider="xenocanto",
+        ))
+    return results
+
+
+def fetch_images_for_taxon(taxon):
+    """Store the taxon's iNaturalist photos and return them, or None when the provider failed."""
+    taxon_id = taxon.inaturalist_taxon_id
+    if taxon_id is None:
+        if not taxon.scientific_name:
+            return []
+        try:
+            taxa_resp = provider_get(
+                "inaturalist",
+                "https://api.inaturalist.org/v1/taxa/autocomplete",
+                params=_autocomplete_params(taxon),
+                timeout=10,
+            )
+            taxa_results = taxa_resp.get("results", [])
+            if not taxa_results:
+                return []
+            taxon_id = taxa_results[0]["id"]
+            # Written back by _fetch once the media is stored, so the lookup is not repeated
+            taxon.inaturalist_taxon_id = taxon_id
+        except Exception as e:
+            print(f"Error looking up iNaturalist taxon for {taxon.scientific_name}: {e}", flush=True)
+            return None
+
+    def _fetch_obs(place_id):
+        resp = provider_get(
+            "inaturalist",
+            "https://api.inaturalist.org/v1/observations",
+            params=_observation_params(taxon_id, place_id),
+            timeout=15,
+        )
+        return resp.get("results", [])
+
+    try:
+        belgium = _fetch_obs(INATURALIST_PLACES[0])
+        france = _fetch_obs(INATURALIST_PLACES[1]) if len(belgium) < 4 else []
+        results = _photo_results(taxon, [belgium, france])
+        # Links already stored (e.g. by a concurrent fetch) are skipped by the (species, link) constraint
+        SearchResult.objects.bulk_create(results, ignore_conflicts=True)
+        return results
+    except Exception as e:
+        print(f"Error fetching iNaturalist observations for {taxon.nom_vernaculaire}: {e}", flush=True)
+        return None
+
+
+def _observations_by_taxon(taxon_ids, place_id, limit=30):
+    """The `limit` newest observations of each taxon id in a place, requested for many taxa at once.
+
+    Observations are split back to the requested taxa through their ancestry (a subspecies observation
+    belongs to its species, like in a single-taxon query). Pages follow an id cursor, and taxa that
+    already have `limit` observations are left out of the following requests.
+    """
+    observations = {taxon_id: [] for taxon_id in taxon_ids}
+    for start in range(0, len(taxon_ids), INATURALIST_BATCH_SIZE):
+        remaining = taxon_ids[start:start + INATURALIST_BATCH_SIZE]
+        id_below = None
+        while remaining:
+            params = {
+                **_observation_params(",".join(str(taxon_id) for taxon_id in remaining), place_id),
+                "per_page": INATURALIST_PAGE_SIZE,
+                "order_by": "id",
+                "order": "desc",
+            }
+            if id_below is not None:
+                params["id_below"] = id_below
+            page = provider_get(
+                "inaturalist", "https://api.inaturalist.org/v1/observations", params=params, timeout=30
+            ).get("results", [])
+            for obs in page:
+                taxon = obs.get("taxon") or {}
+                lineage = {taxon.get("id"), *(taxon.get("ancestor_ids") or [])}
+                for taxon_id in remaining:
+                    if taxon_id in lineage and len(observations[taxon_id]) < limit:
+                        observations[taxon_id].append(obs)
+            if len(page) < INATURALIST_PAGE_SIZE:
+                break
+            id_below = page[-1]["id"]
+            remaining = [taxon_id for taxon_id in remaining if len(observations[taxon_id]) < limit]
+    return observations
+
+
+def fetch_images_for_taxa(taxa):
+    """Batched fetch_images_for_taxon for taxa with a known iNaturalist id: {taxon id: results or None}.
+
+    One observations request covers up to INATURALIST_BATCH_SIZE taxa. Belgium comes first and France
+    is only asked for the taxa with fewer than 4 Belgian observations, as for a single taxon.
+
+    The results are not stored: refresh_media stores them as `prefetched`, once it holds the taxon's lease.
+    """
+    inaturalist_ids = list(dict.fromkeys(taxon.inaturalist_taxon_id for taxon in taxa))
+    try:
+        belgium = _observations_by_taxon(inaturalist_ids, INATURALIST_PLACES[0])
+        france = _observations_by_taxon(
+            [taxon_id for taxon_id in inaturalist_ids if len(belgium[taxon_id]) < 4], INATURALIST_PLACES[1]
+        )
+    except Exception as e:
+        print(f"Error fetching iNaturalist observations for {len(taxa)} taxa: {e}", flush=True)
+        return {taxon.id: None for taxon in taxa}
+
+    return {
+        taxon.id: _photo_results(
+            taxon, [belgium[taxon.inaturalist_taxon_id], france.get(taxon.inaturalist_taxon_id, [])]
+        )
+        for taxon in taxa
+    }
+
+
+def fetch_sounds_for_taxon(taxon):
+    """Store the taxon's Xeno-canto recordings and return them, or None when the provider failed."""
+    queries = xenocanto_queries(taxon.genre, taxon.espece)
+    if not queries:
+        return []
+
+    try:
+        recordings = []
+        for queried, query in enumerate(queries, 1):
+            resp = provider_get(
+                "xenocanto",
+                "https://xeno-canto.org/api/3/recordings",
+                params=xenocanto_params(query),
+                timeout=15,
+            )
+            recordings += resp.get("recordings", [])
+            if enough_recordings(recordings, queried):
+                break
+        results = _sound_results(taxon, rank_recordings(recordings))
+        SearchResult.objects.bulk_create(results, ignore_conflicts=True)
+        return results
+    except Exception as e:
+        print(f"Error fetching Xeno-canto sounds for {taxon.nom_vernaculaire}: {e}", flush=True)
+        return None
+
+
+async def afetch_images_for_taxon(taxon):
+    """Async fetch_images_for_taxon: same requests, awaited off the event loop."""
+    taxon_id = taxon.inaturalist_taxon_id
+    if taxon_id is None:
+        if not taxon.scientific_name:
+            return []
+        try:
+            taxa_resp = await aprovider_get(
+                "inaturalist",
+                "https://api.inaturalist.org/v1/taxa/autocomplete",
+                params=_autocomplete_params(taxon),
+                timeout=10,
+            )
+            taxa_results = taxa_resp.get("results", [])
+            if not taxa_results:
+                return []
+            taxon_id = taxa_results[0]["id"]
+            # Written back by _fetch once the media is stored, so the lookup is not repeated
+            taxon.inaturalist_taxon_id = taxon_id
+        except Exception as e:
+            print(f"Error looking up iNaturalist taxon for {taxon.scientific_name}: {e}", flush=True)
+            return None
+
+    async def _fetch_obs(place_id):
+        resp = await aprovider_get(
+            "inaturalist",
+            "https://api.inaturalist.org/v1/observations",
+            params=_observation_params(taxon_id, place_id),
+            timeout=15,
+        )
+        return resp.get("results", [])
+
+    try:
+        # France only when Belgium has too few, as in the sync path: the shared rate limit would serialize
+        # concurrent requests anyway
+        belgium = await _fetch_obs(INATURALIST_PLACES[0])
+        france = await _fetch_obs(INATURALIST_PLACES[1]) if len(belgium) < 4 else []
+        results = _photo_results(taxon, [belgium, france])
+        await SearchResult.objects.abulk_create(results, ignore_conflicts=True)
+        return results
+    except Exception as e:
+        print(f"Error fetching iNaturalist observations for {taxon.nom_vernaculaire}: {e}", flush=True)
+        return None
+
+
+async def afetch_sounds_for_taxon(taxon):
+    queries = xenocanto_queries(taxon.genre, taxon.espece)
+    if not queries:
+        return []
+
+    try:
+        recordings = []
+        for queried, query in enumerate(queries, 1):
+            resp = await aprovider_get(
+                "xenocanto",
+                "https://xeno-canto.org/api/3/recordings",
+                params=xenocanto_params(query),
+                timeout=15,
+            )
+            recordings += resp.get("recordings", [])
+            if enough_recordings(recordings, queried):
+                break
+        results = _sound_results(taxon, rank_recordings(recordings))
+        await SearchResult.objects.abulk_create(results, ignore_conflicts=True)
+        return results
+    except Exception as e:
+        print(f"Error fetching Xeno-canto sounds for {taxon.nom_vernaculaire}: {e}", flush=True)
+        return None
+
+
+def media_providers(taxon):
+    return ["xenocanto", "inaturalist"] if taxon.classe == "Aves" else ["inaturalist"]
+
+
+def provider_results(taxon, provider):
+    return taxon.search_results.filter(provider=provider)
+
+
+def media_of_kind(taxon, kind):
+    """The SearchResult.PHOTO or SearchResult.AUDIO media of the taxon's species."""
+    return taxon.search_results.filter(kind=kind)
+
+
+def has_media(taxon):
+    return bool(taxon.photo_count or taxon.song_count)
+
+
+def _update_species_taxa(species, **fields):
+    """Set media fields on every taxon of a species (or species id)."""
+    # update() rather than save(): media changes must not invalidate the taxonomy catalog
+    Taxon.objects.filter(species=species).update(**fields)
+
+
+def renumber_media(species):
+    """Keep `ordinal` dense (0…n-1) per kind after media of a species (or species id) was added or removed.
+
+    Existing media keeps its order. The counters of every taxon of the species are kept in sync;
+    returns them as (photo_count, song_count).
+    """
+    counts = {}
+    for kind in (SearchResult.PHOTO, SearchResult.AUDIO):
+        results = SearchResult.objects.filter(species=species, kind=kind).order_by(
+            F("ordinal").asc(nulls_last=True), "id"
+        ).only("id", "ordinal")
+        changed = []
+        for ordinal, result in enumerate(results):
+            if result.ordinal != ordinal:
+                result.ordinal = ordinal
+                changed.append(result)
+        SearchResult.objects.bulk_update(changed, ["ordinal"])
+        counts[kind] = len(results)
+    _update_species_taxa(species, photo_count=counts[SearchResult.PHOTO], song_count=counts[SearchResult.AUDIO])
+    return counts[SearchResult.PHOTO], counts[SearchResult.AUDIO]
+
+
+def _renumber(taxon):
+    taxon.photo_count, taxon.song_count = renumber_media(taxon.species_id)
+
+
+def sample_media(taxon, kind, count, exclude_ids=()):
+    """Up to `count` random media of a kind, skipping `exclude_ids`, in random order.
+
+    Draws random ordinals and fetches those rows through the (species, kind, ordinal) index, so the cost
+    does not grow with the number of media like ORDER BY random() does.
+    """
+    media = media_of_kind(taxon, kind)
+    total = taxon.photo_count if kind == SearchResult.PHOTO else taxon.song_count
+    excluded = set(media.filter(id__in=exclude_ids).values_list("ordinal", flat=True)) if exclude_ids else set()
+    count = min(count, total - len(excluded))
+    if count <= 0:
+        return []
+    ordinals = [o for o in random.sample(range(total), min(total, count + len(excluded))) if o not in excluded]
+    ordinals = ordinals[:count]
+    by_ordinal = {result.ordinal: result for result in media.filter(ordinal__in=ordinals)}
+    return [by_ordinal[ordinal] for ordinal in ordinals if ordinal in by_ordinal]
+
+
+async def asample_media(taxon, kind, count, exclude_ids=()):
+    return await sync_to_async(sample_media)(taxon, kind, count, exclude_ids)
+
+
+def _combine(fetched):
+    return None if None in fetched else [result for results in fetched for result in results]
+
+
+def _miss_backoff(misses):
+    delay = timedelta(hours=settings.MEDIA_MISS_RETRY_HOURS) * 2 ** (misses - 1)
+    return min(delay, timedelta(days=settings.MEDIA_MISS_RETRY_MAX_DAYS))
+
+
+def _failure_backoff(failures):
+    delay = timedelta(minutes=settings.MEDIA_FAILURE_RETRY_MINUTES) * 2 ** (failures - 1)
+    return min(delay, timedelta(hours=settings.MEDIA_FAILURE_RETRY_MAX_HOURS))
+
+
+def _record_refresh(taxon, fetched):
+    """Mark the providers that answered as fresh; last_update is the time of the latest successful refresh.
+
+    An empty answer is remembered as a miss and a failed one as a failure, so the provider is not asked
+    again (nor the fetch lease taken) before the back-off ends.
+    """
+    now = timezone.now()
+    for provider, results in fetched.items():
+        status, _ = MediaStatus.objects.get_or_create(
+            species_id=taxon.species_id, provider=provider, defaults={"refreshed_at": taxon.last_update or now}
+        )
+        if results is None:
+            status.failures += 1
+            status.retry_at = now + _failure_backoff(status.failures)
+        elif results:
+            status.refreshed_at = now
+            status.misses = 0
+            status.failures = 0
+            status.retry_at = None
+        else:
+            status.refreshed_at = now
+            status.misses += 1
+            status.failures = 0
+            status.retry_at = now + _miss_backoff(status.misses)
+        status.save()
+    refreshed = [provider for provider, results in fetched.items() if results is not None]
+    if refreshed:
+        taxon.last_update = now
+        _update_species_taxa(taxon.species_id, last_update=now)
+
+
+def remember_inaturalist_id(taxon, taxon_id):
+    """Write an iNaturalist id resolved from the taxon's name back to it and to the taxa sharing its species.
+
+    (inaturalist_taxon_id, version) is unique: a taxon whose dataset version already has the id on another row
+    keeps none. Those collisions are returned. The resolved taxa move to the "inat:<id>" species, with
+    the media fetched under their name.
+    """
+    key = f"inat:{taxon_id}"
+    with transaction.atomic():
+        if taxon.species_id is None:
+            taxa = [taxon]
+        else:
+            taxa = list(
+                Taxon.objects.select_for_update()
+                .filter(species_id=taxon.species_id, inaturalist_taxon_id=None)
+                .order_by("id")
+            )
+            # The taxon itself wins when several rows of one dataset share its name
+            taxa.sort(key=lambda other: other.pk != taxon.pk)
+        taken = set(Taxon.objects.filter(inaturalist_taxon_id=taxon_id).values_list("version_id", flat=True))
+        resolved = []
+        collisions = []
+        for other in taxa:
+            if other.version_id in taken:
+                collisions.append(other)
+            else:
+                taken.add(other.version_id)
+                resolved.append(other.pk)
+        Taxon.objects.filter(pk__in=resolved).update(inaturalist_taxon_id=taxon_id)
+        taxon.inaturalist_taxon_id = taxon_id if taxon.pk in resolved else None
+        if not resolved or taxon.species_id is None:
+            return collisions
+
+        old_species_id = taxon.species_id
+        target = Species.objects.filter(key=key).first()
+        if target is None and not collisions:
+            # The whole pool gets the id: rename its identity, media and statuses stay put
+            Species.objects.filter(pk=old_species_id).update(key=key)
+            return collisions
+        target = target or Species.objects.create(key=key, name=Species.name_for(taxon))
+        Taxon.objects.filter(pk__in=resolved).update(species=target)
+        known_links = set(target.search_results.values_list("link", flat=True))
+        copies = []
+        for result in SearchResult.objects.filter(species_id=old_species_id).exclude(link__in=known_links):
+            result.pk = None
+            result.species = target
+            result.ordinal = None
+            copies.append(result)
+        SearchResult.objects.bulk_create(copies, ignore_conflicts=True)
+        if not Taxon.objects.filter(species_id=old_species_id).exists():
+            known_providers = list(target.media_statuses.values_list("provider", flat=True))
+            MediaStatus.objects.filter(species_id=old_species_id).exclude(provider__in=known_providers).update(
+                species=target
+            )
+            Species.objects.filter(pk=old_species_id).delete()
+        if taxon.pk in resolved:
+            taxon.species = target
+            _renumber(taxon)
+        else:
+            renumber_media(target)
+    return collisions
+
+
+def _report_collisions(taxon_id, collisions):
+    for other in collisions:
+        print(
+            f"iNaturalist id {taxon_id} of {other.nom_vernaculaire} is already used in dataset {other.dataset}",
+            flush=True,
+        )
+
+
+def _store_fetched(taxon, fetched, unresolved):
+    """Record what the providers of a fetch sent (sync and async paths): refresh statuses and the
+    iNaturalist id resolved during the fetch, when the taxon had none (`unresolved`).
+    """
+    _record_refresh(taxon, fetched)
+    if unresolved and taxon.inaturalist_taxon_id is not None:
+        taxon_id = taxon.inaturalist_taxon_id
+        _report_collisions(taxon_id, remember_inaturalist_id(taxon, taxon_id))
+
+
+def _fetch(taxon, providers, prefetched=None):
+    fetchers = {"inaturalist": fetch_images_for_taxon, "xenocanto": fetch_sounds_for_taxon}
+    prefetched = prefetched or {}
+    unresolved = taxon.inaturalist_taxon_id is None
+    fetched = {
+        provider: prefetched[provider] if provider in prefetched else fetchers[provider](taxon)
+        for provider in providers
+    }
+    for provider in prefetched.keys() & set(providers):
+        if prefetched[provider]:
+            SearchResult.objects.bulk_create(prefetched[provider], ignore_conflicts=True)
+    _store_fetched(taxon, fetched, unresolved)
+    return fetched
+
+
+def fetch_media_for_taxon(taxon, providers=None):
+    """Fetch photos (and songs for birds); returns what the providers sent, or None if one of them failed."""
+    fetched = _fetch(taxon, providers or media_providers(taxon))
+    _renumber(taxon)
+    return _combine(fetched.values())
+
+
+async def afetch_media_for_taxon(taxon, providers=None):
+    fetchers = {"inaturalist": afetch_images_for_taxon, "xenocanto": afetch_sounds_for_taxon}
+    providers = providers or media_providers(taxon)
+    unresolved = taxon.inaturalist_taxon_id is None
+    fetched = dict(zip(providers, await asyncio.gather(*(fetchers[provider](taxon) for provider in providers))))
+    await sync_to_async(_store_fetched)(taxon, fetched, unresolved)
+    await sync_to_async(_renumber)(taxon)
+    return _combine(fetched.values())
+
+
+def refresh_media(taxon, providers=None, prefetched=None):
+    """Fetch again and replace, per provider, the media it no longer returns.
+
+    A provider that fails or returns nothing keeps its current media. `prefetched` maps providers to
+    results already fetched (not stored yet) for the taxon, e.g. by fetch_images_for_taxa.
+    """
+    fetched = _fetch(taxon, providers or media_providers(taxon), prefetched)
+    for provider, results in fetched.items():
+        if results:
+            provider_results(taxon, provider).exclude(link__in=[result.link for result in results]).delete()
+    _renumber(taxon)
+    return _combine(fetched.values())
+
+
+def missed_providers(taxon):
+    """Providers that recently had nothing for this taxon's species, or failed, and are not to be asked again yet."""
+    statuses = MediaStatus.objects.filter(species_id=taxon.species_id, retry_at__gt=timezone.now())
+    return set(statuses.values_list("provider", flat=True))
+
+
+def fetchable_providers(taxon):
+    missed = missed_providers(taxon)
+    return [provider for provider in media_providers(taxon) if provider not in missed]
+
+
+def stale_providers(taxon):
+    """Providers whose media of this taxon is older than their MEDIA_TTL_DAYS.
+
+    Misses and failures wait for their retry_at instead.
+    """
+    now = timezone.now()
+    statuses = {status.provider: status for status in MediaStatus.objects.filter(species_id=taxon.species_id)}
+    stale = []
+    for provider in media_providers(taxon):
+        status = statuses.get(provider)
+        if status is None:
+            # Media fetched before per-provider statuses existed only has the taxon's last_update
+            refreshed_at = taxon.last_update
+        elif status.retry_at:
+            if status.retry_at <= now:
+                stale.append(provider)
+            continue
+        else:
+            refreshed_at = status.refreshed_at
+        if refreshed_at is None or refreshed_at < now - timedelta(days=settings.MEDIA_TTL_DAYS[provider]):
+            stale.append(provider)
+    return stale
+
+
+def acquire_media_lease(taxon):
+    """Take the fetch lease of the taxon's species: returns its token, or None while another process holds it."""
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.MEDIA_FETCH_LEASE_SECONDS)
+    # The token names the species: resolving the taxon's iNaturalist id during the fetch may move it to another
+    token = (taxon.species_id, expires_at)
+    try:
+        with transaction.atomic():
+            MediaFetchLease.objects.create(species_id=taxon.species_id, expires_at=expires_at)
+        return token
+    except IntegrityError:
+        # Take over a lease left behind by a crashed process
+        expired = MediaFetchLease.objects.filter(species_id=taxon.species_id, expires_at__lte=now)
+        if expired.update(expires_at=expires_at):
+            return token
+        return None
+
+
+def release_media_lease(taxon, token):
+    # Only our own lease: if it expired meanwhile, another process may hold it now
+    species_id, expires_at = token
+    MediaFetchLease.objects.filter(species_id=species_id, expires_at=expires_at).delete()
+
+
+def media_fetch_in_progress(taxon):
+    """Whether another process currently holds the fetch lease of the taxon's species."""
+    return MediaFetchLease.objects.filter(species_id=taxon.species_id, expires_at__gt=timezone.now()).exists()
+
+
+def _wait_deadline():
+    wait = settings.MEDIA_FETCH_WAIT
+    remaining = remaining_budget()
+    if remaining is not None:
+        wait = min(wait, remaining)
+    return time.monotonic() + wait
+
+
+def _refresh_in_background(taxon, providers, token):
+    try:
+        refresh_media(taxon, providers)
+    except Exception as e:
+        print(f"Error refreshing media for {taxon.nom_vernaculaire}: {e}", flush=True)
+    finally:
+        release_media_lease(taxon, token)
+        # This thread has its own connection
+        connection.close()
+
+
+def revalidate_media(taxon):
+    """Stale-while-revalidate: start a background refresh of the taxon's stale providers, if any.
+
+    The caller keeps serving the current media. Returns whether a refresh was started.
+    """
+    providers = stale_providers(taxon)
+    if not providers:
+        return False
+    token = acquire_media_lease(taxon)
+    if token is None:
+        return False
+    threading.Thread(target=_refresh_in_background, args=(taxon, providers, token), daemon=True).start()
+    return True
+
+
+def ensure_media(taxon):
+    """Fetch photos (and songs for birds) of a taxon that has none yet, and revalidate stale ones.
+
+    Single flight: while a process fetches a taxon, concurrent callers wait (at most MEDIA_FETCH_WAIT
+    seconds) for its results instead of querying the providers again. Providers that recently had
+    nothing for the taxon are skipped without any network call.
+
+    Media belongs to the taxon's species: taxa of the same species in other datasets share it.
+    """
+    if has_media(taxon):
+        revalidate_media(taxon)
+        return
+    if taxon.species_id is None:
+        return
+    providers = fetchable_providers(taxon)
+    if not providers:
+        return
+    token = acquire_media_lease(taxon)
+    if token is None:
+        deadline = _wait_deadline()
+        while time.monotonic() < deadline and media_fetch_in_progress(taxon):
+            time.sleep(0.2)
+        taxon.refresh_from_db(fields=["photo_count", "song_count"])
+        return
+    try:
+        # The previous lease holder may have finished between our check and the lease
+        taxon.refresh_from_db(fields=["photo_count", "song_count"])
+        if not has_media(taxon):
+            fetch_media_for_taxon(taxon, providers)
+    finally:
+        release_media_lease(taxon, token)
+
+
+async def aensure_media(taxon):
+    if has_media(taxon):
+        await sync_to_async(revalidate_media)(taxon)
+        return
+    if taxon.species_id is None:
+        return
+    providers = await sync_to_async(fetchable_providers)(taxon)
+    if not providers:
+        return
+    token = await sync_to_async(acquire_media_lease)(taxon)
+    if token is None:
+        deadline = _wait_deadline()
+        while time.monotonic() < deadline and await sync_to_async(media_fetch_in_progress)(taxon):
+            await asyncio.sleep(0.2)
+        await taxon.arefresh_from_db(fields=["photo_count", "song_count"])
+        return
+    try:
+        await taxon.arefresh_from_db(fields=["photo_count", "song_count"])
+        if not has_media(taxon):
+            await afetch_media_for_taxon(taxon, providers)
+    finally:
+        await sync_to_async(release_media_lease)(taxon, token)
@@ -0,0 +1,33 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("taxons", "0005_taxon_inaturalist_taxon_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReviewItem",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("session_id", models.CharField(max_length=100)),
+                ("box", models.PositiveSmallIntegerField(default=0)),
+                ("due_at", models.DateTimeField()),
+                (
+                    "taxon",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="review_items",
+                        to="taxons.taxon",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("session_id", "taxon")},
+                "indexes": [models.Index(fields=["session_id", "due_at"], name="taxons_revi_session_798614_idx")],
+            },
+        ),
+    ]
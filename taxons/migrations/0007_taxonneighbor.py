@@ -0,0 +1,39 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("taxons", "0006_reviewitem"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TaxonNeighbor",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("category", models.CharField(blank=True, max_length=200)),
+                ("rank", models.PositiveSmallIntegerField()),
+                (
+                    "neighbor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="taxons.taxon",
+                    ),
+                ),
+                (
+                    "taxon",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="neighbors",
+                        to="taxons.taxon",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("taxon", "category", "neighbor")},
+            },
+        ),
+    ]
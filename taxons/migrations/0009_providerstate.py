@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("taxons", "0008_catalogversion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProviderState",
+            fields=[
+                ("provider", models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ("tokens", models.FloatField(default=0)),
+                ("refilled_at", models.DateTimeField()),
+                ("consecutive_failures", models.PositiveIntegerField(default=0)),
+                (
+                    "open_until",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Appels court-circuités jusqu'à cette date après trop d'échecs",
+                        null=True,
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,47 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_links(apps, schema_editor):
+    SearchResult = apps.get_model("taxons", "SearchResult")
+    duplicates = (
+        SearchResult.objects.values("taxon_id", "link")
+        .annotate(first_id=Min("id"), total=Count("id"))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates:
+        SearchResult.objects.filter(taxon_id=duplicate["taxon_id"], link=duplicate["link"]).exclude(
+            id=duplicate["first_id"]
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("taxons", "0009_providerstate"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_links, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name="searchresult",
+            unique_together={("taxon", "link")},
+        ),
+        migrations.CreateModel(
+            name="MediaFetchLease",
+            fields=[
+                (
+                    "taxon",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="media_fetch_lease",
+                        serialize=False,
+                        to="taxons.taxon",
+                    ),
+                ),
+                ("expires_at", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("taxons", "0010_searchresult_unique_link_mediafetchlease"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MediaStatus",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("provider", models.CharField(max_length=50)),
+                ("refreshed_at", models.DateTimeField()),
+                (
+                    "taxon",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="media_statuses",
+                        to="taxons.taxon",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("taxon", "provider")},
+            },
+        ),
+    ]
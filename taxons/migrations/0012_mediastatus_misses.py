@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("taxons", "0011_mediastatus"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mediastatus",
+            name="misses",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="mediastatus",
+            name="retry_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Aucun résultat chez ce fournisseur : pas de nouvelle recherche avant cette date",
+                null=True,
+            ),
+        ),
+    ]
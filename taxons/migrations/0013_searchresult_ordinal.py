@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+def number_media(apps, schema_editor):
+    SearchResult = apps.get_model("taxons", "SearchResult")
+    next_ordinal = {}
+    changed = []
+    for result in SearchResult.objects.order_by("taxon_id", "id").only("id", "taxon_id", "image_context_link"):
+        key = (result.taxon_id, "xeno-canto" in result.image_context_link)
+        result.ordinal = next_ordinal.get(key, 0)
+        next_ordinal[key] = result.ordinal + 1
+        changed.append(result)
+    SearchResult.objects.bulk_update(changed, ["ordinal"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("taxons", "0012_mediastatus_misses"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="searchresult",
+            name="ordinal",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="searchresult",
+            index=models.Index(fields=["taxon", "ordinal"], name="taxons_sear_taxon_i_bd3892_idx"),
+        ),
+        migrations.RunPython(number_media, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_kinds_and_counts(apps, schema_editor):
+    SearchResult = apps.get_model("taxons", "SearchResult")
+    Taxon = apps.get_model("taxons", "Taxon")
+    SearchResult.objects.filter(image_context_link__contains="xeno-canto").update(kind="audio", provider="xenocanto")
+    counts = SearchResult.objects.values("taxon_id").annotate(
+        photos=Count("id", filter=Q(kind="photo")),
+        songs=Count("id", filter=Q(kind="audio")),
+    )
+    for row in counts:
+        Taxon.objects.filter(id=row["taxon_id"]).update(photo_count=row["photos"], song_count=row["songs"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("taxons", "0013_searchresult_ordinal"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="searchresult",
+            name="kind",
+            field=models.CharField(choices=[("photo", "Photo"), ("audio", "Son")], default="photo", max_length=10),
+        ),
+        migrations.AddField(
+            model_name="searchresult",
+            name="provider",
+            field=models.CharField(default="inaturalist", max_length=50),
+        ),
+        migrations.AddField(
+            model_name="taxon",
+            name="photo_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="taxon",
+            name="song_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RemoveIndex(
+            model_name="searchresult",
+            name="taxons_sear_taxon_i_bd3892_idx",
+        ),
+        migrations.AddIndex(
+            model_name="searchresult",
+            index=models.Index(fields=["taxon", "kind", "ordinal"], name="taxons_sear_taxon_i_3609a8_idx"),
+        ),
+        migrations.RunPython(backfill_kinds_and_counts, migrations.RunPython.noop),
+    ]
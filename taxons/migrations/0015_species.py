@@ -0,0 +1,124 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def species_key(taxon):
+    if taxon.inaturalist_taxon_id is not None:
+        return f"inat:{taxon.inaturalist_taxon_id}"
+    if taxon.espece and "spp." not in taxon.espece and "ssp." not in taxon.espece:
+        name = f"{taxon.genre} {taxon.espece}"
+    else:
+        name = taxon.genre or taxon.famille or taxon.ordre or taxon.classe or taxon.embranchement or taxon.regne
+    if not name:
+        return None
+    return "name:" + " ".join(name.lower().split())
+
+
+def merge_media_by_species(apps, schema_editor):
+    """Point every taxon at its species and pool the media of taxa sharing one, dropping duplicate links."""
+    Species = apps.get_model("taxons", "Species")
+    Taxon = apps.get_model("taxons", "Taxon")
+    SearchResult = apps.get_model("taxons", "SearchResult")
+    MediaStatus = apps.get_model("taxons", "MediaStatus")
+
+    species_of_taxon = {}
+    for taxon in Taxon.objects.all():
+        key = species_key(taxon)
+        if key is None:
+            continue
+        species, _ = Species.objects.get_or_create(key=key)
+        taxon.species = species
+        taxon.save(update_fields=["species"])
+        species_of_taxon[taxon.id] = species.id
+
+    seen_links = set()
+    for result in SearchResult.objects.order_by("id"):
+        species_id = species_of_taxon.get(result.taxon_id)
+        if species_id is None or (species_id, result.link) in seen_links:
+            result.delete()
+            continue
+        seen_links.add((species_id, result.link))
+        result.species_id = species_id
+        result.save(update_fields=["species"])
+
+    # Most recent status per (species, provider)
+    seen_statuses = set()
+    for status in MediaStatus.objects.order_by("-refreshed_at"):
+        species_id = species_of_taxon.get(status.taxon_id)
+        if species_id is None or (species_id, status.provider) in seen_statuses:
+            status.delete()
+            continue
+        seen_statuses.add((species_id, status.provider))
+        status.species_id = species_id
+        status.save(update_fields=["species"])
+
+    # Renumber the pooled media and share the counters between the taxa of each species
+    for species_id in set(species_of_taxon.values()):
+        counts = {}
+        for kind in ("photo", "audio"):
+            results = list(SearchResult.objects.filter(species_id=species_id, kind=kind).order_by("ordinal", "id"))
+            for ordinal, result in enumerate(results):
+                result.ordinal = ordinal
+            SearchResult.objects.bulk_update(results, ["ordinal"])
+            counts[kind] = len(results)
+        Taxon.objects.filter(species_id=species_id).update(photo_count=counts["photo"], song_count=counts["audio"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("taxons", "0014_searchresult_kind_taxon_media_counts"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Species",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("key", models.CharField(max_length=250, unique=True)),
+            ],
+            options={
+                "verbose_name_plural": "species",
+            },
+        ),
+        migrations.AddField(
+            model_name="taxon",
+            name="species",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="taxa",
+                to="taxons.species",
+            ),
+        ),
+        migrations.AddField(
+            model_name="searchresult",
+            name="species",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="search_results",
+                to="taxons.species",
+            ),
+        ),
+        migrations.AddField(
+            model_name="mediastatus",
+            name="species",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="media_statuses",
+                to="taxons.species",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="searchresult",
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name="mediastatus",
+            unique_together=set(),
+        ),
+        migrations.RunPython(merge_media_by_species, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("taxons", "0015_species"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="searchresult",
+            name="taxons_sear_taxon_i_3609a8_idx",
+        ),
+        migrations.RemoveField(
+            model_name="searchresult",
+            name="taxon",
+        ),
+        migrations.AlterField(
+            model_name="searchresult",
+            name="species",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="search_results",
+                to="taxons.species",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="searchresult",
+            unique_together={("species", "link")},
+        ),
+        migrations.AddIndex(
+            model_name="searchresult",
+            index=models.Index(fields=["species", "kind", "ordinal"], name="taxons_sear_species_2d9eb5_idx"),
+        ),
+        migrations.RemoveField(
+            model_name="mediastatus",
+            name="taxon",
+        ),
+        migrations.AlterField(
+            model_name="mediastatus",
+            name="species",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="media_statuses",
+                to="taxons.species",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="mediastatus",
+            unique_together={("species", "provider")},
+        ),
+        # Leases only live for the duration of a fetch
+        migrations.DeleteModel(
+            name="MediaFetchLease",
+        ),
+        migrations.CreateModel(
+            name="MediaFetchLease",
+            fields=[
+                (
+                    "species",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="media_fetch_lease",
+                        serialize=False,
+                        to="taxons.species",
+                    ),
+                ),
+                ("expires_at", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+
+def fill_species_names(apps, schema_editor):
+    Species = apps.get_model("taxons", "Species")
+    Taxon = apps.get_model("taxons", "Taxon")
+    for species in Species.objects.all():
+        if species.key.startswith("name:"):
+            species.name = species.key[len("name:"):]
+        else:
+            taxon = Taxon.objects.filter(species=species).order_by("id").first()
+            if taxon is None:
+                continue
+            if taxon.espece and "spp." not in taxon.espece and "ssp." not in taxon.espece:
+                name = f"{taxon.genre} {taxon.espece}"
+            else:
+                name = taxon.genre or taxon.famille or taxon.ordre or taxon.classe or taxon.embranchement or taxon.regne
+            species.name = " ".join((name or "").lower().split())
+        species.save(update_fields=["name"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("taxons", "0016_media_by_species"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="species",
+            name="name",
+            field=models.CharField(blank=True, db_index=True, max_length=250),
+        ),
+        migrations.RunPython(fill_species_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,14 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("taxons", "0017_species_name"),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name="taxon",
+            unique_together={("inaturalist_taxon_id", "dataset"), ("dataset", "nom_vernaculaire")},
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("taxons", "0018_taxon_unique_dataset_nom_vernaculaire"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="taxon",
+            name="source_hash",
+            field=models.CharField(
+                blank=True,
+                help_text="Empreinte de la ligne importée : import_taxons ne retraite que les lignes modifiées",
+                max_length=64,
+            ),
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations, models
+from django.utils import timezone
+
+import django.db.models.deletion
+
+
+def create_active_versions(apps, schema_editor):
+    DatasetVersion = apps.get_model("taxons", "DatasetVersion")
+    Taxon = apps.get_model("taxons", "Taxon")
+    for dataset in Taxon.objects.values_list("dataset", flat=True).distinct().order_by("dataset"):
+        version = DatasetVersion.objects.create(dataset=dataset, active=True, activated_at=timezone.now())
+        Taxon.objects.filter(dataset=dataset).update(version=version)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("taxons", "0019_taxon_source_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DatasetVersion",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("dataset", models.CharField(max_length=50)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("activated_at", models.DateTimeField(blank=True, null=True)),
+                ("active", models.BooleanField(default=False)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("active", True)),
+                        fields=("dataset",),
+                        name="one_active_version_per_dataset",
+                    )
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="taxon",
+            name="version",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="taxa",
+                to="taxons.datasetversion",
+            ),
+        ),
+        migrations.RunPython(create_active_versions, migrations.RunPython.noop),
+    ]
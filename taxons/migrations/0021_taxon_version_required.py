@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("taxons", "0020_datasetversion"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="taxon",
+            name="version",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="taxa",
+                to="taxons.datasetversion",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="taxon",
+            unique_together={("inaturalist_taxon_id", "version"), ("version", "nom_vernaculaire")},
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("taxons", "0021_taxon_version_required"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mediastatus",
+            name="failures",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="mediastatus",
+            name="retry_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Aucun résultat ou erreur chez ce fournisseur : pas de nouvelle recherche avant cette date",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.urls import reverse
+from taxons.utils import requests_session
+from urllib.parse import urlparse
+
+import hashlib
+import os
+import tempfile
+
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+
+def mirror_enabled():
+    return bool(settings.MEDIA_MIRROR_ROOT)
+
+
+def mirror_name(link):
+    """Relative path of a provider URL in the mirror, named after the URL's hash, e.g. `3f/3fa2….jpg`.
+
+    Keyed on the URL rather than on the downloaded bytes, so that pages can tell whether a photo is
+    mirrored without downloading it.
+    """
+    digest = hashlib.sha256(link.encode("utf-8")).hexdigest()
+    extension = os.path.splitext(urlparse(link).path)[1].lower()
+    if extension not in IMAGE_EXTENSIONS:
+        extension = ".jpg"
+    return f"{digest[:2]}/{digest}{extension}"
+
+
+def mirror_file(name):
+    return os.path.join(settings.MEDIA_MIRROR_ROOT, name)
+
+
+def mirrored_url(link):
+    """URL to serve `link` from: the local mirror once cached, the provider otherwise."""
+    if not mirror_enabled() or not link:
+        return link
+    name = mirror_name(link)
+    if not os.path.exists(mirror_file(name)):
+        return link
+    return reverse("mirror", args=[name])
+
+
+def mirror_link(link):
+    """Download `link` into the mirror if not cached yet. Returns True when the file is cached."""
+    path = mirror_file(mirror_name(link))
+    if os.path.exists(path):
+        return True
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    resp = requests_session().get(link, timeout=30, stream=True)
+    resp.raise_for_status()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".download-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in resp.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+
+def touch(name):
+    """Mark a mirrored file as recently used (LRU eviction orders files by mtime)."""
+    try:
+        os.utime(mirror_file(name))
+    except OSError:
+        pass
+
+
+def evict(max_bytes=None):
+    """Delete the least recently used files until the mirror fits in MEDIA_MIRROR_MAX_BYTES."""
+    max_bytes = settings.MEDIA_MIRROR_MAX_BYTES if max_bytes is None else max_bytes
+    files = []
+    total = 0
+    for directory, _, names in os.walk(settings.MEDIA_MIRROR_ROOT):
+        for name in names:
+            if name.startswith("."):
+                continue
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    evicted = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        evicted += 1
+    return evicted
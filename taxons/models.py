@@ -1,4 +1,88 @@
 from django.db import models
+from django.db import transaction
+from django.utils import timezone
+
+
+class Species(models.Model):
+    """Media identity shared by every dataset row of the same species.
+
+    `key` is "inat:<inaturalist_taxon_id>" when the id is known, else "name:<normalized scientific name>".
+    `name` keeps the normalized scientific name once the id is known, so taxa still without one join the species.
+    """
+
+    key = models.CharField(max_length=250, unique=True)
+    name = models.CharField(max_length=250, blank=True, db_index=True)
+
+    class Meta:
+        verbose_name_plural = "species"
+
+    def __str__(self):
+        return self.key
+
+    @staticmethod
+    def name_for(taxon):
+        return " ".join(taxon.scientific_name.lower().split()) if taxon.scientific_name else ""
+
+    @staticmethod
+    def key_for(taxon):
+        if taxon.inaturalist_taxon_id is not None:
+            return f"inat:{taxon.inaturalist_taxon_id}"
+        if taxon.scientific_name:
+            return "name:" + Species.name_for(taxon)
+        return None
+
+    def matches(self, taxon):
+        if self.key == Species.key_for(taxon):
+            return True
+        return taxon.inaturalist_taxon_id is None and bool(self.name) and self.name == Species.name_for(taxon)
+
+    @classmethod
+    def for_taxon(cls, taxon):
+        key = cls.key_for(taxon)
+        if key is None:
+            return None
+        species = cls.objects.filter(key=key).first()
+        if species is None and taxon.inaturalist_taxon_id is None:
+            species = cls.objects.filter(name=cls.name_for(taxon)).order_by("id").first()
+        return species or cls.objects.get_or_create(key=key, defaults={"name": cls.name_for(taxon)})[0]
+
+
+class DatasetVersion(models.Model):
+    """One import of a dataset. Its taxa are not rewritten by later imports: the next import writes a new
+    version and taxons.versions.activate_version switches the dataset to it in one transaction.
+    """
+
+    dataset = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(blank=True, null=True)
+    active = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dataset"], condition=models.Q(active=True), name="one_active_version_per_dataset"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.dataset or '(sans dataset)'} v{self.pk}" + (" (active)" if self.active else "")
+
+    @classmethod
+    def active_for(cls, dataset):
+        """The dataset's active version, created for taxa added outside import_taxons (admin, tests)."""
+        version = cls.objects.filter(dataset=dataset, active=True).first()
+        if version is None:
+            with transaction.atomic():
+                version, _ = cls.objects.get_or_create(
+                    dataset=dataset, active=True, defaults={"activated_at": timezone.now()}
+                )
+        return version
+
+
+class TaxonQuerySet(models.QuerySet):
+    def active(self):
+        """Taxa of the active version of their dataset, the only ones players see."""
+        return self.filter(version__active=True)
 
 
 class Taxon(models.Model):
@@ -13,27 +97,122 @@ class Taxon(models.Model):
     partie_etat_indice = models.CharField(max_length=200)
     category = models.CharField(max_length=200, blank=True, db_index=True)
     dataset = models.CharField(max_length=50, db_index=True, default="")
+    version = models.ForeignKey(DatasetVersion, on_delete=models.CASCADE, related_name="taxa")
 
     last_update = models.DateTimeField(
         blank=True, null=True, help_text="Date de la dernière mise à jour des résultats de recherche d'images"
     )
     inaturalist_taxon_id = models.IntegerField(null=True, blank=True)
+    species = models.ForeignKey(Species, on_delete=models.SET_NULL, null=True, blank=True, related_name="taxa")
+    # Media of the species, kept in sync by taxons.media.renumber_media
+    photo_count = models.PositiveIntegerField(default=0)
+    song_count = models.PositiveIntegerField(default=0)
+    source_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        help_text="Empreinte de la ligne importée : import_taxons ne retraite que les lignes modifiées",
+    )
+
+    objects = TaxonQuerySet.as_manager()
 
     class Meta:
-        unique_together = [("inaturalist_taxon_id", "dataset")]
+        unique_together = [("inaturalist_taxon_id", "version"), ("version", "nom_vernaculaire")]
 
     def __str__(self):
         return self.nom_vernaculaire
 
+    def save(self, *args, **kwargs):
+        if self.version_id is None:
+            self.version = DatasetVersion.active_for(self.dataset)
+        self.assign_species()
+        super().save(*args, **kwargs)
+
+    def assign_species(self):
+        """Point the taxon at the species matching its name or id; call it before bulk_create/bulk_update."""
+        if not (self.species.matches(self) if self.species_id else Species.key_for(self) is None):
+            self.species = Species.for_taxon(self)
+            # Take over the counters of the new species' media pool
+            pool = Taxon.objects.filter(species_id=self.species_id).exclude(pk=self.pk)
+            counters = pool.values_list("photo_count", "song_count").first() if self.species_id else None
+            self.photo_count, self.song_count = counters or (0, 0)
+
+    @property
+    def search_results(self):
+        """Media of the taxon's species, shared with the other datasets."""
+        if self.species_id is None:
+            return SearchResult.objects.none()
+        return SearchResult.objects.filter(species_id=self.species_id)
+
+    @property
+    def scientific_name(self):
+        """Most precise scientific name available: species, else the lowest known rank."""
+        if self.espece and "spp." not in self.espece and "ssp." not in self.espece:
+            return f"{self.genre} {self.espece}"
+        return self.genre or self.famille or self.ordre or self.classe or self.embranchement or self.regne or None
+
 
 class SearchResult(models.Model):
-    taxon = models.ForeignKey(Taxon, on_delete=models.CASCADE, related_name="search_results")
+    PHOTO = "photo"
+    AUDIO = "audio"
+    KIND_CHOICES = [(PHOTO, "Photo"), (AUDIO, "Son")]
+
+    species = models.ForeignKey(Species, on_delete=models.CASCADE, related_name="search_results")
     title = models.CharField(max_length=300)
     link = models.URLField(max_length=500)
     image_context_link = models.URLField(max_length=500)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=PHOTO)
+    provider = models.CharField(max_length=50, default="inaturalist")
+    # Dense 0…n-1 position among the species' media of the same kind, so random picks fetch rows by index
+    ordinal = models.PositiveIntegerField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ("species", "link")
+        indexes = [
+            models.Index(fields=["species", "kind", "ordinal"]),
+        ]
 
     def __str__(self):
-        return f"{self.taxon.nom_vernaculaire} - {self.title}"
+        return f"{self.species} - {self.title}"
+
+
+class MediaStatus(models.Model):
+    """Last successful media refresh of a species from one provider, compared to MEDIA_TTL_DAYS.
+
+    `misses` counts the refreshes in a row where the provider had nothing for the species, `failures` those
+    where it failed; the provider is not asked again before `retry_at`, which backs off exponentially.
+    """
+
+    species = models.ForeignKey(Species, on_delete=models.CASCADE, related_name="media_statuses")
+    provider = models.CharField(max_length=50)
+    refreshed_at = models.DateTimeField()
+    misses = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    retry_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="Aucun résultat ou erreur chez ce fournisseur : pas de nouvelle recherche avant cette date",
+    )
+
+    class Meta:
+        unique_together = ("species", "provider")
+
+    def __str__(self):
+        return f"{self.species} - {self.provider}: {self.refreshed_at:%Y-%m-%d}"
+
+
+class MediaFetchLease(models.Model):
+    """Held while one process fetches a species' media, so concurrent requests wait for it instead of fetching too.
+
+    An expired lease was left behind by a crashed process and can be taken over.
+    """
+
+    species = models.OneToOneField(
+        Species, on_delete=models.CASCADE, primary_key=True, related_name="media_fetch_lease"
+    )
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.species} (jusqu'à {self.expires_at:%H:%M:%S})"
 
 
 class UserScore(models.Model):
@@ -51,3 +230,65 @@ class UserScore(models.Model):
 
     def __str__(self):
         return f"{self.session_id[:8]} - {self.taxon.nom_vernaculaire}: {self.score}"
+
+
+class ReviewItem(models.Model):
+    """Spaced-repetition state of one taxon for one session (Leitner box + due date)."""
+
+    session_id = models.CharField(max_length=100)
+    taxon = models.ForeignKey(Taxon, on_delete=models.CASCADE, related_name="review_items")
+    box = models.PositiveSmallIntegerField(default=0)
+    due_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("session_id", "taxon")
+        indexes = [
+            models.Index(fields=["session_id", "due_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.session_id[:8]} - {self.taxon.nom_vernaculaire}: box {self.box}"
+
+
+class TaxonNeighbor(models.Model):
+    """Distractor candidate precomputed by import_taxons for a taxon within a (dataset, category) scope.
+
+    `rank` is the closest shared taxonomic rank (0 = genre … 4 = embranchement, 5 = none).
+    An empty `category` is the scope of the whole dataset.
+    """
+
+    taxon = models.ForeignKey(Taxon, on_delete=models.CASCADE, related_name="neighbors")
+    neighbor = models.ForeignKey(Taxon, on_delete=models.CASCADE, related_name="+")
+    category = models.CharField(max_length=200, blank=True)
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ("taxon", "category", "neighbor")
+
+    def __str__(self):
+        return f"{self.taxon.nom_vernaculaire} → {self.neighbor.nom_vernaculaire} ({self.rank})"
+
+
+class CatalogVersion(models.Model):
+    """Single row bumped whenever the taxonomy changes, so every worker reloads its in-memory catalog."""
+
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Catalog v{self.version}"
+
+
+class ProviderState(models.Model):
+    """Rate limit bucket and health of an external media provider, shared by every process."""
+
+    provider = models.CharField(max_length=50, primary_key=True)
+    tokens = models.FloatField(default=0)
+    refilled_at = models.DateTimeField()
+    consecutive_failures = models.PositiveIntegerField(default=0)
+    open_until = models.DateTimeField(
+        blank=True, null=True, help_text="Appels court-circuités jusqu'à cette date après trop d'échecs"
+    )
+
+    def __str__(self):
+        return self.provider
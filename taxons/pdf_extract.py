@@ -0,0 +1,165 @@
+from concurrent.futures import ProcessPoolExecutor
+from django.db import connections
+from pdfminer.pdftypes import PDFObjRef
+from pdfminer.pdftypes import PDFStream
+from pdfminer.pdftypes import resolve1
+
+import hashlib
+import json
+import os
+import pdfplumber
+
+
+# Bump when the rows extracted from a page, or its hash, change, so that every cached page is parsed again
+EXTRACTOR_VERSION = 2
+# Pages handed to a worker at once (each task opens the PDF once)
+CHUNKS_PER_WORKER = 4
+
+
+def page_rows(page):
+    """Taxon rows of the tables of one page, header rows and rows without nom vernaculaire left out."""
+    rows = []
+    for tb in page.extract_tables():
+        for sub_tb in tb:
+            regne = sub_tb[0]
+            nom_vernaculaire = sub_tb[-2]
+            if regne != "Règne" and nom_vernaculaire:
+                rows.append(
+                    tuple(
+                        [
+                            (
+                                str(cell.strip().replace("-\n", "").replace("\n", " "))
+                                if cell and cell != "-"
+                                else None
+                            )
+                            for cell in sub_tb
+                        ]
+                    )
+                )
+    return rows
+
+
+def _object_digest(obj, memo):
+    """SHA-256 of a PDF object with its references resolved, streams with their data.
+
+    `memo` maps object ids to their digest: a font or form shared by every page is read once per file.
+    """
+    if isinstance(obj, PDFObjRef):
+        if obj.objid not in memo:
+            # A reference cycle hashes as empty
+            memo[obj.objid] = b""
+            memo[obj.objid] = _object_digest(resolve1(obj), memo)
+        return memo[obj.objid]
+    digest = hashlib.sha256()
+    if isinstance(obj, PDFStream):
+        digest.update(_object_digest(obj.attrs, memo))
+        digest.update(obj.get_data())
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=str):
+            digest.update(f"/{key}".encode())
+            digest.update(_object_digest(obj[key], memo))
+    elif isinstance(obj, (list, tuple)):
+        digest.update(b"[")
+        for item in obj:
+            digest.update(_object_digest(item, memo))
+        digest.update(b"]")
+    else:
+        digest.update(repr(obj).encode())
+    return digest.digest()
+
+
+def page_hash(page, memo=None):
+    """Content hash of a page: its size, drawing instructions and resources (fonts, images, forms), with the
+    extractor version.
+    """
+    digest = hashlib.sha256(f"{EXTRACTOR_VERSION}:{pdfplumber.__version__}:{list(page.mediabox)}".encode())
+    for stream in page.page_obj.contents:
+        digest.update(resolve1(stream).get_data())
+    digest.update(_object_digest(page.page_obj.resources, {} if memo is None else memo))
+    return digest.hexdigest()
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_pages(pdf_path, page_numbers):
+    """{page number: rows} of some pages of the PDF; runs in the pool workers."""
+    with pdfplumber.open(pdf_path) as pdf:
+        return {number: page_rows(pdf.pages[number]) for number in page_numbers}
+
+
+def parse_pages(pdf_path, page_numbers, workers):
+    """Rows of the given pages, parsed by a pool of `workers` processes when there is more than one page."""
+    if workers <= 1 or len(page_numbers) <= 1:
+        return extract_pages(pdf_path, page_numbers)
+    size = max(1, -(-len(page_numbers) // (workers * CHUNKS_PER_WORKER)))
+    chunks = [page_numbers[start:start + size] for start in range(0, len(page_numbers), size)]
+    parsed = {}
+    # Forked workers would inherit the parent's database connections; they never use them
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        for rows in pool.map(extract_pages, [pdf_path] * len(chunks), chunks):
+            parsed.update(rows)
+    return parsed
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    # Written aside then renamed: a concurrent or interrupted run never reads half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def page_hashes(pdf_path, cache_dir):
+    """Content hashes of the pages, from the manifest of this exact file when a previous run wrote one."""
+    manifest_path = os.path.join(cache_dir, "manifests", f"{file_hash(pdf_path)}.json")
+    manifest = _read_json(manifest_path)
+    if manifest is not None and manifest.get("extractor") == EXTRACTOR_VERSION:
+        return manifest["pages"]
+    with pdfplumber.open(pdf_path) as pdf:
+        memo = {}
+        hashes = [page_hash(page, memo) for page in pdf.pages]
+    _write_json(manifest_path, {"extractor": EXTRACTOR_VERSION, "pages": hashes})
+    return hashes
+
+
+def extract_rows(pdf_path, cache_dir="", workers=None):
+    """Taxon rows of every table of the PDF, in page order.
+
+    Pages are parsed by a process pool. With a `cache_dir`, the rows of each page are kept under the page's
+    content hash: a second run of the same file parses nothing, and a revised file only the pages that changed.
+    """
+    workers = workers or os.cpu_count() or 1
+    if not cache_dir:
+        with pdfplumber.open(pdf_path) as pdf:
+            count = len(pdf.pages)
+        parsed = parse_pages(pdf_path, list(range(count)), workers)
+        return [row for number in range(count) for row in parsed[number]]
+
+    hashes = page_hashes(pdf_path, cache_dir)
+    pages = {}
+    for number, digest in enumerate(hashes):
+        rows = _read_json(os.path.join(cache_dir, "pages", f"{digest}.json"))
+        if rows is not None:
+            pages[number] = [tuple(row) for row in rows]
+    missing = [number for number in range(len(hashes)) if number not in pages]
+    parsed = parse_pages(pdf_path, missing, workers) if missing else {}
+    for number, rows in parsed.items():
+        _write_json(os.path.join(cache_dir, "pages", f"{hashes[number]}.json"), rows)
+        pages[number] = rows
+    return [row for number in range(len(hashes)) for row in pages[number]]
@@ -0,0 +1,90 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from taxons.models import ProviderState
+
+import time
+
+
+class ProviderUnavailable(Exception):
+    """The provider is skipped: its circuit is open or the request has no time left for it."""
+
+
+class DeadlineExceeded(ProviderUnavailable):
+    pass
+
+
+_deadline = ContextVar("provider_deadline", default=None)
+
+
+@contextmanager
+def outbound_budget(seconds):
+    """Cap the total time spent waiting on providers inside the block (nested budgets only shrink)."""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget():
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def acquire(provider):
+    """Take a token from the provider's shared bucket, waiting for one if needed.
+
+    The bucket lives in a ProviderState row locked with SELECT … FOR UPDATE, so every
+    worker and management command shares the same rate limit. Fails fast with
+    ProviderUnavailable while the provider's circuit is open.
+    """
+    limits = settings.PROVIDER_RATE_LIMITS[provider]
+    rate, burst = limits["rate"], limits["burst"]
+    while True:
+        with transaction.atomic():
+            now = timezone.now()
+            state, _ = ProviderState.objects.select_for_update().get_or_create(
+                provider=provider, defaults={"tokens": burst, "refilled_at": now}
+            )
+            if state.open_until and state.open_until > now:
+                raise ProviderUnavailable(f"{provider} is unhealthy until {state.open_until:%H:%M:%S}")
+            tokens = min(burst, state.tokens + (now - state.refilled_at).total_seconds() * rate)
+            if tokens >= 1:
+                state.tokens = tokens - 1
+                state.refilled_at = now
+                state.save(update_fields=["tokens", "refilled_at"])
+                return
+        wait = (1 - tokens) / rate
+        remaining = remaining_budget()
+        if remaining is not None and remaining < wait:
+            raise DeadlineExceeded(f"No time left to wait {wait:.1f}s for {provider}")
+        time.sleep(wait)
+
+
+def record_success(provider):
+    ProviderState.objects.filter(provider=provider, consecutive_failures__gt=0).update(
+        consecutive_failures=0, open_until=None
+    )
+
+
+def record_failure(provider):
+    """Count a failed call; past PROVIDER_FAILURE_THRESHOLD in a row, open the circuit for a cooldown.
+
+    The counter is only reset by a success, so after the cooldown a single failed trial
+    opens the circuit again.
+    """
+    ProviderState.objects.filter(provider=provider).update(consecutive_failures=F("consecutive_failures") + 1)
+    ProviderState.objects.filter(
+        provider=provider, consecutive_failures__gte=settings.PROVIDER_FAILURE_THRESHOLD
+    ).update(open_until=timezone.now() + timedelta(seconds=settings.PROVIDER_COOLDOWN))
+
+
+def provider_available(provider):
+    return not ProviderState.objects.filter(provider=provider, open_until__gt=timezone.now()).exists()
@@ -0,0 +1,158 @@
+from contextlib import contextmanager
+from django.conf import settings
+from taxons.providers import ProviderUnavailable
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class OfflineMiss(ProviderUnavailable):
+    """PROVIDER_CACHE_OFFLINE is set and the response was never cached."""
+
+
+_refresh = False
+
+
+def cache_enabled():
+    return bool(settings.PROVIDER_CACHE_PATH)
+
+
+@contextmanager
+def refreshing(enabled=True):
+    """Inside the block, provider responses are always fetched again (and the cache rewritten)."""
+    global _refresh
+    previous = _refresh
+    _refresh = previous or enabled
+    try:
+        yield
+    finally:
+        _refresh = previous
+
+
+def cache_key(url, params):
+    """Normalized URL with sorted params; secrets (PROVIDER_CACHE_IGNORED_PARAMS) are left out."""
+    parts = urlsplit(url)
+    base = f"{parts.scheme.lower()}://{parts.netloc.lower()}{parts.path.rstrip('/')}"
+    query = sorted(
+        (name, str(value))
+        for name, value in (params or {}).items()
+        if name not in settings.PROVIDER_CACHE_IGNORED_PARAMS
+    )
+    return f"{base}?{urlencode(query)}" if query else base
+
+
+def endpoint_ttl(url):
+    """Seconds a response of this endpoint stays valid, or None when the endpoint is not cached."""
+    parts = urlsplit(url)
+    days = settings.PROVIDER_CACHE_TTL_DAYS.get(f"{parts.netloc.lower()}{parts.path.rstrip('/')}")
+    return None if days is None else days * 86400
+
+
+class ResponseCache:
+    """Provider JSON responses kept in a SQLite file shared by every process (zlib-compressed bodies).
+
+    Entries expire per endpoint (PROVIDER_CACHE_TTL_DAYS) and the least recently used ones are evicted
+    once the bodies exceed `max_bytes`.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, body BLOB NOT NULL, size INTEGER NOT NULL, "
+                "fetched_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+
+    def _connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def get(self, key, ttl):
+        """The cached data, or None when missing or older than `ttl` seconds (None: any age)."""
+        now = time.time()
+        with self._connection() as db:
+            row = db.execute("SELECT body, fetched_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (ttl is not None and row[1] < now - ttl):
+                return None
+            db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, key, data):
+        body = zlib.compress(json.dumps(data).encode("utf-8"))
+        now = time.time()
+        with self._connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, body, size, fetched_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, body, len(body), now, now),
+            )
+            self._evict(db)
+
+    def _evict(self, db):
+        excess = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        evicted = []
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY used_at"):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+        db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+
+def response_cache():
+    """The ResponseCache of this process (a fresh one after a fork), or None when PROVIDER_CACHE_PATH is empty."""
+    global _cache, _cache_pid
+    if not cache_enabled():
+        return None
+    if _cache is None or _cache_pid != os.getpid() or _cache.path != str(settings.PROVIDER_CACHE_PATH):
+        with _cache_lock:
+            if _cache is None or _cache_pid != os.getpid() or _cache.path != str(settings.PROVIDER_CACHE_PATH):
+                _cache = ResponseCache(str(settings.PROVIDER_CACHE_PATH), settings.PROVIDER_CACHE_MAX_BYTES)
+                _cache_pid = os.getpid()
+    return _cache
+
+
+def cached_get(url, params, fetch):
+    """Return the cached response of `url` with `params`, else `fetch()` and cache its result.
+
+    With PROVIDER_CACHE_OFFLINE, responses of any age are replayed and a miss raises OfflineMiss instead
+    of calling `fetch`.
+    """
+    cache = response_cache()
+    key = cache_key(url, params)
+    if settings.PROVIDER_CACHE_OFFLINE:
+        data = cache.get(key, None) if cache is not None else None
+        if data is None:
+            raise OfflineMiss(f"Not in the offline provider cache: {key}")
+        return data
+    ttl = endpoint_ttl(url)
+    if cache is None or ttl is None:
+        return fetch()
+    if not _refresh:
+        data = cache.get(key, ttl)
+        if data is not None:
+            return data
+    data = fetch()
+    cache.set(key, data)
+    return data
@@ -0,0 +1,133 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import FilteredRelation
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from taxons.catalog import get_catalog
+from taxons.models import ReviewItem
+from taxons.models import Taxon
+
+import hashlib
+import random
+
+
+def _scope(qs, dataset="", category="", prefix=""):
+    # Taxa of the previous versions stay in the database until garbage-collected
+    qs = qs.filter(**{f"{prefix}version__active": True})
+    if dataset:
+        qs = qs.filter(**{f"{prefix}dataset": dataset})
+    if category:
+        qs = qs.filter(**{f"{prefix}category": category})
+    return qs
+
+
+def get_next_taxon(session_id, dataset="", category=""):
+    qs = _scope(Taxon.objects.all(), dataset, category)
+
+    # LEFT JOIN on this session's scores: unscored taxa count as 0, lowest score
+    # wins and ties are broken at random, all in a single query.
+    return (
+        qs.annotate(
+            session_scores=FilteredRelation("user_scores", condition=Q(user_scores__session_id=session_id)),
+            session_score=Coalesce("session_scores__score", 0),
+        )
+        .order_by("session_score", "?")
+        .first()
+    )
+
+
+# Seconds the Leitner strategy remembers that a session's scope was scanned for unseen taxa
+ENQUEUED_TIMEOUT = 24 * 3600
+
+
+class MinScoreStrategy:
+    """Ask one of the taxa with the lowest score for the session."""
+
+    name = "min_score"
+
+    def next_taxon(self, session_id, dataset="", category=""):
+        return get_next_taxon(session_id, dataset=dataset, category=category)
+
+    def record_answer(self, session_id, taxon, correct):
+        # Scores are already kept up to date by render_result
+        pass
+
+
+class LeitnerStrategy:
+    """Leitner boxes kept as a per-session queue of ReviewItem rows ordered by due date.
+
+    A correct answer moves the taxon up one box (longer interval), a wrong one sends it
+    back to the first box. The next question is the head of the queue, read through the
+    (session_id, due_at) index.
+    """
+
+    name = "leitner"
+    INTERVALS = [
+        timedelta(minutes=1),
+        timedelta(minutes=10),
+        timedelta(hours=1),
+        timedelta(days=1),
+        timedelta(days=3),
+        timedelta(days=7),
+    ]
+
+    def _queue(self, session_id, dataset="", category=""):
+        return _scope(ReviewItem.objects.filter(session_id=session_id), dataset, category, prefix="taxon__")
+
+    def _enqueued_key(self, session_id, dataset="", category=""):
+        scope = hashlib.sha256(f"{session_id}\0{dataset}\0{category}".encode("utf-8")).hexdigest()
+        return f"leitner-enqueued:{scope}"
+
+    def _enqueue_unseen(self, session_id, dataset="", category=""):
+        """Add the taxa of the scope not yet in the session queue, due now in random order."""
+        unseen = list(
+            _scope(Taxon.objects.all(), dataset, category)
+            .exclude(review_items__session_id=session_id)
+            .values_list("id", flat=True)
+        )
+        if not unseen:
+            return 0
+        random.shuffle(unseen)
+        now = timezone.now()
+        ReviewItem.objects.bulk_create(
+            [
+                ReviewItem(
+                    session_id=session_id, taxon_id=taxon_id, due_at=now - timedelta(microseconds=len(unseen) - i)
+                )
+                for i, taxon_id in enumerate(unseen)
+            ],
+            ignore_conflicts=True,
+        )
+        return len(unseen)
+
+    def next_taxon(self, session_id, dataset="", category=""):
+        # The unseen taxa are scanned once per session and scope, and again when the catalog changes (import,
+        # admin edit): the other questions only read the head of the queue
+        key = self._enqueued_key(session_id, dataset, category)
+        version = get_catalog().version
+        if cache.get(key) != version:
+            self._enqueue_unseen(session_id, dataset, category)
+            cache.set(key, version, ENQUEUED_TIMEOUT)
+        queue = self._queue(session_id, dataset, category).select_related("taxon").order_by("due_at")
+        item = queue.first()
+        # An empty queue: pull in taxa added since the scan without a catalog change
+        if item is None and self._enqueue_unseen(session_id, dataset, category):
+            item = queue.first()
+        return item.taxon if item else None
+
+    def record_answer(self, session_id, taxon, correct):
+        item, _ = ReviewItem.objects.get_or_create(
+            session_id=session_id, taxon=taxon, defaults={"due_at": timezone.now()}
+        )
+        item.box = min(item.box + 1, len(self.INTERVALS) - 1) if correct else 0
+        item.due_at = timezone.now() + self.INTERVALS[item.box]
+        item.save(update_fields=["box", "due_at"])
+
+
+STRATEGIES = {strategy.name: strategy for strategy in (MinScoreStrategy, LeitnerStrategy)}
+
+
+def get_strategy(name=None):
+    return STRATEGIES[name or settings.QUIZ_STRATEGY]()
@@ -0,0 +1,11 @@
+from django import template
+from taxons.mirror import mirrored_url
+
+
+register = template.Library()
+
+
+@register.filter
+def mirrored(link):
+    """Serve a provider image from the local mirror once it is cached there."""
+    return mirrored_url(link)
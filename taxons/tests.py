@@ -1,6 +1,84 @@
-from django.test import TestCase, Client, override_settings
-from taxons.models import Taxon, UserScore
-from taxons.views import get_next_taxon, get_score_lists
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from taxons.catalog import Catalog
+from taxons.catalog import bump_catalog_version
+from taxons.catalog import current_catalog_version
+from taxons.catalog import get_catalog
+from taxons.catalog_file import MappedCatalog
+from taxons.catalog_file import load_catalog_file
+from taxons.catalog_file import write_catalog_file
+from taxons.distractors import build_distractor_index
+from taxons.distractors import pick_distractors
+from taxons.management.commands.import_taxons import Command as ImportCommand
+from taxons.media import XENOCANTO_BOX
+from taxons.media import afetch_media_for_taxon
+from taxons.media import aprovider_get
+from taxons.media import ensure_media
+from taxons.media import fetch_media_for_taxon
+from taxons.media import media_of_kind
+from taxons.media import provider_get
+from taxons.media import provider_results
+from taxons.media import rank_recordings
+from taxons.media import refresh_media
+from taxons.media import renumber_media
+from taxons.media import revalidate_media
+from taxons.media import sample_media
+from taxons.media import stale_providers
+from taxons.mirror import evict
+from taxons.mirror import mirror_file
+from taxons.mirror import mirror_link
+from taxons.mirror import mirror_name
+from taxons.mirror import mirrored_url
+from taxons.models import CatalogVersion
+from taxons.models import DatasetVersion
+from taxons.models import MediaFetchLease
+from taxons.models import MediaStatus
+from taxons.models import ReviewItem
+from taxons.models import SearchResult
+from taxons.models import Taxon
+from taxons.models import TaxonNeighbor
+from taxons.models import UserScore
+from taxons.pdf_extract import extract_pages
+from taxons.pdf_extract import extract_rows
+from taxons.pdf_extract import page_hash
+from taxons.pdf_extract import page_rows
+from taxons.providers import DeadlineExceeded
+from taxons.providers import ProviderUnavailable
+from taxons.providers import acquire
+from taxons.providers import outbound_budget
+from taxons.providers import provider_available
+from taxons.providers import record_failure
+from taxons.providers import record_success
+from taxons.response_cache import OfflineMiss
+from taxons.response_cache import refreshing
+from taxons.response_cache import response_cache
+from taxons.strategies import LeitnerStrategy
+from taxons.strategies import get_next_taxon
+from taxons.utils import HttpClient
+from taxons.utils import http_client
+from taxons.views import get_score_lists
+from unittest import mock
+
+import asyncio
+import csv
+import io
+import json
+import os
+import pdfplumber
+import requests
+import tempfile
+import threading
+import time
+import zlib
 
 
 def make_taxon(dataset="nature", nom_vernaculaire="Merle noir", category="Oiseaux",
@@ -105,6 +183,802 @@ class GetNextTaxonTest(TestCase):
         result = get_next_taxon(self.session_id, dataset="nonexistent")
         self.assertIsNone(result)
 
+    def test_prefers_lowest_score(self):
+        other = make_taxon(dataset="nature", nom_vernaculaire="Merle à plastron",
+                           genre="Turdus", espece="torquatus")
+        UserScore.objects.create(session_id=self.session_id, taxon=self.t_nature, score=10)
+        for _ in range(10):
+            self.assertEqual(get_next_taxon(self.session_id, dataset="nature"), other)
+
+    def test_unscored_taxon_counts_as_zero(self):
+        other = make_taxon(dataset="nature", nom_vernaculaire="Merle à plastron",
+                           genre="Turdus", espece="torquatus")
+        UserScore.objects.create(session_id=self.session_id, taxon=self.t_nature, score=0)
+        UserScore.objects.create(session_id=self.session_id, taxon=other, score=3)
+        for _ in range(10):
+            self.assertEqual(get_next_taxon(self.session_id, dataset="nature"), self.t_nature)
+
+    def test_other_sessions_scores_are_ignored(self):
+        UserScore.objects.create(session_id="other", taxon=self.t_nature, score=50)
+        self.assertEqual(get_next_taxon(self.session_id, dataset="nature"), self.t_nature)
+
+    def test_single_query_regardless_of_catalog_size(self):
+        for i in range(20):
+            make_taxon(dataset="nature", nom_vernaculaire=f"Taxon {i}", espece=f"sp{i}")
+        with self.assertNumQueries(1):
+            get_next_taxon(self.session_id, dataset="nature", category="Oiseaux")
+
+
+class LeitnerStrategyTest(TestCase):
+    def setUp(self):
+        self.session_id = "testsession"
+        self.strategy = LeitnerStrategy()
+        cache.clear()
+        self.t1 = make_taxon(nom_vernaculaire="Merle noir")
+        self.t2 = make_taxon(nom_vernaculaire="Merle à plastron", espece="torquatus")
+
+    def test_first_question_seeds_the_queue(self):
+        taxon = self.strategy.next_taxon(self.session_id, dataset="nature")
+        self.assertIn(taxon, [self.t1, self.t2])
+        self.assertEqual(ReviewItem.objects.filter(session_id=self.session_id).count(), 2)
+
+    def test_answered_taxon_moves_behind_unanswered(self):
+        first = self.strategy.next_taxon(self.session_id, dataset="nature")
+        self.strategy.record_answer(self.session_id, first, correct=True)
+        second = self.strategy.next_taxon(self.session_id, dataset="nature")
+        self.assertNotEqual(first, second)
+
+    def test_correct_answer_promotes_and_wrong_answer_resets(self):
+        self.strategy.record_answer(self.session_id, self.t1, correct=True)
+        self.strategy.record_answer(self.session_id, self.t1, correct=True)
+        self.assertEqual(ReviewItem.objects.get(taxon=self.t1).box, 2)
+        self.strategy.record_answer(self.session_id, self.t1, correct=False)
+        self.assertEqual(ReviewItem.objects.get(taxon=self.t1).box, 0)
+
+    def test_no_match_returns_none(self):
+        self.assertIsNone(self.strategy.next_taxon(self.session_id, dataset="nonexistent"))
+
+    def test_due_question_is_a_single_query(self):
+        self.strategy.next_taxon(self.session_id, dataset="nature")
+        for i in range(20):
+            make_taxon(nom_vernaculaire=f"Taxon {i}", espece=f"sp{i}")
+        self.strategy.next_taxon(self.session_id, dataset="nature")
+        with self.assertNumQueries(1):
+            self.strategy.next_taxon(self.session_id, dataset="nature")
+
+    def test_unseen_taxa_are_scanned_once_until_the_catalog_changes(self):
+        for taxon in (self.t1, self.t2):
+            self.strategy.record_answer(self.session_id, taxon, correct=True)
+        self.strategy.next_taxon(self.session_id, dataset="nature")
+        new = make_taxon(nom_vernaculaire="Grive draine", espece="viscivorus")
+        get_catalog()
+        # Nothing due: the head is returned without looking for unseen taxa again
+        with self.assertNumQueries(1):
+            self.strategy.next_taxon(self.session_id, dataset="nature")
+        self.assertFalse(ReviewItem.objects.filter(taxon=new).exists())
+
+        bump_catalog_version()
+        self.assertEqual(self.strategy.next_taxon(self.session_id, dataset="nature"), new)
+
+
+class DistractorIndexTest(TestCase):
+    def setUp(self):
+        self.merle = make_taxon(nom_vernaculaire="Merle noir")
+        self.plastron = make_taxon(nom_vernaculaire="Merle à plastron", espece="torquatus")
+        self.grive = make_taxon(nom_vernaculaire="Grive musicienne", genre="Turdus", espece="philomelos")
+        self.rouge_gorge = make_taxon(nom_vernaculaire="Rougegorge familier", genre="Erithacus",
+                                      espece="rubecula", famille="Muscicapidae")
+        self.mesange = make_taxon(nom_vernaculaire="Mésange bleue", genre="Cyanistes",
+                                  espece="caeruleus", famille="Paridae")
+        self.chene = make_taxon(nom_vernaculaire="Chêne pédonculé", genre="Quercus", espece="robur",
+                                category="Plantes", classe="Magnoliopsida", ordre="Fagales",
+                                famille="Fagaceae")
+        self.other_dataset = make_taxon(dataset="rando", nom_vernaculaire="Merle noir")
+
+    def test_closest_ranks_only_until_three_found(self):
+        build_distractor_index(self.merle.version)
+        neighbors = TaxonNeighbor.objects.filter(taxon=self.merle, category="Oiseaux")
+        self.assertEqual(
+            {(n.neighbor, n.rank) for n in neighbors},
+            {(self.plastron, 0), (self.grive, 0), (self.rouge_gorge, 2), (self.mesange, 2)},
+        )
+
+    def test_category_scope_excludes_other_categories(self):
+        build_distractor_index(self.merle.version)
+        neighbors = {n.neighbor for n in TaxonNeighbor.objects.filter(taxon=self.chene, category="Plantes")}
+        self.assertEqual(neighbors, set())
+        neighbors = {n.neighbor for n in TaxonNeighbor.objects.filter(taxon=self.chene, category="")}
+        self.assertNotIn(self.other_dataset, neighbors)
+        self.assertEqual(len(neighbors), 5)
+
+    def test_rebuild_replaces_previous_index(self):
+        build_distractor_index(self.merle.version)
+        count = TaxonNeighbor.objects.count()
+        build_distractor_index(self.merle.version)
+        self.assertEqual(TaxonNeighbor.objects.count(), count)
+
+    def test_pick_reads_the_catalog_without_queries(self):
+        build_distractor_index(self.merle.version)
+        get_catalog()
+        with self.assertNumQueries(0):
+            picked = pick_distractors(self.merle, category="Oiseaux")
+        self.assertEqual(len(picked), 3)
+        self.assertNotIn(self.merle.id, [t.id for t in picked])
+
+    def test_pick_without_index_matches_indexed_candidates(self):
+        picked = pick_distractors(self.merle, category="Oiseaux", count=10)
+        self.assertEqual(
+            {t.id for t in picked},
+            {self.plastron.id, self.grive.id, self.rouge_gorge.id, self.mesange.id},
+        )
+
+
+class CatalogTest(TestCase):
+    def setUp(self):
+        self.merle = make_taxon(nom_vernaculaire="Merle noir")
+        self.chene = make_taxon(nom_vernaculaire="Chêne pédonculé", genre="Quercus", espece="robur",
+                                category="Plantes", classe="Magnoliopsida")
+        self.rando = make_taxon(dataset="rando", nom_vernaculaire="Arbre", category="")
+
+    def test_lists_are_precomputed_per_dataset_and_category(self):
+        catalog = get_catalog()
+        self.assertEqual(catalog.datasets(), ("nature", "rando"))
+        self.assertEqual(catalog.categories("nature"), {"Oiseaux", "Plantes"})
+        self.assertEqual(catalog.categories("rando"), set())
+        self.assertEqual(catalog.names("nature"), ("Chêne pédonculé", "Merle noir"))
+        self.assertEqual(catalog.names("nature", "Plantes"), ("Chêne pédonculé",))
+        self.assertEqual(catalog.get(self.merle.id).genre, "Turdus")
+
+    def test_names_sort_like_the_database_collation(self):
+        for name in ["Écureuil roux", "Œdémères", "Épicéa commun", "Érable plane", "Orme", "Ortie dioïque"]:
+            make_taxon(nom_vernaculaire=name, category="")
+        expected = ("Chêne pédonculé", "Écureuil roux", "Épicéa commun", "Érable plane", "Merle noir", "Œdémères",
+                    "Orme", "Ortie dioïque")
+        catalog = Catalog.from_database(current_catalog_version())
+        self.assertEqual(catalog.names("nature"), expected)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "catalog.bin")
+            write_catalog_file(path, catalog)
+            self.assertEqual(load_catalog_file(path, catalog.version).names("nature"), expected)
+
+    def test_records_are_immutable(self):
+        with self.assertRaises(AttributeError):
+            get_catalog().get(self.merle.id).genre = "Merula"
+
+    def test_cached_until_version_bumped(self):
+        catalog = get_catalog()
+        with self.assertNumQueries(0):
+            self.assertIs(get_catalog(), catalog)
+        Taxon.objects.filter(id=self.merle.id).update(nom_vernaculaire="Merle")
+        bump_catalog_version()
+        self.assertIn("Merle", get_catalog().names("nature"))
+
+    @override_settings(CATALOG_CHECK_INTERVAL=0)
+    def test_other_worker_bump_is_noticed(self):
+        catalog = get_catalog()
+        CatalogVersion.objects.update_or_create(pk=1, defaults={"version": catalog.version[0] + 1})
+        self.assertIsNot(get_catalog(), catalog)
+
+    def test_saving_a_taxon_drops_the_local_copy(self):
+        get_catalog()
+        make_taxon(nom_vernaculaire="Grive draine", espece="viscivorus")
+        self.assertIn("Grive draine", get_catalog().names("nature"))
+
+
+class CatalogFileTest(TestCase):
+    def setUp(self):
+        self.merle = make_taxon(nom_vernaculaire="Merle noir")
+        self.plastron = make_taxon(nom_vernaculaire="Merle à plastron", espece="torquatus")
+        self.chene = make_taxon(nom_vernaculaire="Chêne pédonculé", genre="Quercus", espece="robur",
+                                category="Plantes", classe="Magnoliopsida")
+        make_taxon(dataset="rando", nom_vernaculaire="Hêtre", category="", genre="Fagus", espece="sylvatica")
+        build_distractor_index(self.merle.version)
+        bump_catalog_version()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "catalog.bin")
+        self.catalog = Catalog.from_database(current_catalog_version())
+        write_catalog_file(self.path, self.catalog)
+
+    def test_mapped_catalog_matches_database_catalog(self):
+        mapped = load_catalog_file(self.path, self.catalog.version)
+        self.assertEqual(mapped.datasets(), self.catalog.datasets())
+        for dataset in self.catalog.datasets():
+            self.assertEqual(mapped.categories(dataset), self.catalog.categories(dataset))
+            for category in ["", *self.catalog.categories(dataset)]:
+                self.assertEqual(mapped.names(dataset, category), self.catalog.names(dataset, category))
+                self.assertEqual(mapped.taxa(dataset, category), self.catalog.taxa(dataset, category))
+        self.assertEqual(mapped.neighbors(self.merle.id, "Oiseaux"), self.catalog.neighbors(self.merle.id, "Oiseaux"))
+        record = mapped.get(self.chene.id)
+        self.assertEqual((record.nom_vernaculaire, record.genre, record.category),
+                         ("Chêne pédonculé", "Quercus", "Plantes"))
+        self.assertIsNone(mapped.get(-1))
+        self.assertEqual([str(record) for record in mapped.by_rank("nature", "genre", "Turdus")],
+                         ["Merle à plastron", "Merle noir"])
+        self.assertEqual(mapped.by_rank("nature", "genre", "Turdus"), self.catalog.by_rank("nature", "genre", "Turdus"))
+        self.assertEqual(mapped.by_rank("rando", "genre", "Turdus"), ())
+        self.assertEqual(mapped.neighbors(self.merle.id, "Absent"), ())
+
+    def test_mapping_decodes_nothing_up_front(self):
+        with mock.patch.object(MappedCatalog, "_record") as record, \
+                mock.patch.object(MappedCatalog, "_string") as string:
+            load_catalog_file(self.path, self.catalog.version)
+        record.assert_not_called()
+        string.assert_not_called()
+
+    def test_stale_or_missing_file_is_ignored(self):
+        with mock.patch.object(MappedCatalog, "close", autospec=True, side_effect=MappedCatalog.close) as close:
+            self.assertIsNone(load_catalog_file(self.path, (self.catalog.version[0] + 1, 0)))
+        close.assert_called_once()
+        self.assertTrue(close.call_args.args[0]._mm.closed)
+        self.assertIsNone(load_catalog_file(self.path + ".missing", self.catalog.version))
+
+    def test_get_catalog_maps_the_file_and_falls_back_to_the_database(self):
+        with override_settings(CATALOG_PATH=self.path):
+            self.assertIsInstance(get_catalog(), MappedCatalog)
+            bump_catalog_version()
+            self.assertIsInstance(get_catalog(), Catalog)
+
+
+@override_settings(PROVIDER_RATE_LIMITS={"inaturalist": {"rate": 20, "burst": 2}},
+                   PROVIDER_FAILURE_THRESHOLD=2, PROVIDER_COOLDOWN=60)
+class ProviderLimitsTest(TestCase):
+    def test_token_bucket_allows_burst_then_waits(self):
+        start = time.monotonic()
+        for _ in range(2):
+            acquire("inaturalist")
+        self.assertLess(time.monotonic() - start, 0.05)
+        acquire("inaturalist")
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_deadline_fails_fast_instead_of_waiting(self):
+        acquire("inaturalist")
+        acquire("inaturalist")
+        with outbound_budget(0.01):
+            with self.assertRaises(DeadlineExceeded):
+                acquire("inaturalist")
+
+    def test_circuit_opens_after_consecutive_failures_and_success_closes_it(self):
+        acquire("inaturalist")
+        record_failure("inaturalist")
+        self.assertTrue(provider_available("inaturalist"))
+        record_failure("inaturalist")
+        self.assertFalse(provider_available("inaturalist"))
+        with self.assertRaises(ProviderUnavailable):
+            acquire("inaturalist")
+        record_success("inaturalist")
+        self.assertTrue(provider_available("inaturalist"))
+
+    def test_provider_get_records_failures(self):
+        with mock.patch("taxons.media.http_client") as client:
+            client.return_value.get_json.side_effect = ConnectionError
+            for _ in range(2):
+                with self.assertRaises(ConnectionError):
+                    provider_get("inaturalist", "https://api.inaturalist.org/v1/taxa", {}, timeout=10)
+            with self.assertRaises(ProviderUnavailable):
+                provider_get("inaturalist", "https://api.inaturalist.org/v1/taxa", {}, timeout=10)
+        self.assertEqual(client.return_value.get_json.call_count, 2)
+
+    def test_budget_caps_the_request_timeout(self):
+        with mock.patch("taxons.media.http_client") as client, outbound_budget(5):
+            provider_get("inaturalist", "https://api.inaturalist.org/v1/taxa", {}, timeout=10)
+        self.assertLessEqual(client.return_value.get_json.call_args.kwargs["timeout"], 5)
+        # No retries: their back-off would outlast the budget
+        self.assertFalse(client.return_value.get_json.call_args.kwargs["retries"])
+
+    def test_timeouts_shortened_by_the_budget_are_not_provider_failures(self):
+        with mock.patch("taxons.media.http_client") as client:
+            client.return_value.get_json.side_effect = requests.Timeout
+            for _ in range(2):
+                with outbound_budget(5), self.assertRaises(DeadlineExceeded):
+                    provider_get("inaturalist", "https://api.inaturalist.org/v1/taxa", {}, timeout=10)
+            self.assertTrue(provider_available("inaturalist"))
+            for _ in range(2):
+                with self.assertRaises(requests.Timeout):
+                    provider_get("inaturalist", "https://api.inaturalist.org/v1/taxa", {}, timeout=10)
+        self.assertFalse(provider_available("inaturalist"))
+        self.assertTrue(client.return_value.get_json.call_args.kwargs["retries"])
+
+    async def test_async_calls_close_their_thread_connection(self):
+        with mock.patch("taxons.media.provider_get", return_value={}), \
+                mock.patch("taxons.media.close_old_connections") as close:
+            await aprovider_get("inaturalist", "https://api.inaturalist.org/v1/taxa", {}, timeout=10)
+        close.assert_called_once()
+
+
+class HttpClientTest(TestCase):
+    def response(self, status_code=200, body=None, etag=None):
+        resp = mock.Mock(status_code=status_code, headers={"ETag": etag} if etag else {})
+        resp.content = json.dumps(body).encode()
+        resp.json.return_value = body
+        return resp
+
+    def test_shared_per_process_and_rebuilt_after_fork(self):
+        client = http_client()
+        self.assertIs(http_client(), client)
+        with mock.patch("taxons.utils.os.getpid", return_value=-1):
+            self.assertIsNot(http_client(), client)
+
+    def test_etag_revalidation_reuses_cached_body(self):
+        client = HttpClient(1, 1, 1000)
+        with mock.patch.object(client.session, "get", side_effect=[
+            self.response(body={"results": [1]}, etag='"abc"'),
+            self.response(status_code=304),
+        ]) as get:
+            self.assertEqual(client.get_json("https://api.example.org", params={"q": "x"}), {"results": [1]})
+            self.assertEqual(client.get_json("https://api.example.org", params={"q": "x"}), {"results": [1]})
+        self.assertEqual(get.call_args_list[1].kwargs["headers"], {"If-None-Match": '"abc"'})
+
+    def test_etag_cache_is_bounded_by_body_size(self):
+        client = HttpClient(1, 1, 10)
+        with mock.patch.object(client.session, "get", side_effect=[
+            self.response(body="a" * 4, etag='"a"'),
+            self.response(body="b" * 4, etag='"b"'),
+            self.response(body="large body", etag='"c"'),
+            self.response(body="a" * 4),
+            self.response(status_code=304),
+            self.response(body="large body"),
+        ]) as get:
+            client.get_json("https://api.example.org/a")
+            client.get_json("https://api.example.org/b")
+            # 6 + 6 bytes: /a is dropped
+            client.get_json("https://api.example.org/a")
+            client.get_json("https://api.example.org/b")
+            # 12 bytes: never kept
+            client.get_json("https://api.example.org/c")
+            client.get_json("https://api.example.org/c")
+        headers = [call.kwargs["headers"] for call in get.call_args_list]
+        self.assertEqual(headers[2:], [{}, {"If-None-Match": '"b"'}, {}, {}])
+
+
+@override_settings(PROVIDER_RATE_LIMITS={"inaturalist": {"rate": 1000, "burst": 10}})
+class ResponseCacheTest(TestCase):
+    URL = "https://api.inaturalist.org/v1/taxa/autocomplete"
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(PROVIDER_CACHE_PATH=os.path.join(tmp.name, "providers.sqlite3"))
+        override.enable()
+        self.addCleanup(override.disable)
+        patcher = mock.patch("taxons.media.http_client")
+        self.get_json = patcher.start().return_value.get_json
+        self.addCleanup(patcher.stop)
+        self.get_json.side_effect = lambda url, params, timeout, retries: {"results": [{"q": params["q"]}]}
+
+    def get(self, q, **params):
+        return provider_get("inaturalist", self.URL, {"q": q, **params}, timeout=10)
+
+    def test_cached_responses_skip_the_network(self):
+        self.assertEqual(self.get("Turdus merula", per_page=1), {"results": [{"q": "Turdus merula"}]})
+        # Same normalized URL: params order and API keys do not matter
+        self.assertEqual(provider_get("inaturalist", self.URL + "/", {"per_page": "1", "q": "Turdus merula",
+                                                                      "key": "secret"}, timeout=10),
+                         {"results": [{"q": "Turdus merula"}]})
+        self.assertEqual(self.get_json.call_count, 1)
+        self.get("Turdus philomelos", per_page=1)
+        self.assertEqual(self.get_json.call_count, 2)
+
+    def test_expired_or_refreshed_responses_are_fetched_again(self):
+        self.get("Turdus merula")
+        with override_settings(PROVIDER_CACHE_TTL_DAYS={"api.inaturalist.org/v1/taxa/autocomplete": 0}):
+            self.get("Turdus merula")
+        self.assertEqual(self.get_json.call_count, 2)
+        with refreshing():
+            self.get("Turdus merula")
+        self.assertEqual(self.get_json.call_count, 3)
+        self.get("Turdus merula")
+        self.assertEqual(self.get_json.call_count, 3)
+
+    def test_offline_replays_cached_responses_only(self):
+        self.get("Turdus merula")
+        with override_settings(PROVIDER_CACHE_OFFLINE=True):
+            self.assertEqual(self.get("Turdus merula"), {"results": [{"q": "Turdus merula"}]})
+            with self.assertRaises(OfflineMiss):
+                self.get("Turdus philomelos")
+        self.assertEqual(self.get_json.call_count, 1)
+
+    def test_least_recently_used_responses_are_evicted_past_the_cap(self):
+        cache = response_cache()
+        # Room for two of the three entries
+        cache.max_bytes = 2 * len(zlib.compress(json.dumps({"results": ["a" * 30]}).encode("utf-8")))
+        for q in ("a", "b", "c"):
+            cache.set(q, {"results": [q * 30]})
+            cache.get("a", None)
+        self.assertIsNotNone(cache.get("a", None))
+        self.assertIsNone(cache.get("b", None))
+
+
+class ImportTaxonsCommandTest(TestCase):
+    HEADER = ["Règne", "Embranchement (Sous-embranchement)", "Classe", "Ordre (Sous-ordre)", "Famille", "Genre",
+              "Espèce", "Nom vernaculaire", "Partie/état/indice à reconnaitre"]
+
+    def write_csv(self, rows):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "nature.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.HEADER)
+            for genre, espece, nom in rows:
+                writer.writerow(["Plantae", "Tracheophyta", "Magnoliopsida", "Fagales", "Fagaceae", genre, espece,
+                                 nom, ""])
+        return path
+
+    def slow_autocomplete(self, provider, url, params, timeout):
+        # Earlier rows answer last, so a pool finishes them out of order
+        ids = {"Quercus robur": (1, 0.06), "Quercus petraea": (1, 0.03), "Fagus sylvatica": (2, 0.0)}
+        taxon_id, delay = ids[params["q"]]
+        time.sleep(delay)
+        return {"results": [{"id": taxon_id}]}
+
+    def test_parallel_lookups_are_applied_in_file_order(self):
+        path = self.write_csv([("Quercus", "robur", "Chêne pédonculé"), ("Quercus", "petraea", "Chêne sessile"),
+                               ("Fagus", "sylvatica", "Hêtre")])
+        command = ImportCommand(stdout=io.StringIO())
+        with mock.patch("taxons.management.commands.import_taxons.provider_get", side_effect=self.slow_autocomplete):
+            counts, version = command.import_csv(path, "nature", jobs=3)
+        self.assertEqual(counts, (3, 0, 0, 0))
+        ids = dict(version.taxa.values_list("nom_vernaculaire", "inaturalist_taxon_id"))
+        # The first row in the file keeps the id both rows resolve to, as in a serial import
+        self.assertEqual(ids, {"Chêne pédonculé": 1, "Chêne sessile": None, "Hêtre": 2})
+        self.assertIn("[3/3] Hêtre", command.stdout.getvalue())
+
+    def import_rows(self, rows, force=False, **provider):
+        command = ImportCommand(stdout=io.StringIO())
+        provider = provider or {"return_value": {"results": []}}
+        with mock.patch("taxons.management.commands.import_taxons.provider_get", **provider) as provider_get:
+            counts, version = command.import_csv(self.write_csv(rows), "nature", force=force)
+        self.provider_calls = provider_get.call_count
+        if version is not None:
+            command.switch_to(version)
+        return counts
+
+    def test_reimport_upserts_and_deletes_missing_rows(self):
+        self.import_rows([("Quercus", "robur", "Chêne pédonculé"), ("Quercus", "petraea", "Chêne sessile"),
+                          ("Fagus", "sylvatica", "Hêtre")])
+        oak = Taxon.objects.get(nom_vernaculaire="Chêne pédonculé")
+        UserScore.objects.create(session_id="s", taxon=oak, score=3)
+
+        counts = self.import_rows([("Quercus", "robur", "Chêne pédonculé"), ("Fagus", "orientalis", "Hêtre"),
+                                   ("Betula", "pendula", "Bouleau verruqueux")])
+        self.assertEqual(counts, (1, 1, 1, 1))
+        self.assertEqual(set(Taxon.objects.active().values_list("nom_vernaculaire", flat=True)),
+                         {"Chêne pédonculé", "Hêtre", "Bouleau verruqueux"})
+        # The user data follows the unchanged row into the new version
+        new_oak = Taxon.objects.active().get(nom_vernaculaire="Chêne pédonculé")
+        self.assertNotEqual(new_oak.id, oak.id)
+        self.assertEqual(UserScore.objects.get().taxon_id, new_oak.id)
+        self.assertEqual(new_oak.species_id, oak.species_id)
+        # Species are assigned although bulk writes bypass Taxon.save()
+        beech = Taxon.objects.active().get(nom_vernaculaire="Hêtre")
+        self.assertEqual(beech.species.key, "name:fagus orientalis")
+        self.assertEqual(Taxon.objects.active().get(nom_vernaculaire="Bouleau verruqueux").species.key,
+                         "name:betula pendula")
+
+    def test_unchanged_rows_are_skipped_until_forced(self):
+        rows = [("Quercus", "robur", "Chêne pédonculé"), ("Fagus", "sylvatica", "Hêtre")]
+        self.import_rows(rows, return_value={"results": [{"id": 7}]})
+        self.assertEqual(self.provider_calls, 2)
+
+        self.assertEqual(self.import_rows(rows), (0, 0, 2, 0))
+        self.assertEqual(self.provider_calls, 0)
+        self.assertEqual(Taxon.objects.active().get(nom_vernaculaire="Chêne pédonculé").inaturalist_taxon_id, 7)
+
+        # Whitespace does not count as a change
+        changed = [("Quercus ", " robur", "Chêne pédonculé"), ("Fagus", "orientalis", "Hêtre")]
+        self.assertEqual(self.import_rows(changed), (0, 1, 1, 0))
+        self.assertEqual(self.provider_calls, 1)
+
+        self.import_rows(rows, force=True)
+        self.assertEqual(self.provider_calls, 2)
+
+    def test_force_rebuilds_an_unchanged_dataset(self):
+        rows = [("Quercus", "robur", "Chêne pédonculé"), ("Quercus", "petraea", "Chêne sessile")]
+        self.import_rows(rows)
+        version = Taxon.objects.active().first().version
+        # A damaged distractor index
+        TaxonNeighbor.objects.all().delete()
+        self.import_rows(rows)
+        self.assertEqual(Taxon.objects.active().first().version, version)
+
+        self.assertEqual(self.import_rows(rows, force=True), (0, 0, 2, 0))
+        self.assertNotEqual(Taxon.objects.active().first().version, version)
+        self.assertTrue(TaxonNeighbor.objects.filter(taxon__version__active=True).exists())
+
+    def test_rows_whose_lookup_failed_are_retried(self):
+        rows = [("Quercus", "robur", "Chêne pédonculé")]
+        self.import_rows(rows, side_effect=ConnectionError)
+        self.import_rows(rows)
+        self.assertEqual(self.provider_calls, 1)
+
+    def test_failed_lookup_keeps_the_stored_id(self):
+        rows = [("Quercus", "robur", "Chêne pédonculé")]
+        self.import_rows(rows, return_value={"results": [{"id": 7}]})
+        self.import_rows(rows, force=True, side_effect=ConnectionError)
+        oak = Taxon.objects.active().get()
+        self.assertEqual((oak.inaturalist_taxon_id, oak.source_hash), (7, ""))
+        self.import_rows(rows, return_value={"results": [{"id": 7}]})
+        self.assertEqual(self.provider_calls, 1)
+        self.assertNotEqual(Taxon.objects.active().get().source_hash, "")
+
+    def test_failed_import_leaves_the_dataset_untouched(self):
+        self.import_rows([("Quercus", "robur", "Chêne pédonculé")])
+        with mock.patch("taxons.models.Taxon.objects.bulk_create", side_effect=RuntimeError("crash")):
+            with self.assertRaises(RuntimeError):
+                self.import_rows([("Fagus", "sylvatica", "Hêtre")])
+        self.assertEqual(list(Taxon.objects.values_list("nom_vernaculaire", flat=True)), ["Chêne pédonculé"])
+
+    def test_players_see_the_previous_version_until_the_switch(self):
+        self.import_rows([("Quercus", "robur", "Chêne pédonculé")])
+        old_version = Taxon.objects.get().version
+        command = ImportCommand(stdout=io.StringIO())
+        with mock.patch("taxons.management.commands.import_taxons.provider_get", return_value={"results": []}):
+            _, version = command.import_csv(self.write_csv([("Fagus", "sylvatica", "Hêtre")]), "nature")
+        self.assertFalse(version.active)
+        self.assertEqual(get_catalog().names("nature"), ("Chêne pédonculé",))
+        self.assertEqual(get_next_taxon("s", dataset="nature").nom_vernaculaire, "Chêne pédonculé")
+
+        command.switch_to(version)
+        self.assertEqual(get_catalog().names("nature"), ("Hêtre",))
+        self.assertEqual(get_next_taxon("s", dataset="nature").nom_vernaculaire, "Hêtre")
+        old_version.refresh_from_db()
+        self.assertFalse(old_version.active)
+
+    @override_settings(DATASET_VERSIONS_KEPT=2)
+    def test_answers_recorded_against_the_previous_version_follow_the_next_switch(self):
+        self.import_rows([("Quercus", "robur", "Chêne"), ("Fagus", "sylvatica", "Hêtre")])
+        old_oak, old_beech = Taxon.objects.active().order_by("nom_vernaculaire")
+        self.import_rows([("Quercus", "petraea", "Chêne"), ("Fagus", "sylvatica", "Hêtre")])
+        # Recorded by requests that loaded the old taxa before the switch was committed
+        UserScore.objects.create(session_id="late", taxon=old_oak, score=4)
+        ReviewItem.objects.create(session_id="late", taxon=old_oak, due_at=timezone.now())
+        UserScore.objects.create(session_id="both", taxon=old_beech, score=1)
+        UserScore.objects.create(session_id="both", taxon=Taxon.objects.active().get(nom_vernaculaire="Hêtre"), score=9)
+
+        self.import_rows([("Quercus", "rubra", "Chêne"), ("Fagus", "sylvatica", "Hêtre")])
+        oak = Taxon.objects.active().get(nom_vernaculaire="Chêne")
+        self.assertEqual(UserScore.objects.get(session_id="late").taxon_id, oak.id)
+        self.assertEqual(ReviewItem.objects.get(session_id="late").taxon_id, oak.id)
+        self.assertEqual(list(UserScore.objects.filter(session_id="both").values_list("score", flat=True)), [9])
+        self.assertFalse(DatasetVersion.objects.filter(pk=old_oak.version_id).exists())
+
+    @override_settings(DATASET_VERSIONS_KEPT=2)
+    def test_old_versions_are_garbage_collected(self):
+        for espece in ["robur", "petraea", "rubra"]:
+            self.import_rows([("Quercus", espece, "Chêne")])
+        # The active version and the previous one
+        self.assertEqual(DatasetVersion.objects.filter(dataset="nature").count(), 2)
+        self.assertEqual(sorted(Taxon.objects.values_list("espece", flat=True)), ["petraea", "rubra"])
+
+
+def make_pdf(pages):
+    """Bytes of a minimal PDF drawing each table of `pages` (lists of rows of cells) as a ruled grid."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"",
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+    kids = []
+    for rows in pages:
+        ops = []
+        for r, row in enumerate(rows):
+            for c, cell in enumerate(row):
+                x, y = 20 + c * 80, 800 - (r + 1) * 20
+                ops.append(f"{x} {y} 80 20 re S")
+                if cell:
+                    ops.append(f"BT /F1 8 Tf {x + 2} {y + 6} Td ({cell}) Tj ET")
+        stream = "\n".join(ops).encode("cp1252")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 800 842] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 3 0 R >> >> >>" % len(objects))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+class PdfExtractTest(TestCase):
+    HEADER = ImportTaxonsCommandTest.HEADER
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.cache_dir = os.path.join(tmp.name, "cache")
+        self.pages = [
+            [self.HEADER, ["Plantae", "Tracheophyta", "Magnoliopsida", "Fagales", "Fagaceae", "Quercus", "robur",
+                           "Chêne pédonculé", "feuille"],
+             ["Plantae", "Tracheophyta", "Magnoliopsida", "Fagales", "Fagaceae", "Fagus", "-", "Hêtre", ""]],
+            [self.HEADER, ["Animalia", "Chordata", "Aves", "Passeriformes", "Turdidae", "Turdus", "merula",
+                           "Merle noir", ""], ["Animalia", "Chordata", "Aves", "", "", "", "", "", ""]],
+            [self.HEADER, ["Fungi", "Basidiomycota", "Agaricomycetes", "Agaricales", "Amanitaceae", "Amanita",
+                           "muscaria", "Amanite tue-mouches", "chapeau"]],
+        ]
+
+    def write_pdf(self, pages, name="nature.pdf"):
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as f:
+            f.write(make_pdf(pages))
+        return path
+
+    def serial_rows(self, path):
+        # The extraction as done before, one page after the other
+        with pdfplumber.open(path) as pdf:
+            return [row for page in pdf.pages for row in page_rows(page)]
+
+    def test_rows_match_a_serial_extraction(self):
+        path = self.write_pdf(self.pages)
+        expected = [
+            ("Plantae", "Tracheophyta", "Magnoliopsida", "Fagales", "Fagaceae", "Quercus", "robur",
+             "Chêne pédonculé", "feuille"),
+            ("Plantae", "Tracheophyta", "Magnoliopsida", "Fagales", "Fagaceae", "Fagus", None, "Hêtre", None),
+            ("Animalia", "Chordata", "Aves", "Passeriformes", "Turdidae", "Turdus", "merula", "Merle noir", None),
+            ("Fungi", "Basidiomycota", "Agaricomycetes", "Agaricales", "Amanitaceae", "Amanita", "muscaria",
+             "Amanite tue-mouches", "chapeau"),
+        ]
+        self.assertEqual(self.serial_rows(path), expected)
+        self.assertEqual(extract_rows(path, workers=2), expected)
+        self.assertEqual(extract_rows(path, self.cache_dir, workers=2), expected)
+        # Cached pages come back identical
+        self.assertEqual(extract_rows(path, self.cache_dir, workers=2), expected)
+
+    def test_only_changed_pages_are_parsed_again(self):
+        path = self.write_pdf(self.pages)
+        with mock.patch("taxons.pdf_extract.extract_pages", wraps=extract_pages) as parse:
+            extract_rows(path, self.cache_dir, workers=1)
+            self.assertEqual(parse.call_args.args[1], [0, 1, 2])
+
+            parse.reset_mock()
+            extract_rows(path, self.cache_dir, workers=1)
+            parse.assert_not_called()
+
+            self.pages[1][1][7] = "Merle"
+            revised = self.write_pdf(self.pages, "revised.pdf")
+            rows = extract_rows(revised, self.cache_dir, workers=1)
+            self.assertEqual(parse.call_args.args[1], [1])
+        self.assertEqual(rows, self.serial_rows(revised))
+
+    def test_page_hash_covers_the_resources(self):
+        path = self.write_pdf(self.pages)
+        with open(path, "rb") as f:
+            data = f.read()
+        courier = os.path.join(self.dir, "courier.pdf")
+        with open(courier, "wb") as f:
+            # Same drawing instructions, another font
+            f.write(data.replace(b"/BaseFont /Helvetica", b"/BaseFont /Courier  "))
+        with pdfplumber.open(path) as pdf, pdfplumber.open(courier) as other:
+            self.assertNotEqual(page_hash(pdf.pages[0]), page_hash(other.pages[0]))
+            self.assertEqual(page_hash(pdf.pages[0]), page_hash(pdf.pages[0], {}))
+
+    def test_database_connections_are_closed_before_forking_the_workers(self):
+        path = self.write_pdf(self.pages)
+        with mock.patch("taxons.pdf_extract.connections") as connections:
+            extract_rows(path, workers=2)
+        connections.close_all.assert_called_once_with()
+
+    def test_import_writes_the_csv_from_the_pdf(self):
+        path = self.write_pdf(self.pages)
+        csv_path = os.path.join(self.dir, "nature.csv")
+        with override_settings(PDF_CACHE_DIR=self.cache_dir):
+            ImportCommand(stdout=io.StringIO()).extract_pdf_to_csv(path, csv_path, workers=2)
+        with open(csv_path, encoding="utf-8", newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], self.HEADER)
+        self.assertEqual(rows[2], ["Plantae", "Tracheophyta", "Magnoliopsida", "Fagales", "Fagaceae", "Fagus", "",
+                                   "Hêtre", ""])
+        self.assertEqual(len(rows), 5)
+
+
+class PrefetchMediaCommandTest(TransactionTestCase):
+    def setUp(self):
+        self.fresh = make_taxon(nom_vernaculaire="Merle noir", last_update=timezone.now())
+        SearchResult.objects.create(species=self.fresh.species, title="t", link="https://example.org/1.jpg",
+                                    image_context_link="https://example.org/1")
+        self.old = make_taxon(nom_vernaculaire="Grive draine", espece="viscivorus",
+                              last_update=timezone.now() - timedelta(days=60))
+        SearchResult.objects.create(species=self.old.species, title="t", link="https://example.org/old.jpg",
+                                    image_context_link="https://example.org/old")
+        self.missing = make_taxon(nom_vernaculaire="Merle à plastron", espece="torquatus")
+        renumber_media(self.fresh.species)
+        renumber_media(self.old.species)
+
+    def fake_refresh(self, taxon, providers=None, prefetched=None):
+        result = SearchResult.objects.create(species=taxon.species, title="t",
+                                             link=f"https://example.org/{taxon.id}-new.jpg",
+                                             image_context_link="https://example.org/new")
+        renumber_media(taxon.species)
+        return [result]
+
+    def run_command(self, *args):
+        with mock.patch("taxons.management.commands.prefetch_media.refresh_media",
+                        side_effect=self.fake_refresh) as refresh:
+            call_command("prefetch_media", "--workers=2", *args, stdout=io.StringIO())
+        return {call.args[0].id for call in refresh.call_args_list}
+
+    def test_only_taxa_without_media_are_fetched(self):
+        self.assertEqual(self.run_command(), {self.missing.id})
+        self.assertEqual(self.run_command(), set())
+
+    def test_stale_after_refreshes_and_replaces_old_media(self):
+        with mock.patch("taxons.media.provider_get", side_effect=fake_provider_get):
+            call_command("prefetch_media", "--workers=1", "--stale-after=30", stdout=io.StringIO())
+        links = set(self.old.search_results.values_list("link", flat=True))
+        self.assertNotIn("https://example.org/old.jpg", links)
+        self.assertEqual(len(links), 7)
+        self.assertEqual(self.missing.search_results.count(), 7)
+        self.assertTrue(self.fresh.search_results.filter(link="https://example.org/1.jpg").exists())
+
+    def test_photos_of_known_taxa_are_fetched_in_batches(self):
+        # 3 Belgian observations of 12716, none of 12717; in France, 12717 is 1 observation in 10
+        def batched_provider_get(provider, url, params, timeout):
+            if provider != "inaturalist":
+                return {}
+            taxon_ids = {int(taxon_id) for taxon_id in str(params["taxon_id"]).split(",")}
+            belgium = params["place_id"] == 7008
+            observations = [
+                {"id": 1000 - i, "uri": f"https://www.inaturalist.org/observations/{params['place_id']}-{i}",
+                 "taxon": {"id": 99, "ancestor_ids": [1, 12716 if belgium or i % 10 else 12717]},
+                 "photos": [{"url": f"https://static.inaturalist.org/photos/{params['place_id']}-{i}/square.jpg"}]}
+                for i in range(3 if belgium else 300)
+            ]
+            observations = [obs for obs in observations if taxon_ids & set(obs["taxon"]["ancestor_ids"])]
+            observations = [obs for obs in observations if obs["id"] < params.get("id_below", 10 ** 6)]
+            return {"results": observations[:params["per_page"]]}
+
+        self.missing.inaturalist_taxon_id = 12716
+        self.missing.save()
+        other = make_taxon(nom_vernaculaire="Grive musicienne", espece="philomelos", inaturalist_taxon_id=12717)
+        with mock.patch("taxons.media.provider_get", side_effect=batched_provider_get) as provider_get:
+            call_command("prefetch_media", "--workers=1", stdout=io.StringIO())
+        inaturalist_calls = [c.kwargs["params"] for c in provider_get.call_args_list if "observations" in c.args[1]]
+        # Belgium, then France for both (fewer than 4 Belgian photos each), then France for 12717 only
+        self.assertEqual([(c["taxon_id"], c["place_id"]) for c in inaturalist_calls],
+                         [("12716,12717", 7008), ("12716,12717", 6753), ("12717", 6753)])
+        self.assertEqual(inaturalist_calls[2]["id_below"], 801)
+        self.missing.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.missing.photo_count, 3 + 30)
+        self.assertEqual(other.photo_count, 30)
+        self.assertEqual(
+            self.missing.search_results.filter(ordinal=0).get().link,
+            "https://static.inaturalist.org/photos/7008-0/medium.jpg",
+        )
+
+    def test_taxa_being_fetched_elsewhere_are_skipped(self):
+        MediaFetchLease.objects.create(species=self.missing.species, expires_at=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(self.run_command(), set())
+        self.assertTrue(MediaFetchLease.objects.filter(species=self.missing.species).exists())
+
+    def test_each_taxon_is_leased_right_before_its_own_fetch(self):
+        other = make_taxon(nom_vernaculaire="Grive musicienne", espece="philomelos")
+        leased = []
+
+        def refresh(taxon, providers=None, prefetched=None):
+            leased.append(set(MediaFetchLease.objects.values_list("species_id", flat=True)))
+            return self.fake_refresh(taxon, providers, prefetched)
+
+        with mock.patch("taxons.management.commands.prefetch_media.refresh_media", side_effect=refresh):
+            call_command("prefetch_media", "--workers=1", stdout=io.StringIO())
+        self.assertEqual(leased, [{self.missing.species_id}, {other.species_id}])
+
+    def test_batched_photos_of_a_busy_taxon_are_not_stored(self):
+        self.missing.inaturalist_taxon_id = 12716
+        self.missing.save()
+        MediaFetchLease.objects.create(species=self.missing.species, expires_at=timezone.now() + timedelta(minutes=1))
+        photo = SearchResult(species=self.missing.species, title="t", link="https://example.org/batched.jpg",
+                             image_context_link="https://example.org/batched")
+        with mock.patch("taxons.management.commands.prefetch_media.fetch_images_for_taxa",
+                        return_value={self.missing.id: [photo]}) as batch:
+            call_command("prefetch_media", "--workers=1", stdout=io.StringIO())
+        self.assertEqual(batch.call_args.args[0], [self.missing])
+        self.assertFalse(self.missing.search_results.exists())
+
 
 @override_settings(STORAGES={
     "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
@@ -140,3 +1014,518 @@ class IndexViewDatasetTest(TestCase):
         self.client.get("/?dataset=nature")
         session = self.client.session
         self.assertEqual(session["current_dataset"], "nature")
+
+
+def fake_provider_get(provider, url, params, timeout):
+    if "autocomplete" in url:
+        return {"results": [{"id": 12716}]}
+    if "observations" in url:
+        return {"results": [
+            {"uri": f"https://www.inaturalist.org/observations/{params['place_id']}{i}",
+             "photos": [{"url": f"https://static.inaturalist.org/photos/{params['place_id']}{i}/square.jpg",
+                         "attribution": "(c) someone"}]}
+            for i in range(3)
+        ]}
+    return {"recordings": [{"file": "https://xeno-canto.org/1/download", "url": "https://xeno-canto.org/1",
+                            "loc": "Namur", "cnt": "Belgium", "type": "song", "q": "A", "rec": "someone",
+                            "length": "0:42"}]}
+
+
+@override_settings(STORAGES={
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+})
+@mock.patch("taxons.media.provider_get", side_effect=fake_provider_get)
+class MediaViewsTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.taxon = make_taxon(nom_vernaculaire="Merle noir")
+        self.client.get("/?dataset=nature")
+
+    def test_images_grid_fetches_media_and_picks_photo_and_song(self, provider_get):
+        resp = self.client.get(f"/images_grid/{self.taxon.id}/")
+        self.assertEqual(resp.status_code, 200)
+        # 3 Belgian observations (< 4) so French ones are added too, plus the recordings
+        self.assertEqual(self.taxon.search_results.count(), 7)
+        self.assertEqual(len(self.client.session["search_results_ids"]), 1)
+        self.assertIn("current_song_id", self.client.session)
+
+    def test_adding_photos_costs_points(self, provider_get):
+        self.client.get(f"/images_grid/{self.taxon.id}/")
+        self.client.post(f"/images_grid/{self.taxon.id}/")
+        self.assertEqual(len(self.client.session["search_results_ids"]), 2)
+        self.assertEqual(self.client.session["current_score"], 8)
+
+    def test_correct_answer_scores_and_shows_photos(self, provider_get):
+        resp = self.client.post("/submit_answer/", {"answer": "merle noir"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(UserScore.objects.get(taxon=self.taxon).score, 10)
+        self.assertEqual(resp.content.decode().count("<img"), 4)
+
+    def test_wrong_answer_penalizes_guessed_taxon(self, provider_get):
+        guessed = make_taxon(nom_vernaculaire="Grive draine", espece="viscivorus")
+        UserScore.objects.create(session_id=self.client.session["user_session_id"], taxon=guessed, score=8)
+        self.client.post("/submit_answer/", {"answer": "Grive draine"})
+        self.assertEqual(UserScore.objects.get(taxon=guessed).score, 3)
+        self.assertEqual(UserScore.objects.get(taxon=self.taxon).score, 0)
+
+
+@mock.patch("taxons.media.provider_get", side_effect=fake_provider_get)
+class SingleFlightMediaFetchTest(TestCase):
+    def setUp(self):
+        self.taxon = make_taxon(nom_vernaculaire="Merle noir")
+
+    def test_refetch_does_not_duplicate_links(self, provider_get):
+        fetch_media_for_taxon(self.taxon)
+        fetch_media_for_taxon(self.taxon)
+        self.assertEqual(self.taxon.search_results.count(), 7)
+
+    def test_lease_is_released_after_fetch(self, provider_get):
+        ensure_media(self.taxon)
+        self.assertEqual(self.taxon.search_results.count(), 7)
+        self.assertFalse(MediaFetchLease.objects.exists())
+
+    @override_settings(MEDIA_FETCH_WAIT=0.3)
+    def test_waits_for_fetch_in_progress_instead_of_fetching(self, provider_get):
+        MediaFetchLease.objects.create(species=self.taxon.species, expires_at=timezone.now() + timedelta(minutes=1))
+        start = time.monotonic()
+        ensure_media(self.taxon)
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        provider_get.assert_not_called()
+
+    def test_expired_lease_is_taken_over(self, provider_get):
+        MediaFetchLease.objects.create(species=self.taxon.species, expires_at=timezone.now() - timedelta(seconds=1))
+        ensure_media(self.taxon)
+        self.assertEqual(self.taxon.search_results.count(), 7)
+        self.assertFalse(MediaFetchLease.objects.exists())
+
+    @override_settings(MEDIA_FETCH_WAIT=0)
+    def test_images_grid_reports_fetch_in_progress(self, provider_get):
+        MediaFetchLease.objects.create(species=self.taxon.species, expires_at=timezone.now() + timedelta(minutes=1))
+        resp = self.client.get(f"/images_grid/{self.taxon.id}/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("en cours", resp.content.decode())
+        provider_get.assert_not_called()
+
+
+@override_settings(MEDIA_TTL_DAYS={"inaturalist": 30, "xenocanto": 90})
+class MediaFreshnessTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch("taxons.media.provider_get", side_effect=fake_provider_get)
+        self.provider_get = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.taxon = make_taxon(nom_vernaculaire="Merle noir")
+        fetch_media_for_taxon(self.taxon)
+
+    def age(self, provider, days):
+        MediaStatus.objects.filter(species=self.taxon.species, provider=provider).update(
+            refreshed_at=timezone.now() - timedelta(days=days)
+        )
+
+    def test_fetch_marks_every_provider_fresh(self):
+        self.assertIsNotNone(Taxon.objects.get(id=self.taxon.id).last_update)
+        self.assertEqual(stale_providers(self.taxon), [])
+
+    def test_each_provider_has_its_own_ttl(self):
+        self.age("inaturalist", 40)
+        self.age("xenocanto", 40)
+        self.assertEqual(stale_providers(self.taxon), ["inaturalist"])
+
+    def test_media_without_status_falls_back_to_last_update(self):
+        MediaStatus.objects.all().delete()
+        self.taxon.last_update = None
+        self.assertEqual(stale_providers(self.taxon), ["xenocanto", "inaturalist"])
+
+    def test_stale_media_is_served_while_refreshed_in_background(self):
+        self.age("inaturalist", 40)
+        self.provider_get.reset_mock()
+        with mock.patch("taxons.media.threading.Thread") as thread:
+            ensure_media(self.taxon)
+        self.provider_get.assert_not_called()
+        thread.return_value.start.assert_called_once()
+        self.assertEqual(thread.call_args.kwargs["args"][1], ["inaturalist"])
+        # The refresh holds the lease: no second refresh is started meanwhile
+        with mock.patch("taxons.media.threading.Thread") as thread:
+            ensure_media(self.taxon)
+        thread.assert_not_called()
+
+    def test_refresh_replaces_only_the_refreshed_provider(self):
+        song = provider_results(self.taxon, "xenocanto").get()
+        SearchResult.objects.create(species=self.taxon.species, title="t", link="https://example.org/gone.jpg",
+                                    image_context_link="https://example.org/gone", provider="inaturalist")
+        refresh_media(self.taxon, ["inaturalist"])
+        self.assertFalse(self.taxon.search_results.filter(link="https://example.org/gone.jpg").exists())
+        self.assertTrue(self.taxon.search_results.filter(id=song.id).exists())
+        self.assertEqual(self.taxon.search_results.count(), 7)
+
+    def test_failed_refresh_keeps_media(self):
+        self.provider_get.side_effect = RuntimeError("down")
+        before = self.taxon.search_results.count()
+        self.assertIsNone(refresh_media(self.taxon))
+        self.assertEqual(self.taxon.search_results.count(), before)
+
+
+@override_settings(MEDIA_MISS_RETRY_HOURS=1, MEDIA_MISS_RETRY_MAX_DAYS=30)
+class MediaMissTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch("taxons.media.provider_get", return_value={})
+        self.provider_get = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.taxon = make_taxon(nom_vernaculaire="Merle noir", inaturalist_taxon_id=12716)
+
+    def test_empty_answers_are_cached_per_provider(self):
+        ensure_media(self.taxon)
+        calls = self.provider_get.call_count
+        self.assertEqual(set(MediaStatus.objects.filter(misses=1).values_list("provider", flat=True)),
+                         {"inaturalist", "xenocanto"})
+        ensure_media(self.taxon)
+        self.assertEqual(self.provider_get.call_count, calls)
+
+    def test_only_missed_provider_is_skipped(self):
+        MediaStatus.objects.create(species=self.taxon.species, provider="xenocanto", refreshed_at=timezone.now(),
+                                   misses=1, retry_at=timezone.now() + timedelta(hours=1))
+        ensure_media(self.taxon)
+        self.assertEqual({call.args[0] for call in self.provider_get.call_args_list}, {"inaturalist"})
+
+    def test_back_off_doubles_until_the_cap(self):
+        for misses, expected in [(1, timedelta(hours=1)), (3, timedelta(hours=4)), (20, timedelta(days=30))]:
+            status = MediaStatus.objects.update_or_create(
+                species=self.taxon.species, provider="inaturalist",
+                defaults={"refreshed_at": timezone.now(), "misses": misses - 1, "retry_at": timezone.now()},
+            )[0]
+            fetch_media_for_taxon(self.taxon, ["inaturalist"])
+            status.refresh_from_db()
+            self.assertEqual(status.misses, misses)
+            self.assertAlmostEqual((status.retry_at - status.refreshed_at).total_seconds(),
+                                   expected.total_seconds(), delta=1)
+
+    def test_miss_is_retried_after_back_off_and_cleared_by_results(self):
+        MediaStatus.objects.create(species=self.taxon.species, provider="inaturalist", refreshed_at=timezone.now(),
+                                   misses=2, retry_at=timezone.now() - timedelta(seconds=1))
+        self.provider_get.side_effect = fake_provider_get
+        ensure_media(self.taxon)
+        status = MediaStatus.objects.get(species=self.taxon.species, provider="inaturalist")
+        self.assertEqual((status.misses, status.retry_at), (0, None))
+
+    def test_failed_refresh_backs_off_without_new_lease_or_thread(self):
+        self.provider_get.side_effect = ConnectionError
+        last_update = timezone.now() - timedelta(days=60)
+        Taxon.objects.filter(pk=self.taxon.pk).update(last_update=last_update)
+        self.taxon.refresh_from_db()
+        fetch_media_for_taxon(self.taxon, ["inaturalist"])
+        status = MediaStatus.objects.get(species=self.taxon.species, provider="inaturalist")
+        self.assertEqual((status.failures, status.misses, status.refreshed_at), (1, 0, last_update))
+        self.assertAlmostEqual((status.retry_at - timezone.now()).total_seconds(), 5 * 60, delta=5)
+        calls = self.provider_get.call_count
+        with mock.patch("taxons.media.threading.Thread") as thread:
+            self.assertFalse(revalidate_media(self.taxon))
+        thread.assert_not_called()
+        self.assertFalse(MediaFetchLease.objects.exists())
+        self.assertEqual(self.provider_get.call_count, calls)
+
+    def test_images_grid_skips_missed_taxon_without_network(self):
+        for provider in ("inaturalist", "xenocanto"):
+            MediaStatus.objects.create(species=self.taxon.species, provider=provider, refreshed_at=timezone.now(),
+                                       misses=1, retry_at=timezone.now() + timedelta(hours=1))
+        resp = self.client.get(f"/images_grid/{self.taxon.id}/")
+        self.assertEqual(resp.status_code, 404)
+        self.provider_get.assert_not_called()
+
+
+@override_settings(STORAGES={
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+})
+class MediaSamplingTest(TestCase):
+    def setUp(self):
+        self.taxon = make_taxon(nom_vernaculaire="Merle noir", last_update=timezone.now())
+        SearchResult.objects.bulk_create(
+            [SearchResult(species=self.taxon.species, title="t", link=f"https://example.org/{i}.jpg",
+                          image_context_link=f"https://www.inaturalist.org/observations/{i}") for i in range(10)]
+            + [SearchResult(species=self.taxon.species, title="t", link=f"https://xeno-canto.org/{i}/download",
+                            image_context_link=f"https://xeno-canto.org/{i}", kind=SearchResult.AUDIO,
+                            provider="xenocanto") for i in range(3)]
+        )
+        renumber_media(self.taxon.species)
+        self.taxon.refresh_from_db()
+
+    def test_counters_follow_media(self):
+        self.assertEqual((self.taxon.photo_count, self.taxon.song_count), (10, 3))
+        media_of_kind(self.taxon, SearchResult.AUDIO).delete()
+        renumber_media(self.taxon.species)
+        taxon = Taxon.objects.get(id=self.taxon.id)
+        self.assertEqual((taxon.photo_count, taxon.song_count), (10, 0))
+
+    def test_ordinals_are_dense_per_kind(self):
+        self.assertEqual(sorted(media_of_kind(self.taxon, "photo").values_list("ordinal", flat=True)), list(range(10)))
+        self.assertEqual(sorted(media_of_kind(self.taxon, "audio").values_list("ordinal", flat=True)), [0, 1, 2])
+
+    def test_renumber_after_delete_keeps_order(self):
+        photos = list(media_of_kind(self.taxon, "photo").order_by("ordinal"))
+        photos[3].delete()
+        renumber_media(self.taxon.species)
+        self.assertEqual(list(media_of_kind(self.taxon, "photo").order_by("ordinal").values_list("id", flat=True)),
+                         [p.id for p in photos if p.id != photos[3].id])
+
+    def test_sample_returns_distinct_media_of_the_kind(self):
+        picked = sample_media(self.taxon, "photo", 4)
+        self.assertEqual(len({p.id for p in picked}), 4)
+        self.assertTrue(all(p.kind == SearchResult.PHOTO for p in picked))
+        self.assertEqual(len(sample_media(self.taxon, "audio", 5)), 3)
+
+    def test_sample_skips_excluded_ids(self):
+        shown = [p.id for p in media_of_kind(self.taxon, "photo")[:8]]
+        for _ in range(10):
+            picked = sample_media(self.taxon, "photo", 2, exclude_ids=shown)
+            self.assertEqual(len(picked), 2)
+            self.assertFalse({p.id for p in picked} & set(shown))
+        self.assertEqual(sample_media(self.taxon, "photo", 3, exclude_ids=shown + [picked[0].id]), [picked[1]])
+
+    def test_views_do_not_sort_randomly(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/?dataset=nature")
+            self.client.get(f"/images_grid/{self.taxon.id}/")
+            self.client.post(f"/images_grid/{self.taxon.id}/")
+            self.client.post("/submit_answer/", {"answer": "Merle noir"})
+        self.assertEqual(len(self.client.session["search_results_ids"]), 2)
+        media_queries = [q["sql"] for q in queries.captured_queries if "taxons_searchresult" in q["sql"]]
+        self.assertTrue(media_queries)
+        self.assertFalse([sql for sql in media_queries if "RANDOM()" in sql.upper()])
+
+
+class XenoCantoRankingTest(TestCase):
+    def recording(self, name, cnt="Belgium", type="call", q="B", length="0:30"):
+        return {"file": name, "cnt": cnt, "type": type, "q": q, "length": length}
+
+    def test_same_priority_as_the_per_country_queries(self):
+        recordings = [
+            self.recording("fr-song", cnt="France", type="song"),
+            self.recording("de-song", cnt="Germany", type="song", q="A"),
+            self.recording("be-call"),
+            self.recording("be-song-c", type="song", q="C"),
+            self.recording("be-song-a-long", type="song", q="A", length="4:10"),
+            self.recording("be-song-a", type="song, call", q="A"),
+            self.recording("be-song-unrated", type="song", q="no score"),
+            self.recording("fr-call", cnt="France"),
+        ]
+        self.assertEqual(
+            [r["file"] for r in rank_recordings(recordings)],
+            ["be-song-a", "be-song-a-long", "be-song-c", "be-song-unrated", "be-call", "fr-song", "fr-call"],
+        )
+
+    @mock.patch("taxons.media.provider_get", side_effect=fake_provider_get)
+    def test_one_query_per_species(self, provider_get):
+        taxon = make_taxon()
+        fetch_media_for_taxon(taxon, ["xenocanto"])
+        self.assertEqual(provider_get.call_count, 1)
+        self.assertIn("box:", provider_get.call_args.kwargs["params"]["query"])
+        self.assertEqual(taxon.song_count, 1)
+
+    def fetch_with_answers(self, answers):
+        """Fetch a taxon's sounds, each query answered with the recordings of the first key it contains."""
+        def provider_get(provider, url, params, timeout):
+            return {"recordings": next((r for key, r in answers.items() if key in params["query"]), [])}
+
+        with mock.patch("taxons.media.provider_get", side_effect=provider_get) as get:
+            fetch_media_for_taxon(make_taxon(), ["xenocanto"])
+        return [call.kwargs["params"]["query"].split()[-1] for call in get.call_args_list]
+
+    def test_per_country_queries_when_the_box_has_no_belgian_recording(self):
+        queries = self.fetch_with_answers({
+            "box:": [self.recording("fr-song", cnt="France", type="song")],
+            # Recordings without coordinates only come with cnt:, the others are in the box again
+            "cnt:Belgium": [self.recording("be-call"), self.recording("fr-song", cnt="France", type="song")],
+        })
+        self.assertEqual(queries, [f"box:{XENOCANTO_BOX}", "cnt:Belgium"])
+        self.assertEqual(list(SearchResult.objects.order_by("id").values_list("link", flat=True)),
+                         ["be-call", "fr-song"])
+
+    def test_france_is_queried_last(self):
+        queries = self.fetch_with_answers({"cnt:France": [self.recording("fr-call", cnt="France")]})
+        self.assertEqual(queries, [f"box:{XENOCANTO_BOX}", "cnt:Belgium", "cnt:France"])
+        self.assertEqual(SearchResult.objects.get().link, "fr-call")
+
+
+@mock.patch("taxons.media.provider_get", side_effect=fake_provider_get)
+class SharedSpeciesMediaTest(TestCase):
+    def setUp(self):
+        self.nature = make_taxon(dataset="nature", nom_vernaculaire="Merle noir")
+        self.rando = make_taxon(dataset="rando", nom_vernaculaire="Merle", genre=" turdus", espece="Merula ")
+
+    def test_species_key(self, provider_get):
+        self.assertEqual(self.nature.species, self.rando.species)
+        self.assertEqual(self.nature.species.key, "name:turdus merula")
+        inat = make_taxon(dataset="other", nom_vernaculaire="Merle", inaturalist_taxon_id=12716)
+        self.assertEqual(inat.species.key, "inat:12716")
+
+    def test_media_is_fetched_once_for_every_dataset(self, provider_get):
+        ensure_media(self.nature)
+        calls = provider_get.call_count
+        rando = Taxon.objects.get(id=self.rando.id)
+        self.assertEqual((rando.photo_count, rando.song_count), (6, 1))
+        ensure_media(rando)
+        self.assertEqual(provider_get.call_count, calls)
+        self.assertEqual(list(rando.search_results), list(self.nature.search_results))
+
+    def test_taxon_joining_a_species_takes_its_counters(self, provider_get):
+        ensure_media(self.nature)
+        other = make_taxon(dataset="other", nom_vernaculaire="Merle")
+        self.assertEqual((other.photo_count, other.song_count), (6, 1))
+
+
+@mock.patch("taxons.media.provider_get", side_effect=fake_provider_get)
+class InaturalistIdWriteBackTest(TestCase):
+    def setUp(self):
+        self.nature = make_taxon(dataset="nature", nom_vernaculaire="Merle noir")
+        self.rando = make_taxon(dataset="rando", nom_vernaculaire="Merle")
+
+    def autocomplete_calls(self, provider_get):
+        return [c for c in provider_get.call_args_list if "autocomplete" in c.args[1]]
+
+    def test_resolved_id_is_written_back_to_the_species(self, provider_get):
+        fetch_media_for_taxon(self.nature)
+        self.assertEqual(len(self.autocomplete_calls(provider_get)), 1)
+        for taxon in (self.nature, self.rando):
+            taxon.refresh_from_db()
+            self.assertEqual(taxon.inaturalist_taxon_id, 12716)
+            self.assertEqual(taxon.species.key, "inat:12716")
+            self.assertEqual((taxon.photo_count, taxon.song_count), (6, 1))
+
+        refresh_media(self.rando)
+        self.assertEqual(len(self.autocomplete_calls(provider_get)), 1)
+
+    def test_id_already_used_in_the_dataset_is_not_written(self, provider_get):
+        blackbird = make_taxon(dataset="nature", nom_vernaculaire="Merle", genre="Turdus", espece="merula merula",
+                               inaturalist_taxon_id=12716)
+        fetch_media_for_taxon(self.nature)
+        self.nature.refresh_from_db()
+        self.rando.refresh_from_db()
+        self.assertIsNone(self.nature.inaturalist_taxon_id)
+        self.assertEqual(self.nature.species.key, "name:turdus merula")
+        self.assertEqual(self.rando.inaturalist_taxon_id, 12716)
+        self.assertEqual(self.rando.species, blackbird.species)
+        # The media fetched under the name follows the taxa that moved
+        self.assertEqual((self.rando.photo_count, self.rando.song_count), (6, 1))
+        self.assertEqual((self.nature.photo_count, self.nature.song_count), (6, 1))
+
+    def test_backfill_command(self, provider_get):
+        make_taxon(dataset="nature", nom_vernaculaire="Inconnu", genre="Nullus", espece="ignotus")
+        out = io.StringIO()
+        with mock.patch("taxons.management.commands.backfill_inaturalist_ids.provider_get",
+                        side_effect=lambda provider, url, params, timeout:
+                        {"results": [{"id": 12716}] if params["q"] == "Turdus merula" else []}):
+            call_command("backfill_inaturalist_ids", "--pause", "0", stdout=out)
+        self.assertIn("1 species resolved, 1 not found, 0 failed, 0 collisions", out.getvalue())
+        self.assertEqual(Taxon.objects.filter(inaturalist_taxon_id=12716).count(), 2)
+
+
+class SlowProviderLoadTest(TestCase):
+    """Fetching media for several birds from slow providers, sync then async."""
+
+    DELAY = 0.05  # seconds per provider call
+
+    def setUp(self):
+        self.taxa = [make_taxon(nom_vernaculaire=f"Oiseau {i}", espece=f"sp{i}", inaturalist_taxon_id=i)
+                     for i in range(4)]
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def slow_provider_get(self, provider, url, params, timeout):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.DELAY)
+        with self.lock:
+            self.in_flight -= 1
+        return {}
+
+    async def test_async_fetch_is_faster_than_the_sync_one(self):
+        def fetch_all_sync():
+            for taxon in self.taxa:
+                fetch_media_for_taxon(taxon)
+
+        with mock.patch("taxons.media.provider_get", side_effect=self.slow_provider_get) as provider_get:
+            start = time.monotonic()
+            await sync_to_async(fetch_all_sync)()
+            sync_seconds = time.monotonic() - start
+            sync_calls = provider_get.call_count
+            self.assertEqual(self.max_in_flight, 1)
+
+            start = time.monotonic()
+            await asyncio.gather(*(afetch_media_for_taxon(taxon) for taxon in self.taxa))
+            async_seconds = time.monotonic() - start
+
+        # Each bird: Belgium, then France (Belgium has fewer than 4 observations), then Xeno-canto around
+        # both countries, in Belgium and in France (no recording anywhere)
+        self.assertEqual(sync_calls, 4 * 5)
+        self.assertEqual(provider_get.call_count - sync_calls, sync_calls)
+        self.assertGreater(self.max_in_flight, 1)
+        # The sync path waits for every call in turn; the async one waits for the birds concurrently
+        self.assertGreaterEqual(sync_seconds, sync_calls * self.DELAY)
+        self.assertLess(async_seconds, sync_seconds / 2)
+
+
+class MediaMirrorTest(TestCase):
+    LINK = "https://inaturalist-open-data.s3.amazonaws.com/photos/1/medium.jpeg"
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        override = override_settings(MEDIA_MIRROR_ROOT=self.root, MEDIA_MIRROR_ACCEL_PREFIX="")
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def cache(self, link, content=b"jpeg"):
+        path = mirror_file(mirror_name(link))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def test_provider_url_until_cached(self):
+        self.assertEqual(mirrored_url(self.LINK), self.LINK)
+        self.cache(self.LINK)
+        self.assertEqual(mirrored_url(self.LINK), f"/mirror/{mirror_name(self.LINK)}")
+
+    def test_disabled_mirror_keeps_provider_url(self):
+        self.cache(self.LINK)
+        with override_settings(MEDIA_MIRROR_ROOT=""):
+            self.assertEqual(mirrored_url(self.LINK), self.LINK)
+
+    def test_download_is_cached_by_url(self):
+        resp = mock.Mock()
+        resp.iter_content.return_value = [b"jp", b"eg"]
+        with mock.patch("taxons.mirror.requests_session") as session:
+            session.return_value.get.return_value = resp
+            mirror_link(self.LINK)
+            mirror_link(self.LINK)
+        self.assertEqual(session.return_value.get.call_count, 1)
+        with open(mirror_file(mirror_name(self.LINK)), "rb") as f:
+            self.assertEqual(f.read(), b"jpeg")
+
+    def test_served_with_immutable_cache_headers(self):
+        self.cache(self.LINK)
+        resp = self.client.get(mirrored_url(self.LINK))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(b"".join(resp.streaming_content), b"jpeg")
+        self.assertIn("immutable", resp["Cache-Control"])
+
+    def test_x_accel_redirect(self):
+        self.cache(self.LINK)
+        with override_settings(MEDIA_MIRROR_ACCEL_PREFIX="/protected-mirror/"):
+            resp = self.client.get(mirrored_url(self.LINK))
+        self.assertEqual(resp["X-Accel-Redirect"], f"/protected-mirror/{mirror_name(self.LINK)}")
+        self.assertEqual(resp["Content-Type"], "image/jpeg")
+
+    def test_unknown_file_is_404(self):
+        self.assertEqual(self.client.get(f"/mirror/{mirror_name(self.LINK)}").status_code, 404)
+
+    def test_eviction_removes_least_recently_used(self):
+        old = self.cache("https://example.org/old.jpg", b"x" * 10)
+        new = self.cache("https://example.org/new.jpg", b"x" * 10)
+        os.utime(old, (1, 1))
+        self.assertEqual(evict(max_bytes=15), 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
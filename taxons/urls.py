@@ -1,5 +1,6 @@
 from . import views
 from django.urls import path
+from django.urls import re_path
 
 
 urlpatterns = [
@@ -8,4 +9,5 @@ urlpatterns = [
     path("submit_answer/", views.render_result, name="submit_answer"),
     path("show_propositions/", views.show_propositions, name="show_propositions"),
     path("skip_question/", views.skip_question, name="skip_question"),
+    re_path(r"^mirror/(?P<name>[0-9a-f]{2}/[0-9a-f]{64}\.[a-z]+)$", views.serve_mirror, name="mirror"),
 ]
@@ -1,10 +1,90 @@
-import requests
+from collections import OrderedDict
+from django.conf import settings
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+import os
+import requests
+import threading
+
+
+class HttpClient:
+    """Pooled outbound HTTP client shared by every thread of a process.
+
+    Connections are kept alive and reused per host (at most HTTP_POOL_MAXSIZE each), and JSON
+    responses carrying an ETag are revalidated with If-None-Match instead of downloaded again. The kept
+    responses add up to at most `etag_cache_bytes` of response bodies, least recently used dropped first.
+    Server errors are retried with back-off, except for requests sent with retries=False (a request
+    budget is running: a single attempt keeps the call within its timeout).
+    """
+
+    def __init__(self, pool_connections, pool_maxsize, etag_cache_bytes):
+        retry = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
+        self.session = self._session(retry, pool_connections, pool_maxsize)
+        self.single_attempt_session = self._session(0, pool_connections, pool_maxsize)
+        self._etag_cache_bytes = etag_cache_bytes
+        self._etags = OrderedDict()  # (url, params) → (etag, decoded body, body size in bytes)
+        self._etag_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _session(max_retries, pool_connections, pool_maxsize):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            max_retries=max_retries, pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=True
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def get_json(self, url, params=None, timeout=None, retries=True):
+        key = (url, tuple(sorted((params or {}).items())))
+        with self._lock:
+            cached = self._etags.get(key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+
+        session = self.session if retries else self.single_attempt_session
+        resp = session.get(url, params=params, timeout=timeout, headers=headers)
+        if resp.status_code == 304 and cached:
+            with self._lock:
+                self._etags[key] = cached
+                self._etags.move_to_end(key)
+            return cached[1]
+        resp.raise_for_status()
+        data = resp.json()
+
+        etag = resp.headers.get("ETag")
+        size = len(resp.content)
+        # A body larger than the whole cache would only evict everything else
+        if etag and size <= self._etag_cache_bytes:
+            with self._lock:
+                previous = self._etags.pop(key, None)
+                if previous:
+                    self._etag_bytes -= previous[2]
+                self._etags[key] = (etag, data, size)
+                self._etag_bytes += size
+                while self._etag_bytes > self._etag_cache_bytes:
+                    self._etag_bytes -= self._etags.popitem(last=False)[1][2]
+        return data
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def http_client():
+    """Return the HttpClient of this process, creating a fresh one after a fork."""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = HttpClient(
+                    settings.HTTP_POOL_CONNECTIONS, settings.HTTP_POOL_MAXSIZE, settings.HTTP_ETAG_CACHE_BYTES
+                )
+                _client_pid = os.getpid()
+    return _client
+
 
 def requests_session():
-    session = requests.Session()
-    retry = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-    session.mount("https://", HTTPAdapter(max_retries=retry))
-    return session
+    return http_client().session
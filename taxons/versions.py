@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case
+from django.db.models import Q
+from django.db.models import When
+from django.utils import timezone
+from taxons.catalog import bump_catalog_version
+from taxons.models import DatasetVersion
+from taxons.models import ReviewItem
+from taxons.models import UserScore
+
+
+REMAP_BATCH_SIZE = 500
+
+
+def _remap(model, taxon_ids):
+    """Point the rows of `model` at the new taxa (old taxon id → new taxon id)."""
+    pairs = list(taxon_ids.items())
+    for start in range(0, len(pairs), REMAP_BATCH_SIZE):
+        batch = dict(pairs[start:start + REMAP_BATCH_SIZE])
+        model.objects.filter(taxon_id__in=batch).update(
+            taxon_id=Case(*(When(taxon_id=old, then=new) for old, new in batch.items()))
+        )
+
+
+def _remap_leftovers(model, version, new_ids):
+    """Point the rows of `model` still on older inactive versions at the taxa of `version`.
+
+    Those are answers recorded against a taxon of the previous version after its activation was committed.
+    A row whose session already has one for the new taxon is left to be deleted with its version.
+    """
+    leftovers = model.objects.filter(taxon__version__dataset=version.dataset, taxon__version__active=False).exclude(
+        taxon__version=version
+    ).values_list("pk", "session_id", "taxon__nom_vernaculaire")
+    taken = set(model.objects.filter(taxon__version=version).values_list("session_id", "taxon_id"))
+    for pk, session_id, nom_vernaculaire in leftovers:
+        new_id = new_ids.get(nom_vernaculaire)
+        if new_id is not None and (session_id, new_id) not in taken:
+            model.objects.filter(pk=pk).update(taxon_id=new_id)
+            taken.add((session_id, new_id))
+
+
+def activate_version(version):
+    """Make `version` the one players see, in a single transaction.
+
+    Scores and review items follow their taxon (same nom_vernaculaire) into the new version; those of rows
+    gone from the dataset stay with the previous version until it is garbage-collected.
+
+    The previous version's taxa are locked first: an answer recorded against one of them waits for the
+    switch instead of landing between the remap and the commit. Such late answers are moved along by the
+    next activation, before collect_versions deletes their version.
+    """
+    with transaction.atomic():
+        previous = DatasetVersion.objects.select_for_update().filter(dataset=version.dataset, active=True).first()
+        if previous is not None:
+            new_ids = dict(version.taxa.values_list("nom_vernaculaire", "id"))
+            taxon_ids = {
+                old_id: new_ids[nom_vernaculaire]
+                for old_id, nom_vernaculaire in previous.taxa.select_for_update().values_list("id", "nom_vernaculaire")
+                if nom_vernaculaire in new_ids
+            }
+            for model in (UserScore, ReviewItem):
+                _remap(model, taxon_ids)
+                _remap_leftovers(model, version, new_ids)
+            DatasetVersion.objects.filter(pk=previous.pk).update(active=False)
+        version.active = True
+        version.activated_at = timezone.now()
+        version.save(update_fields=["active", "activated_at"])
+        # Same transaction: the workers reload their catalog exactly when the new version becomes visible
+        bump_catalog_version()
+
+
+def collect_versions(dataset, keep=None):
+    """Delete the versions of `dataset` older than the `keep` last activated ones, with their taxa.
+
+    Versions never activated (interrupted imports) older than the active one are deleted too.
+    Returns the number of versions deleted.
+    """
+    keep = settings.DATASET_VERSIONS_KEPT if keep is None else keep
+    versions = DatasetVersion.objects.filter(dataset=dataset)
+    active = versions.filter(active=True).first()
+    if active is None:
+        return 0
+    kept = list(
+        versions.exclude(activated_at=None).order_by("-activated_at", "-pk").values_list("pk", flat=True)[:max(keep, 1)]
+    )
+    stale = versions.exclude(pk__in=kept).filter(Q(activated_at__isnull=False) | Q(pk__lt=active.pk))
+    count = stale.count()
+    if count:
+        # Cascades to the taxa, their neighbors, scores and review items
+        stale.delete()
+    return count
@@ -1,12 +1,30 @@
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.http import FileResponse
+from django.http import Http404
 from django.http import HttpResponse
 from django.shortcuts import render
 from django.template.loader import render_to_string
+from taxons.catalog import get_catalog
+from taxons.distractors import pick_distractors
+from taxons.media import aensure_media
+from taxons.media import asample_media
+from taxons.media import has_media
+from taxons.media import media_fetch_in_progress
+from taxons.media import media_of_kind
+from taxons.mirror import mirror_enabled
+from taxons.mirror import mirror_file
+from taxons.mirror import touch
 from taxons.models import SearchResult
 from taxons.models import Taxon
 from taxons.models import UserScore
-from taxons.utils import requests_session
+from taxons.providers import outbound_budget
+from taxons.providers import provider_available
+from taxons.strategies import get_strategy
 
+import asyncio
+import mimetypes
+import os
 import random
 import secrets
 
@@ -27,7 +45,7 @@ CATEGORIES = [
 
 
 def get_score_lists(session_id, dataset="", category=""):
-    qs = UserScore.objects.filter(session_id=session_id)
+    qs = UserScore.objects.filter(session_id=session_id, taxon__version__active=True)
     if dataset:
         qs = qs.filter(taxon__dataset=dataset)
     if category:
@@ -51,28 +69,10 @@ def get_or_create_session_id(request):
     return request.session["user_session_id"]
 
 
-def get_next_taxon(session_id, dataset="", category=""):
-    qs = Taxon.objects.all()
-    if dataset:
-        qs = qs.filter(dataset=dataset)
-    if category:
-        qs = qs.filter(category=category)
-
-    user_scores = UserScore.objects.filter(session_id=session_id)
-    scored_taxon_ids = {score.taxon_id: score.score for score in user_scores}
-
-    all_taxons = list(qs)
-    taxon_scores = []
-    for taxon in all_taxons:
-        score = scored_taxon_ids.get(taxon.id, 0)
-        taxon_scores.append((taxon, score))
-
-    if taxon_scores:
-        min_score = min(score for _, score in taxon_scores)
-        lowest_scoring_taxons = [taxon for taxon, score in taxon_scores if score == min_score]
-        return random.choice(lowest_scoring_taxons)
-
-    return None
+async def aget_or_create_session_id(request):
+    if not await request.session.aget("user_session_id"):
+        await request.session.aset("user_session_id", secrets.token_urlsafe(32))
+    return await request.session.aget("user_session_id")
 
 
 def index(request):
@@ -83,10 +83,7 @@ def index(request):
 
     # No dataset selected: show the dataset selector widget
     if not dataset:
-        datasets = list(
-            Taxon.objects.values_list("dataset", flat=True).distinct().order_by("dataset")
-        )
-        return render(request, "taxons/index.html", {"datasets": datasets})
+        return render(request, "taxons/index.html", {"datasets": get_catalog().datasets()})
 
     # Reset session when dataset changes
     if dataset != request.session.get("current_dataset", ""):
@@ -107,7 +104,7 @@ def index(request):
     request.session.pop("current_score", None)
     request.session.pop("current_song_id", None)
 
-    taxon = get_next_taxon(session_id, dataset=dataset, category=category)
+    taxon = get_strategy().next_taxon(session_id, dataset=dataset, category=category)
     if not taxon:
         return render(request, "taxons/index.html", {
             "error": "No taxons available.",
@@ -116,63 +113,18 @@ def index(request):
     request.session["current_taxon_id"] = taxon.id
     request.session["current_score"] = 10
 
-    # Generate propositions filtered to this dataset (and category)
-    base_qs = Taxon.objects.filter(dataset=dataset)
-    if category:
-        base_qs = base_qs.filter(category=category)
-
-    wrong_choices = []
-    if taxon.genre:
-        wrong_choices.extend(list(base_qs.filter(genre=taxon.genre).exclude(id=taxon.id)))
-    if len(wrong_choices) < 3 and taxon.famille:
-        wrong_choices.extend(list(
-            base_qs.filter(famille=taxon.famille)
-            .exclude(id=taxon.id)
-            .exclude(id__in=[t.id for t in wrong_choices])
-        ))
-    if len(wrong_choices) < 3 and taxon.ordre:
-        wrong_choices.extend(list(
-            base_qs.filter(ordre=taxon.ordre)
-            .exclude(id=taxon.id)
-            .exclude(id__in=[t.id for t in wrong_choices])
-        ))
-    if len(wrong_choices) < 3 and taxon.classe:
-        wrong_choices.extend(list(
-            base_qs.filter(classe=taxon.classe)
-            .exclude(id=taxon.id)
-            .exclude(id__in=[t.id for t in wrong_choices])
-        ))
-    if len(wrong_choices) < 3 and taxon.embranchement:
-        wrong_choices.extend(list(
-            base_qs.filter(embranchement=taxon.embranchement)
-            .exclude(id=taxon.id)
-            .exclude(id__in=[t.id for t in wrong_choices])
-        ))
-    if len(wrong_choices) < 3:
-        wrong_choices.extend(list(
-            base_qs.exclude(id=taxon.id)
-            .exclude(id__in=[t.id for t in wrong_choices])
-            .order_by("?")
-        ))
-
-    selected_wrong = random.sample(wrong_choices, min(3, len(wrong_choices)))
+    # Propositions: closest taxa of this dataset (and category), from the precomputed index
+    selected_wrong = pick_distractors(taxon, category=category)
     propositions = [taxon.nom_vernaculaire] + [t.nom_vernaculaire for t in selected_wrong]
     random.shuffle(propositions)
 
     # Answer dropdown: all nom_vernaculaire in this dataset/category, alphabetical
-    nv_qs = Taxon.objects.filter(dataset=dataset)
-    if category:
-        nv_qs = nv_qs.filter(category=category)
-    nom_vernaculaire_list = list(nv_qs.order_by("nom_vernaculaire").values_list("nom_vernaculaire", flat=True))
+    catalog = get_catalog()
+    nom_vernaculaire_list = catalog.names(dataset, category)
 
     top_scores, bottom_scores, has_gap, bottom_start_rank = get_score_lists(session_id, dataset=dataset, category=category)
 
-    existing_categories = set(
-        Taxon.objects.filter(dataset=dataset)
-        .exclude(category="")
-        .values_list("category", flat=True)
-        .distinct()
-    )
+    existing_categories = catalog.categories(dataset)
     categories = [c for c in CATEGORIES if c in existing_categories]
 
     return render(
@@ -193,185 +145,66 @@ def index(request):
     )
 
 
-def fetch_images_for_taxon(taxon):
-    if taxon.inaturalist_taxon_id is not None:
-        taxon_id = taxon.inaturalist_taxon_id
-    else:
-        if taxon.espece and "spp." not in taxon.espece and "ssp." not in taxon.espece:
-            scientific_name = f"{taxon.genre} {taxon.espece}"
-        elif taxon.genre:
-            scientific_name = taxon.genre
-        elif taxon.famille:
-            scientific_name = taxon.famille
-        elif taxon.ordre:
-            scientific_name = taxon.ordre
-        elif taxon.classe:
-            scientific_name = taxon.classe
-        elif taxon.embranchement:
-            scientific_name = taxon.embranchement
-        elif taxon.regne:
-            scientific_name = taxon.regne
-        else:
-            return
-
-        try:
-            taxa_resp = requests_session().get(
-                "https://api.inaturalist.org/v1/taxa/autocomplete",
-                params={"q": scientific_name, "per_page": 1},
-                timeout=10,
-            ).json()
-            taxa_results = taxa_resp.get("results", [])
-            if not taxa_results:
-                return
-            taxon_id = taxa_results[0]["id"]
-        except Exception as e:
-            print(f"Error looking up iNaturalist taxon for {scientific_name}: {e}", flush=True)
-            return
-
-    def _fetch_obs(place_id):
-        resp = requests_session().get(
-            "https://api.inaturalist.org/v1/observations",
-            params={
-                "taxon_id": taxon_id,
-                "place_id": place_id,
-                "quality_grade": "research",
-                "photos": "true",
-                "per_page": 30,
-            },
-            timeout=15,
-        ).json()
-        return resp.get("results", [])
-
-    try:
-        observations = _fetch_obs(7008)  # Belgium
-        if len(observations) < 4:
-            france_obs = _fetch_obs(6753)  # France
-            observations = observations + france_obs
-        seen_urls = set()
-        for obs in observations:
-            photos = obs.get("photos", [])
-            if not photos:
-                continue
-            photo = photos[0]
-            square_url = photo.get("url", "")
-            if not square_url:
-                continue
-            medium_url = square_url.replace("/square.", "/medium.")
-            if medium_url in seen_urls:
-                continue
-            seen_urls.add(medium_url)
-            taxon.search_results.create(
-                title=photo.get("attribution", "")[:300],
-                link=medium_url,
-                image_context_link=obs.get("uri", ""),
-            )
-    except Exception as e:
-        print(f"Error fetching iNaturalist observations for {taxon.nom_vernaculaire}: {e}", flush=True)
-
-
-def fetch_sounds_for_taxon(taxon):
-    if taxon.espece and "spp." not in taxon.espece and "ssp." not in taxon.espece:
-        species_query = f"gen:{taxon.genre} sp:{taxon.espece}"
-    elif taxon.genre:
-        species_query = f"gen:{taxon.genre}"
-    else:
-        return
-
-    queries = [
-        f"{species_query} cnt:Belgium type:song",
-        f"{species_query} cnt:Belgium",
-        f"{species_query} cnt:France type:song",
-        f"{species_query} cnt:France",
-    ]
-
-    try:
-        resp = None
-        for query in queries:
-            resp = requests_session().get(
-                "https://xeno-canto.org/api/3/recordings",
-                params={"query": query, "key": settings.XENOCANTO_API_KEY},
-                timeout=15,
-            ).json()
-            if resp.get("recordings"):
-                break
-        for recording in resp.get("recordings", [])[:30]:
-            file_url = recording.get("file", "")
-            if not file_url:
-                continue
-            loc = recording.get("loc", "")
-            rec = recording.get("rec", "")
-            length = recording.get("length", "")
-            attribution = f"{rec} — {loc} ({length})"
-            taxon.search_results.create(
-                title=attribution[:300],
-                link=file_url,
-                image_context_link=recording.get("url", ""),
-            )
-    except Exception as e:
-        print(f"Error fetching Xeno-canto sounds for {taxon.nom_vernaculaire}: {e}", flush=True)
-
-
-def get_photos_for_taxon(taxon, count=4, already_shown_ids=None):
+async def aget_photos_for_taxon(taxon, count=4, already_shown_ids=None):
     """Return up to `count` photos for a taxon without touching scores.
 
     Keeps already-shown photos first, then adds random extras to reach `count`.
     """
-    if not taxon.search_results.exists():
-        if taxon.classe == "Aves":
-            fetch_sounds_for_taxon(taxon)
-        fetch_images_for_taxon(taxon)
-    photos_qs = taxon.search_results.exclude(image_context_link__contains="xeno-canto")
+    await aensure_media(taxon)
+    photos_qs = media_of_kind(taxon, SearchResult.PHOTO)
     result = []
     if already_shown_ids:
-        result = list(photos_qs.filter(id__in=already_shown_ids))
+        result = [p async for p in photos_qs.filter(id__in=already_shown_ids)]
     remaining = count - len(result)
     if remaining > 0:
-        extra_ids = [p.id for p in result]
-        result += list(photos_qs.exclude(id__in=extra_ids).order_by("?")[:remaining])
+        result += await asample_media(taxon, SearchResult.PHOTO, remaining, exclude_ids=[p.id for p in result])
     return result
 
 
-def render_images_grid(request, taxon_id):
-    taxon = Taxon.objects.get(id=taxon_id)
+async def render_images_grid(request, taxon_id):
+    taxon = await Taxon.objects.aget(id=taxon_id)
     is_bird = taxon.classe == "Aves"
 
-    if not taxon.search_results.exists():
-        if is_bird:
-            fetch_sounds_for_taxon(taxon)
-        fetch_images_for_taxon(taxon)
+    with outbound_budget(settings.OUTBOUND_BUDGET_SECONDS):
+        await aensure_media(taxon)
 
-    if not taxon.search_results.exists():
+    if not has_media(taxon):
+        if await sync_to_async(media_fetch_in_progress)(taxon):
+            # Another request is still fetching this taxon: don't query the providers a second time
+            return HttpResponse("<p>📷 Recherche des photos en cours, réessayez dans quelques secondes.</p>")
+        if not await sync_to_async(provider_available)("inaturalist"):
+            # Placeholder swapped in by htmx while the provider's circuit is open
+            return HttpResponse("<p>📷 Les photos sont momentanément indisponibles, réessayez dans une minute.</p>")
         return HttpResponse(f"Aucun résultat trouvé pour ce taxon (id={taxon.id}).", status=404)
 
-    photos = taxon.search_results.exclude(image_context_link__contains="xeno-canto")
-
     if request.method == "POST":
-        if "current_score" in request.session:
-            request.session["current_score"] -= 2
+        if await request.session.ahas_key("current_score"):
+            await request.session.aset("current_score", await request.session.aget("current_score") - 2)
 
-        search_results_ids = request.session.setdefault("search_results_ids", [])
+        search_results_ids = await request.session.asetdefault("search_results_ids", [])
         current_count = len(search_results_ids)
         if current_count == 1:
-            more_images = photos.exclude(id__in=search_results_ids).order_by("?")[:1]
+            more_images = await asample_media(taxon, SearchResult.PHOTO, 1, exclude_ids=search_results_ids)
         elif current_count == 2:
-            more_images = photos.exclude(id__in=search_results_ids).order_by("?")[:2]
+            more_images = await asample_media(taxon, SearchResult.PHOTO, 2, exclude_ids=search_results_ids)
         else:
             more_images = []
-        request.session["search_results_ids"].extend([img.id for img in more_images])
+        search_results_ids.extend([img.id for img in more_images])
         request.session.modified = True
     else:
-        first_photo = photos.order_by("?").first()
-        request.session["search_results_ids"] = [first_photo.id] if first_photo else []
+        first_photo = await asample_media(taxon, SearchResult.PHOTO, 1)
+        await request.session.aset("search_results_ids", [photo.id for photo in first_photo])
         if is_bird:
-            song = taxon.search_results.filter(image_context_link__contains="xeno-canto").order_by("?").first()
+            song = await asample_media(taxon, SearchResult.AUDIO, 1)
             if song:
-                request.session["current_song_id"] = song.id
+                await request.session.aset("current_song_id", song[0].id)
 
     song = None
     if is_bird:
-        song = SearchResult.objects.filter(id=request.session.get("current_song_id")).first()
+        song = await SearchResult.objects.filter(id=await request.session.aget("current_song_id")).afirst()
 
-    images = SearchResult.objects.filter(id__in=request.session["search_results_ids"], taxon=taxon)
+    search_results_ids = await request.session.aget("search_results_ids")
+    images = [img async for img in SearchResult.objects.filter(id__in=search_results_ids, species_id=taxon.species_id)]
     return render(request, "taxons/images_grid.html", {
         "images": images,
         "song": song,
@@ -380,44 +213,55 @@ def render_images_grid(request, taxon_id):
     })
 
 
-def render_result(request):
-    session_id = get_or_create_session_id(request)
-    category = request.session.get("current_category", "")
-    dataset = request.session.get("current_dataset", "")
+async def render_result(request):
+    session_id = await aget_or_create_session_id(request)
+    category = await request.session.aget("current_category", "")
+    dataset = await request.session.aget("current_dataset", "")
+    strategy = get_strategy()
     taxon = None
     guessed_taxon = None
     result = {}
 
-    taxon_id = request.session.get("current_taxon_id")
+    taxon_id = await request.session.aget("current_taxon_id")
     if taxon_id:
-        taxon = Taxon.objects.get(id=taxon_id)
+        taxon = await Taxon.objects.select_related("version").aget(id=taxon_id)
+        if not taxon.version.active:
+            # The dataset was re-imported while the question was shown: score the taxon of the active version
+            taxon = await Taxon.objects.active().filter(
+                dataset=taxon.dataset, nom_vernaculaire=taxon.nom_vernaculaire
+            ).afirst() or taxon
         user_answer = request.POST.get("answer", "").strip().lower()
         correct_answer = taxon.nom_vernaculaire.strip().lower()
 
         if not user_answer:
             result = {}
         elif user_answer == correct_answer:
-            current_score = request.session.get("current_score", 10)
-            user_score, created = UserScore.objects.get_or_create(
+            current_score = await request.session.aget("current_score", 10)
+            user_score, created = await UserScore.objects.aget_or_create(
                 session_id=session_id, taxon=taxon, defaults={"score": current_score}
             )
             if not created:
                 user_score.score += current_score
-                user_score.save()
+                await user_score.asave()
+            await sync_to_async(strategy.record_answer)(session_id, taxon, correct=True)
             result = {
                 "class": "correct",
                 "message": f"✅ Correct ! C'est bien {taxon.nom_vernaculaire}" + (f" ({taxon.genre} {taxon.espece})" if taxon.espece else ""),
             }
         else:
-            guessed_taxon = Taxon.objects.filter(nom_vernaculaire=request.POST.get("answer", "").strip()).first()
+            guessed_taxon = await Taxon.objects.active().filter(
+                nom_vernaculaire=request.POST.get("answer", "").strip()
+            ).afirst()
             if guessed_taxon:
-                user_score, created = UserScore.objects.get_or_create(
+                user_score, created = await UserScore.objects.aget_or_create(
                     session_id=session_id, taxon=guessed_taxon, defaults={"score": 0}
                 )
                 if not created:
                     user_score.score = max(0, user_score.score - 5)
-                    user_score.save()
-            UserScore.objects.get_or_create(session_id=session_id, taxon=taxon, defaults={"score": 0})
+                    await user_score.asave()
+                await sync_to_async(strategy.record_answer)(session_id, guessed_taxon, correct=False)
+            await UserScore.objects.aget_or_create(session_id=session_id, taxon=taxon, defaults={"score": 0})
+            await sync_to_async(strategy.record_answer)(session_id, taxon, correct=False)
             result = {
                 "class": "incorrect",
                 "message": f"❌ Incorrect. La réponse était : {taxon.nom_vernaculaire}" + (f" ({taxon.genre} {taxon.espece})" if taxon.espece else ""),
@@ -429,21 +273,32 @@ def render_result(request):
         }
 
     # After a real answer, fetch photos for the correct taxon (no score impact)
-    # and for the guessed (wrong) taxon if applicable.
-    correct_photos = []
-    guessed_photos = []
-    guessed_song = None
-    if result and taxon:
-        already_shown = request.session.get("search_results_ids", [])
-        correct_photos = get_photos_for_taxon(taxon, already_shown_ids=already_shown)
-    if result.get("class") == "incorrect" and guessed_taxon:
-        guessed_photos = get_photos_for_taxon(guessed_taxon)
+    # and for the guessed (wrong) taxon if applicable, concurrently.
+    async def _correct_photos():
+        already_shown = await request.session.aget("search_results_ids", [])
+        return await aget_photos_for_taxon(taxon, already_shown_ids=already_shown)
+
+    async def _guessed_photos():
+        photos = await aget_photos_for_taxon(guessed_taxon)
+        song = None
         if guessed_taxon.classe == "Aves":
-            guessed_song = guessed_taxon.search_results.filter(
-                image_context_link__contains="xeno-canto"
-            ).order_by("?").first()
+            songs = await asample_media(guessed_taxon, SearchResult.AUDIO, 1)
+            song = songs[0] if songs else None
+        return photos, song
 
-    top_scores, bottom_scores, has_gap, bottom_start_rank = get_score_lists(session_id, dataset=dataset, category=category)
+    fetches = {}
+    if result and taxon:
+        fetches["correct"] = _correct_photos()
+    if result.get("class") == "incorrect" and guessed_taxon:
+        fetches["guessed"] = _guessed_photos()
+    with outbound_budget(settings.OUTBOUND_BUDGET_SECONDS):
+        fetched = dict(zip(fetches, await asyncio.gather(*fetches.values())))
+    correct_photos = fetched.get("correct", [])
+    guessed_photos, guessed_song = fetched.get("guessed", ([], None))
+
+    top_scores, bottom_scores, has_gap, bottom_start_rank = await sync_to_async(get_score_lists)(
+        session_id, dataset=dataset, category=category
+    )
     result_html = render_to_string(
         "taxons/result.html",
         {
@@ -482,3 +337,22 @@ def skip_question(request):
     request.session.pop("search_results_ids", None)
     request.session.pop("current_score", None)
     return HttpResponse(status=200, headers={"HX-Refresh": "true"})
+
+
+def serve_mirror(request, name):
+    if not mirror_enabled():
+        raise Http404
+    path = mirror_file(name)
+    if not os.path.exists(path):
+        raise Http404
+    touch(name)
+    if settings.MEDIA_MIRROR_ACCEL_PREFIX:
+        response = HttpResponse(
+            content_type=mimetypes.guess_type(name)[0],
+            headers={"X-Accel-Redirect": settings.MEDIA_MIRROR_ACCEL_PREFIX + name},
+        )
+    else:
+        response = FileResponse(open(path, "rb"))
+    # Names are hashes of the provider URL, and a provider photo URL always serves the same image
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response